@@ -0,0 +1,539 @@
+# benchmark.py
+# Sintetik ma'lumotlar generatori va yuklama testi (API jarayon ichida, httpx ASGITransport orqali)
+#
+# 1) Ma'lumot yaratish (default: 100k mahsulot, 5M sotuv qatori, 1M audit yozuvi):
+#    python benchmark.py generate --database-url sqlite+aiosqlite:///bench.db
+#    python benchmark.py generate --database-url sqlite+aiosqlite:///bench.db --scale 0.01   # tezkor kichik to'plam
+# 2) Yuklama (kassalar + dashboardlar), natija endpointlar bo'yicha p50/p95/p99:
+#    python benchmark.py run --database-url sqlite+aiosqlite:///bench.db --duration 60 --registers 20 --json base.json
+# 3) Deploydan oldin solishtirish (p95 ruxsat etilgandan ko'p yomonlashsa exit code 1):
+#    python benchmark.py run --database-url ... --baseline base.json --max-regression 0.2
+# 4) Katta ro'yxatlar serializatsiyasi: ORM + pydantic va ustunli tezkor yo'l (qator/s):
+#    python benchmark.py serialize --database-url sqlite+aiosqlite:///bench.db
+#
+# Diqqat: ishlab turgan bazaga qarshi ishlatmang - generate jadvallarga yozadi.
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Kassa API benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="Sintetik ma'lumotlar yaratish")
+    gen.add_argument("--database-url", required=True)
+    gen.add_argument("--products", type=int, default=100_000)
+    gen.add_argument("--sale-items", type=int, default=5_000_000)
+    gen.add_argument("--audit", type=int, default=1_000_000)
+    gen.add_argument("--clients", type=int, default=20_000)
+    gen.add_argument("--cashiers", type=int, default=20)
+    gen.add_argument("--days", type=int, default=365, help="Savdolar shu kunlar oralig'iga taqsimlanadi")
+    gen.add_argument("--scale", type=float, default=1.0, help="Barcha hajmlarni shu koeffitsientga ko'paytirish")
+    gen.add_argument("--seed", type=int, default=42)
+
+    run = sub.add_parser("run", help="Yuklama testini ishga tushirish")
+    run.add_argument("--database-url", required=True)
+    run.add_argument("--duration", type=float, default=30, help="Soniya")
+    run.add_argument("--registers", type=int, default=10, help="Bir vaqtda ishlayotgan kassalar")
+    run.add_argument("--dashboards", type=int, default=2, help="Bir vaqtda ochiq dashboardlar (admin)")
+    run.add_argument("--think-ms", type=float, default=100, help="Kassadagi amallar orasidagi pauza")
+    run.add_argument("--seed", type=int, default=42)
+    run.add_argument("--json", help="Natijani JSON faylga yozish")
+    run.add_argument("--baseline", help="Avvalgi natija (JSON) bilan solishtirish")
+    run.add_argument("--max-regression", type=float, default=0.2, help="p95 uchun ruxsat etilgan o'sish (0.2 = 20%%)")
+
+    ser = sub.add_parser("serialize", help="Ro'yxat endpointlari: ORM + pydantic va tezkor JSON yo'lini solishtirish")
+    ser.add_argument("--database-url", required=True)
+    ser.add_argument("--repeat", type=int, default=5, help="Har bir o'lchov necha marta takrorlanadi (eng yaxshisi olinadi)")
+    ser.add_argument("--sales-limit", type=int, default=1000, help="GET /sales/ sahifa hajmi")
+    ser.add_argument("--json", help="Natijani JSON faylga yozish")
+    return parser.parse_args()
+
+
+import numpy as np
+from sqlalchemy import insert, select, func, text
+
+engine = init_db = SessionLocal = None
+Employee = Category = Supplier = Product = Client = Sale = SaleItem = AuditLog = StockMove = Expense = phone_key = name_key = None
+
+
+def _load_app(database_url: str):
+    """Ilova modullari DATABASE_URL ni import paytida o'qiydi - shuning uchun env o'rnatilgandan keyin yuklanadi"""
+    global engine, init_db, SessionLocal, Employee, Category, Supplier, Product, Client
+    global Sale, SaleItem, AuditLog, StockMove, Expense, phone_key, name_key
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark-token")
+    os.environ.setdefault("RUN_BOT_IN_API", "false")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from database import (
+        engine, init_db, SessionLocal, Employee, Category, Supplier, Product, Client,
+        Sale, SaleItem, AuditLog, StockMove, Expense, phone_key, name_key
+    )
+
+CHUNK = 20_000
+PAYMENT_METHODS = ["cash", "cash", "cash", "card", "card", "transfer"]
+AUDIT_ACTIONS = ["YANGI_SOTUV", "MAHSULOT_TAHRIR", "KIRIM", "SMENA_OCHILDI", "SMENA_YOPILDI", "QAYTARISH", "TIZIMGA_KIRISH"]
+
+
+# --- GENERATE ---
+
+async def _bulk(table, rows):
+    if rows:
+        async with engine.begin() as conn:
+            await conn.execute(insert(table), rows)
+
+
+async def _next_id(model) -> int:
+    async with SessionLocal() as db:
+        return (await db.scalar(select(func.max(model.id)))) or 0
+
+
+async def _sync_sequences(models):
+    """Aniq id bilan yozilgan jadvallarda PostgreSQL sequence'larini MAX(id) ga suradi.
+    Aks holda ilovaning keyingi INSERT lari (POST /sales/, yangi mahsulot/mijoz) duplicate key bilan yiqiladi."""
+    if engine.url.get_backend_name() != "postgresql":
+        return
+    async with engine.begin() as conn:
+        for model in models:
+            table = model.__tablename__
+            await conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table}), 1))"
+            ))
+
+
+async def generate(a):
+    from core import get_password_hash
+
+    scale = a.scale
+    n_products = max(int(a.products * scale), 10)
+    n_items = int(a.sale_items * scale)
+    n_audit = int(a.audit * scale)
+    n_clients = max(int(a.clients * scale), 10)
+    rng = np.random.default_rng(a.seed)
+    now = datetime.now()
+    started = time.perf_counter()
+
+    await init_db()
+    password = get_password_hash("bench")
+
+    # Xodimlar: admin + kassirlar
+    async with SessionLocal() as db:
+        existing = set((await db.execute(select(Employee.username).where(Employee.username.like("bench_%")))).scalars())
+    employees = [{"username": "bench_admin", "hashed_password": password, "role": "admin", "permissions": "all",
+                  "is_active": True, "full_name": "Bench Admin"}]
+    employees += [{"username": f"bench_kassir_{i}", "hashed_password": password, "role": "cashier", "permissions": "pos",
+                   "is_active": True, "full_name": f"Kassir {i}"} for i in range(a.cashiers)]
+    await _bulk(Employee, [e for e in employees if e["username"] not in existing])
+    async with SessionLocal() as db:
+        cashier_ids = np.array((await db.execute(
+            select(Employee.id).where(Employee.username.like("bench_kassir_%")).order_by(Employee.id)
+        )).scalars().all())
+        admin_id = await db.scalar(select(Employee.id).where(Employee.username == "bench_admin"))
+
+    # Kategoriya va firmalar
+    cat_start, sup_start = await _next_id(Category), await _next_id(Supplier)
+    await _bulk(Category, [{"id": cat_start + i + 1, "name": f"Bench kategoriya {cat_start + i + 1}"} for i in range(50)])
+    await _bulk(Supplier, [{"id": sup_start + i + 1, "name": f"Bench firma {sup_start + i + 1}", "balance": 0}
+                           for i in range(200)])
+
+    # Mahsulotlar
+    prod_start = await _next_id(Product)
+    buy = np.round(rng.lognormal(9.5, 0.8, n_products), -2)
+    for lo in range(0, n_products, CHUNK):
+        hi = min(lo + CHUNK, n_products)
+        await _bulk(Product, [{
+            "id": prod_start + i + 1,
+            "name": f"Mahsulot {prod_start + i + 1}",
+            "barcode": f"bench{prod_start + i + 1:010d}",
+            "buy_price": float(buy[i]),
+            "sell_price": float(round(buy[i] * 1.25, -2)),
+            "stock": 1_000_000.0,  # Yuklama testida qoldiq tugamasligi uchun
+            "unit": "dona",
+            "category_id": cat_start + 1 + i % 50,
+            "supplier_id": sup_start + 1 + i % 200,
+            "is_favorite": i < 20,
+        } for i in range(lo, hi)])
+    print(f"  mahsulotlar: {n_products}")
+
+    # Mijozlar
+    client_start = await _next_id(Client)
+    for lo in range(0, n_clients, CHUNK):
+        hi = min(lo + CHUNK, n_clients)
+        rows = []
+        for i in range(lo, hi):
+            phone = f"+99890{client_start + i + 1:07d}"
+            name = f"Mijoz {client_start + i + 1}"
+            # Core insert @validates ni chaqirmaydi - qidiruv kalitlari shu yerda to'ldiriladi
+            rows.append({"id": client_start + i + 1, "name": name, "name_key": name_key(name), "phone": phone,
+                         "phone_key": phone_key(phone), "balance": 0.0, "bonus_balance": 0.0, "created_at": now})
+        await _bulk(Client, rows)
+    print(f"  mijozlar: {n_clients}")
+
+    # Sotuvlar va sotuv qatorlari (mashhur mahsulotlar ko'proq sotiladi - Zipf)
+    sale_id = await _next_id(Sale)
+    item_id = await _next_id(SaleItem)
+    remaining = n_items
+    span = a.days * 86400
+    while remaining > 0:
+        # Har bir chekda 1-7 qator (o'rtacha 4)
+        counts = rng.integers(1, 8, max(min(CHUNK // 4, remaining // 4), 1))
+        counts = counts[np.cumsum(counts) <= remaining]
+        if counts.size == 0:
+            counts = np.array([remaining])
+        n_sales = counts.size
+        total = int(counts.sum())
+        product_idx = (rng.zipf(1.3, total) - 1) % n_products
+        qty = rng.integers(1, 4, total).astype(float)
+        price = np.round(buy[product_idx] * 1.25, -2)
+        offsets = np.sort(rng.integers(0, span, n_sales))[::-1]
+        sale_of_item = np.repeat(np.arange(n_sales), counts)
+        totals = np.bincount(sale_of_item, weights=qty * price, minlength=n_sales)
+        cashiers = rng.choice(cashier_ids, n_sales)
+        with_client = rng.random(n_sales) < 0.2
+        clients = rng.integers(client_start + 1, client_start + n_clients + 1, n_sales)
+
+        sales = []
+        for s in range(n_sales):
+            method = PAYMENT_METHODS[s % len(PAYMENT_METHODS)]
+            amount = float(totals[s])
+            sales.append({
+                "id": sale_id + s + 1,
+                "created_at": now - timedelta(seconds=int(offsets[s])),
+                "total_amount": amount,
+                "payment_method": method,
+                "cashier_id": int(cashiers[s]),
+                "client_id": int(clients[s]) if with_client[s] else None,
+                "status": "completed",
+                "cash_amount": amount if method == "cash" else 0.0,
+                "card_amount": amount if method == "card" else 0.0,
+                "transfer_amount": amount if method == "transfer" else 0.0,
+                "debt_amount": 0.0, "bonus_earned": 0.0, "bonus_spent": 0.0,
+            })
+        items = [{
+            "id": item_id + j + 1,
+            "sale_id": sale_id + int(sale_of_item[j]) + 1,
+            "product_id": prod_start + int(product_idx[j]) + 1,
+            "quantity": float(qty[j]),
+            "price": float(price[j]),
+        } for j in range(total)]
+        moves = [{
+            "product_id": it["product_id"], "quantity": -it["quantity"], "type": "sale",
+            "reason": f"Sotuv #{it['sale_id']}", "created_by": sales[int(sale_of_item[j])]["cashier_id"],
+            "created_at": sales[int(sale_of_item[j])]["created_at"],
+        } for j, it in enumerate(items) if j % 10 == 0]
+
+        await _bulk(Sale, sales)
+        await _bulk(SaleItem, items)
+        await _bulk(StockMove, moves)
+        sale_id += n_sales
+        item_id += total
+        remaining -= total
+        done = n_items - remaining
+        print(f"\r  sotuv qatorlari: {done}/{n_items}", end="", flush=True)
+    print()
+
+    # Audit jurnali
+    for lo in range(0, n_audit, CHUNK):
+        hi = min(lo + CHUNK, n_audit)
+        offsets = rng.integers(0, span, hi - lo)
+        await _bulk(AuditLog, [{
+            "user_id": int(cashier_ids[i % len(cashier_ids)]) if i % 5 else admin_id,
+            "action": AUDIT_ACTIONS[i % len(AUDIT_ACTIONS)],
+            "details": f"Bench yozuv #{i}",
+            "created_at": now - timedelta(seconds=int(offsets[i - lo])),
+        } for i in range(lo, hi)])
+        print(f"\r  audit: {hi}/{n_audit}", end="", flush=True)
+    print()
+
+    await _bulk(Expense, [{
+        "reason": f"Xarajat {i}", "category": "Boshqa", "amount": float(rng.integers(10, 500) * 1000),
+        "created_at": now - timedelta(seconds=int(rng.integers(0, span))), "created_by": admin_id,
+    } for i in range(max(int(5000 * scale), 10))])
+
+    await _sync_sequences([Category, Supplier, Product, Client, Sale, SaleItem])
+    async with engine.begin() as conn:
+        await conn.execute(text("ANALYZE"))
+    print(f"Tayyor: {time.perf_counter() - started:.0f} s")
+
+
+# --- RUN ---
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}  # label -> [soniya]
+        self.errors = {}
+
+    def add(self, label: str, seconds: float, ok: bool):
+        self.samples.setdefault(label, []).append(seconds)
+        if not ok:
+            self.errors[label] = self.errors.get(label, 0) + 1
+
+    def report(self, elapsed: float) -> dict:
+        result = {}
+        for label, values in sorted(self.samples.items()):
+            arr = np.array(values) * 1000
+            result[label] = {
+                "count": len(values),
+                "errors": self.errors.get(label, 0),
+                "rps": round(len(values) / elapsed, 2),
+                "p50_ms": round(float(np.percentile(arr, 50)), 2),
+                "p95_ms": round(float(np.percentile(arr, 95)), 2),
+                "p99_ms": round(float(np.percentile(arr, 99)), 2),
+                "max_ms": round(float(arr.max()), 2),
+            }
+        return result
+
+
+async def _call(client, recorder, label, method, url, **kwargs):
+    started = time.perf_counter()
+    ok = False
+    try:
+        response = await client.request(method, url, **kwargs)
+        ok = response.status_code < 400
+        return response
+    except Exception:
+        return None
+    finally:
+        recorder.add(label, time.perf_counter() - started, ok)
+
+
+async def register_loop(client, recorder, headers, key_prefix, products, deadline, think, rng):
+    """Bitta kassa: katalogni yuklaydi, smena ochadi, keyin ketma-ket sotuv qiladi"""
+    await _call(client, recorder, "GET /inventory/products", "GET", "/inventory/products", headers=headers)
+    await _call(client, recorder, "GET /pos/shifts/active", "GET", "/pos/shifts/active", headers=headers)
+    await client.post("/pos/shifts/open", json={"opening_balance": 0}, headers=headers)
+    n = 0
+    while time.perf_counter() < deadline:
+        basket = rng.sample(products, rng.randint(1, 6))
+        items = [{"product_id": pid, "quantity": 1, "price": price} for pid, price in basket]
+        total = sum(i["price"] for i in items)
+        await _call(client, recorder, "POST /sales/", "POST", "/sales/", headers={**headers, "Idempotency-Key": f"{key_prefix}-{n}"},
+                    json={"total_amount": total, "payment_method": "cash", "cash_amount": total, "items": items})
+        n += 1
+        if n % 5 == 0:
+            await _call(client, recorder, "GET /inventory/products?query", "GET", "/inventory/products",
+                        params={"query": f"Mahsulot {rng.choice(products)[0]}"}, headers=headers)
+        if n % 10 == 0:
+            await _call(client, recorder, "GET /sales/", "GET", "/sales/", params={"limit": 20}, headers=headers)
+        if think:
+            await asyncio.sleep(think)
+
+
+async def dashboard_loop(client, recorder, headers, deadline):
+    """Admin dashboardi: hisobotlarni aylana bo'yicha yangilaydi"""
+    month_ago = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
+    pages = [
+        ("GET /finance/stats", "/finance/stats", {}),
+        ("GET /finance/dashboard-chart", "/finance/dashboard-chart", {}),
+        ("GET /finance/profit-chart?days=90", "/finance/profit-chart", {"days": 90}),
+        ("GET /finance/top-products", "/finance/top-products", {"start_date": month_ago}),
+        ("GET /finance/employee-performance", "/finance/employee-performance", {"start_date": month_ago}),
+        ("GET /audit/logs", "/audit/logs", {"limit": 100}),
+        ("GET /crm/clients", "/crm/clients", {}),
+    ]
+    i = 0
+    while time.perf_counter() < deadline:
+        label, url, params = pages[i % len(pages)]
+        await _call(client, recorder, label, "GET", url, params=params, headers=headers)
+        i += 1
+
+
+async def run(a):
+    import httpx
+    import uuid
+    from core import create_access_token
+    import main
+    from utils.settings_provider import settings_provider
+
+    await init_db()
+    await settings_provider.load()
+    async with SessionLocal() as db:
+        cashiers = (await db.execute(
+            select(Employee.username).where(Employee.username.like("bench_kassir_%")).order_by(Employee.id)
+        )).scalars().all()
+        # Kassalar eng ko'p sotiladigan mahsulotlarni urishadi
+        hot = (await db.execute(select(Product.id, Product.sell_price).order_by(Product.id).limit(2000))).all()
+    if not cashiers or not hot:
+        sys.exit("Ma'lumot topilmadi. Avval: python benchmark.py generate --database-url ...")
+
+    rng = random.Random(a.seed)
+    run_id = uuid.uuid4().hex[:8]  # Idempotency kalitlari avvalgi yugurishlar bilan to'qnashmasligi uchun
+    products = [(pid, price) for pid, price in hot]
+
+    def auth(username):
+        return {"Authorization": "Bearer " + create_access_token({"sub": username}, timedelta(hours=12))}
+
+    transport = httpx.ASGITransport(app=main.app)
+    recorder = Recorder()
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        deadline = time.perf_counter() + a.duration
+        started = time.perf_counter()
+        tasks = [
+            register_loop(client, recorder, auth(cashiers[i % len(cashiers)]), f"bench-{run_id}-{i}", products, deadline,
+                          a.think_ms / 1000, random.Random(rng.random()))
+            for i in range(a.registers)
+        ]
+        tasks += [dashboard_loop(client, recorder, auth("bench_admin"), deadline) for _ in range(a.dashboards)]
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    endpoints = recorder.report(elapsed)
+    total = sum(e["count"] for e in endpoints.values())
+    print(f"\n{'Endpoint':<40} {'soni':>7} {'xato':>5} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for label, e in endpoints.items():
+        print(f"{label:<40} {e['count']:>7} {e['errors']:>5} {e['rps']:>8} "
+              f"{e['p50_ms']:>8.1f}ms {e['p95_ms']:>7.1f}ms {e['p99_ms']:>7.1f}ms {e['max_ms']:>7.1f}ms")
+    print(f"\nJami: {total} so'rov, {total / elapsed:.1f} so'rov/s, {elapsed:.1f} s, "
+          f"{a.registers} kassa + {a.dashboards} dashboard")
+
+    result = {
+        "meta": {"date": datetime.now().isoformat(timespec="seconds"), "database": engine.url.get_backend_name(),
+                 "duration": round(elapsed, 2), "registers": a.registers, "dashboards": a.dashboards,
+                 "throughput_rps": round(total / elapsed, 2)},
+        "endpoints": endpoints,
+    }
+    if a.json:
+        with open(a.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Natija saqlandi: {a.json}")
+
+    if a.baseline:
+        with open(a.baseline, encoding="utf-8") as f:
+            base = json.load(f)["endpoints"]
+        regressions = []
+        for label, e in endpoints.items():
+            b = base.get(label)
+            # Juda tez endpointlarda shovqin katta - 5 ms dan pastini solishtirmaymiz
+            if b and b["p95_ms"] >= 5 and e["p95_ms"] > b["p95_ms"] * (1 + a.max_regression):
+                regressions.append(f"  {label}: p95 {b['p95_ms']:.1f}ms -> {e['p95_ms']:.1f}ms")
+        if regressions:
+            print("\n❌ Sekinlashuv aniqlandi:\n" + "\n".join(regressions))
+            sys.exit(1)
+        print("\n✅ Baseline bilan solishtirildi: sekinlashuv yo'q")
+
+
+# --- SERIALIZE ---
+
+async def _best_of(repeat: int, fn):
+    best, body = None, None
+    for _ in range(repeat):
+        async with SessionLocal() as db:
+            started = time.perf_counter()
+            body = await fn(db)
+            elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, body
+
+
+def _normalized(body: bytes):
+    """Sale.items munosabatida tartib berilmagan - solishtirishda qatorlar id bo'yicha saralanadi"""
+    data = json.loads(body)
+    for row in data:
+        if isinstance(row.get("items"), list):
+            row["items"].sort(key=lambda item: item["id"])
+    return data
+
+
+async def serialize(a):
+    from typing import List
+    from pydantic import TypeAdapter
+    from sqlalchemy.orm import joinedload
+    from schemas import ProductOut, ClientOut, SaleOut, StockMoveOut
+    from routers.inventory import products_json, stock_logs_json
+    from routers.crm import clients_json
+    from routers.sales import sales_json
+    from utils.fast_json import orjson
+
+    def pydantic_json(schema, objects) -> bytes:
+        adapter = TypeAdapter(List[schema])
+        return adapter.dump_json(adapter.validate_python(objects, from_attributes=True))
+
+    async with SessionLocal() as db:
+        # Eng ko'p harakatli mahsulot - /inventory/logs?product_id=... uchun
+        hot_product = await db.scalar(
+            select(StockMove.product_id).group_by(StockMove.product_id).order_by(func.count().desc()).limit(1)
+        )
+    if hot_product is None:
+        sys.exit("Ma'lumot topilmadi. Avval: python benchmark.py generate --database-url ...")
+
+    sales_page = select(Sale.id).order_by(Sale.created_at.desc(), Sale.id.desc()).limit(a.sales_limit)
+
+    async def orm_products(db):
+        return pydantic_json(ProductOut, (await db.execute(select(Product))).scalars().all())
+
+    async def orm_clients(db):
+        return pydantic_json(ClientOut, (await db.execute(select(Client).order_by(Client.id))).scalars().all())
+
+    async def fast_clients(db):
+        body, _ = await clients_json(db)
+        return body
+
+    async def orm_sales(db):
+        result = await db.execute(
+            select(Sale).options(
+                joinedload(Sale.items).joinedload(SaleItem.product), joinedload(Sale.cashier), joinedload(Sale.client)
+            ).order_by(Sale.created_at.desc(), Sale.id.desc()).limit(a.sales_limit)
+        )
+        return pydantic_json(SaleOut, result.unique().scalars().all())
+
+    async def orm_logs(db):
+        result = await db.execute(
+            select(StockMove).options(joinedload(StockMove.product))
+            .where(StockMove.product_id == hot_product).order_by(StockMove.created_at.desc())
+        )
+        return pydantic_json(StockMoveOut, result.scalars().all())
+
+    cases = [
+        ("GET /inventory/products", orm_products, lambda db: products_json(db)),
+        ("GET /crm/clients", orm_clients, fast_clients),
+        (f"GET /sales/?limit={a.sales_limit}", orm_sales, lambda db: sales_json(db, sales_page)),
+        (f"GET /inventory/logs?product_id={hot_product}", orm_logs, lambda db: stock_logs_json(db, hot_product)),
+    ]
+
+    print(f"JSON: {'orjson' if orjson is not None else 'json (orjson o`rnatilmagan)'}, takror: {a.repeat}")
+    print(f"\n{'Endpoint':<40} {'qator':>7} {'ORM qator/s':>12} {'tezkor qator/s':>15} {'tezlashish':>11} {'bir xil':>8}")
+    results = {}
+    for label, orm_fn, fast_fn in cases:
+        orm_time, orm_body = await _best_of(a.repeat, orm_fn)
+        fast_time, fast_body = await _best_of(a.repeat, fast_fn)
+        rows = len(json.loads(fast_body))
+        same = _normalized(orm_body) == _normalized(fast_body)
+        results[label] = {
+            "rows": rows,
+            "orm_ms": round(orm_time * 1000, 2),
+            "fast_ms": round(fast_time * 1000, 2),
+            "orm_rows_per_s": round(rows / orm_time) if orm_time else 0,
+            "fast_rows_per_s": round(rows / fast_time) if fast_time else 0,
+            "speedup": round(orm_time / fast_time, 2) if fast_time else 0,
+            "identical": same,
+        }
+        r = results[label]
+        print(f"{label:<40} {rows:>7} {r['orm_rows_per_s']:>12} {r['fast_rows_per_s']:>15} {r['speedup']:>10}x {'ha' if same else 'YO`Q':>8}")
+
+    if a.json:
+        with open(a.json, "w", encoding="utf-8") as f:
+            json.dump({"meta": {"date": datetime.now().isoformat(timespec="seconds"), "database": engine.url.get_backend_name(),
+                                "orjson": orjson is not None, "repeat": a.repeat}, "endpoints": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"Natija saqlandi: {a.json}")
+    if not all(r["identical"] for r in results.values()):
+        sys.exit("❌ Tezkor yo'l natijasi ORM + pydantic natijasidan farq qiladi")
+
+
+def main():
+    args = parse_args()
+    _load_app(args.database_url)
+    commands = {"generate": generate, "run": run, "serialize": serialize}
+    asyncio.run(commands[args.command](args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from database import SessionLocal as AsyncSessionLocal, Client, Employee, Attendance
+from database import SessionLocal as AsyncSessionLocal, Client, Employee, Attendance, phone_key
 from datetime import datetime, timezone
 import os
 import asyncio
@@ -10,9 +10,13 @@ from aiogram.filters import CommandStart
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from sqlalchemy import select, and_
 from dotenv import load_dotenv
+from utils.cache import response_cache
+from utils.broadcast import create_broadcast, start_broadcast
+from utils.debt_reminders import send_debt_reminders
+from utils.attendance import get_employee_with_status, get_working_now
+from utils.fsm_storage import DatabaseStorage
 
 load_dotenv()
 
@@ -26,11 +30,8 @@ class Registration(StatesGroup):
 class Broadcast(StatesGroup):
     waiting_for_content = State()
 
-dp = Dispatcher(storage=MemoryStorage())
-
-def normalize_phone(phone: str) -> str:
-    """Raqamlardan boshqa hamma narsani olib tashlash"""
-    return "".join(filter(str.isdigit, str(phone)))
+# Holatlar bazada saqlanadi - qayta ishga tushganda ro'yxatdan o'tish jarayoni yo'qolmaydi
+dp = Dispatcher(storage=DatabaseStorage())
 
 # --- MENU ---
 def get_main_menu(role="client"):
@@ -63,20 +64,15 @@ def get_main_menu(role="client"):
 async def clock_in_handler(message: Message) -> None:
     logging.info(f"DEBUG: Clock-in from user_id={message.from_user.id}")
     async with AsyncSessionLocal() as db:
-        res = await db.execute(select(Employee).where(Employee.telegram_id == message.from_user.id))
-        employee = res.scalars().first()
+        # Xodim va oxirgi holati bitta so'rovda
+        employee, last_status = await get_employee_with_status(db, message.from_user.id)
         logging.info(f"DEBUG: Found employee={employee.username if employee else 'None'}")
         
         if not employee:
             await message.answer("Siz xodimlar ro'yxatida yo'qsiz!")
             return
             
-        # Oxirgi holatni tekshirish
-        stmt = select(Attendance).where(Attendance.employee_id == employee.id).order_by(Attendance.created_at.desc())
-        last_attres = await db.execute(stmt)
-        last_att = last_attres.scalars().first()
-        
-        if last_att and last_att.status == "in":
+        if last_status == "in":
             await message.answer("Siz allaqachon ishdasiz! 😅")
             return
             
@@ -90,20 +86,15 @@ async def clock_in_handler(message: Message) -> None:
 async def clock_out_handler(message: Message) -> None:
     logging.info(f"DEBUG: Clock-out from user_id={message.from_user.id}")
     async with AsyncSessionLocal() as db:
-        res = await db.execute(select(Employee).where(Employee.telegram_id == message.from_user.id))
-        employee = res.scalars().first()
+        # Xodim va oxirgi holati bitta so'rovda
+        employee, last_status = await get_employee_with_status(db, message.from_user.id)
         logging.info(f"DEBUG: Found employee={employee.username if employee else 'None'}")
         
         if not employee:
             await message.answer("Siz xodimlar ro'yxatida yo'qsiz!")
             return
             
-        # Oxirgi holatni tekshirish
-        stmt = select(Attendance).where(Attendance.employee_id == employee.id).order_by(Attendance.created_at.desc())
-        last_attres = await db.execute(stmt)
-        last_att = last_attres.scalars().first()
-        
-        if not last_att or last_att.status == "out":
+        if last_status != "in":
             await message.answer("Siz hali ishga kelmagansiz-ku? 🤔")
             return
             
@@ -121,20 +112,11 @@ async def who_is_working_handler(message: Message) -> None:
         if not res.scalars().first():
             return
 
-        # Hozirda ishda bo'lganlarni aniqlash
-        # Sodda yo'li: Har bir xodimning oxirgi statusi 'in' bo'lganlarni olish
-        stmt = select(Employee)
-        emp_res = await db.execute(stmt)
-        all_employees = emp_res.scalars().all()
-        
-        working_now = []
-        for emp in all_employees:
-            att_stmt = select(Attendance).where(Attendance.employee_id == emp.id).order_by(Attendance.created_at.desc()).limit(1)
-            att_res = await db.execute(att_stmt)
-            last_att = att_res.scalars().first()
-            if last_att and last_att.status == "in":
-                name = emp.full_name or emp.username
-                working_now.append(f"👤 {name} ({last_att.created_at.strftime('%H:%M')} dan beri)")
+        # Hozirda ishda bo'lganlar: har bir xodimning oxirgi holati bitta so'rovda
+        working_now = [
+            f"👤 {emp.full_name or emp.username} ({since.strftime('%H:%M')} dan beri)"
+            for emp, since in await get_working_now(db)
+        ]
         
         if working_now:
             text = "👥 <b>Hozirda ishda:</b>\n\n" + "\n".join(working_now)
@@ -205,22 +187,14 @@ async def name_handler(message: Message, state: FSMContext) -> None:
     phone = data.get("phone")
     telegram_id = message.from_user.id
 
-    telegram_id = message.from_user.id
-    norm_user_phone = normalize_phone(phone)
+    key = phone_key(phone)
 
     async with AsyncSessionLocal() as db:
-        # 1. Avval xodimlarni tekshiramiz (oxirgi 9 ta raqam bo'yicha)
-        emp_result = await db.execute(select(Employee))
-        employees = emp_result.scalars().all()
-        
+        # 1. Avval xodimlarni tekshiramiz (oxirgi 9 ta raqam bo'yicha, indeksli)
         employee = None
-        for e in employees:
-            if not e.phone: continue
-            norm_db_phone = normalize_phone(e.phone)
-            # Oxirgi 9 ta raqam mos kelsa
-            if norm_user_phone[-9:] == norm_db_phone[-9:]:
-                employee = e
-                break
+        if key:
+            emp_result = await db.execute(select(Employee).where(Employee.phone_key == key).limit(1))
+            employee = emp_result.scalars().first()
 
         if employee:
             logging.info(f"Linking telegram_id {telegram_id} to employee {employee.username}")
@@ -237,8 +211,10 @@ async def name_handler(message: Message, state: FSMContext) -> None:
             return
 
         # 2. Agar xodim bo'lmasa, mijoz sifatida tekshiramiz
-        client_result = await db.execute(select(Client).where(Client.phone == phone))
-        client = client_result.scalars().first()
+        client = None
+        if key:
+            client_result = await db.execute(select(Client).where(Client.phone_key == key).order_by(Client.id).limit(1))
+            client = client_result.scalars().first()
 
         if client:
             client.name = full_name
@@ -254,6 +230,7 @@ async def name_handler(message: Message, state: FSMContext) -> None:
             db.add(new_client)
         
         await db.commit()
+        await response_cache.invalidate("crm/clients")
         await message.answer(f"Tabriklaymiz! Siz muvaffaqiyatli ro'yxatdan o'tdingiz. ✅", reply_markup=get_main_menu("client"))
 
     await state.clear()
@@ -316,27 +293,23 @@ async def process_broadcast(message: Message, state: FSMContext) -> None:
         await message.answer("Bekor qilindi.", reply_markup=get_main_menu("admin"))
         return
 
-    async with AsyncSessionLocal() as db:
-        res = await db.execute(select(Client).where(Client.telegram_id.isnot(None)))
-        clients = res.scalars().all()
-    
-    count = 0
-    await message.answer(f"Xabar yuborish boshlandi ({len(clients)} ta mijoz)... ⏳")
-    
-    for client in clients:
-        try:
-            if message.content_type == "text":
-                await bot.send_message(client.telegram_id, message.text)
-            elif message.content_type == "photo":
-                await bot.send_photo(client.telegram_id, message.photo[-1].file_id, caption=message.caption)
-            elif message.content_type == "video":
-                await bot.send_video(client.telegram_id, message.video.file_id, caption=message.caption)
-            count += 1
-            await asyncio.sleep(0.05)
-        except Exception:
-            pass
-
-    await message.answer(f"Tayyor! ✅\nXabar {count} ta mijozga yuborildi.", reply_markup=get_main_menu("admin"))
+    if message.content_type == "text":
+        text, file_id = message.text, None
+    elif message.content_type == "photo":
+        text, file_id = message.caption, message.photo[-1].file_id
+    elif message.content_type == "video":
+        text, file_id = message.caption, message.video.file_id
+    else:
+        await message.answer("Faqat matn, rasm yoki video yuborish mumkin.")
+        return
+
+    # Yuborish fonda ishlaydi: progress shu xabarda yangilanib boradi,
+    # server qayta ishga tushsa - to'xtagan joyidan davom etadi
+    progress = await message.answer("⏳ Xabar yuborish boshlanmoqda...")
+    broadcast_id = await create_broadcast(message.chat.id, progress.message_id, message.content_type, text, file_id)
+    start_broadcast(bot, broadcast_id)
+
+    await message.answer("Xabar fonda yuborilmoqda. Natija yuqoridagi xabarda ko'rinadi. ✅", reply_markup=get_main_menu("admin"))
     await state.clear()
 
 # --- ADMIN: MA'LUMOTLAR (BACKUP) ---
@@ -361,39 +334,7 @@ async def admin_backup_handler(message: Message) -> None:
 async def check_debts(bot: Bot):
     """Qarz eslatmalarini tekshirish funksiyasi"""
     try:
-        now = datetime.now()
-        async with AsyncSessionLocal() as db:
-            result = await db.execute(
-                select(Client).where(
-                    Client.debt_due_date.isnot(None),
-                    Client.telegram_id.isnot(None),
-                    Client.balance < 0
-                )
-            )
-            clients = result.scalars().all()
-
-            for client in clients:
-                days_left = (client.debt_due_date - now).days
-                debt = abs(client.balance)
-
-                msg = None
-                if days_left == 3:
-                    msg = f"🔔 Eslatma: {client.name}, qarzingizni to'lashga 3 kun qoldi.\n💰 Summa: {debt:,.0f} so'm"
-                elif days_left == 2:
-                    msg = f"🔔 Eslatma: {client.name}, qarzingizni to'lashga 2 kun qoldi.\n💰 Summa: {debt:,.0f} so'm"
-                elif days_left == 1:
-                    msg = f"⚠️ Diqqat: {client.name}, ertaga qarzingizni to'lash muddati tugaydi!\n💰 Summa: {debt:,.0f} so'm"
-                elif days_left == 0:
-                    msg = f"🚨 {client.name}, bugun qarzingizni to'lash muddati!\n💰 Iltimos, {debt:,.0f} so'm to'lang."
-                elif days_left < 0:
-                    msg = f"‼️ {client.name}, siz qarzingizni kechiktirdingiz!\n💰 Qarzingiz: {debt:,.0f} so'm.\nIltimos, tezroq to'lang."
-
-                if msg:
-                    try:
-                        await bot.send_message(client.telegram_id, msg)
-                    except Exception as e:
-                        print(f"Xabar yuborishda xatolik ({client.name}): {e}")
-
+        await send_debt_reminders(bot)
     except Exception as e:
         print(f"Qarz tekshirishda xatolik: {e}")
 
@@ -0,0 +1,74 @@
+# bot_worker.py
+# Telegram bot va fon vazifalari uchun alohida jarayon.
+# Ishga tushirish: python bot_worker.py  (API tomonda RUN_BOT_IN_API=false qo'yiladi,
+# shunda API ni bir nechta uvicorn worker bilan ishlatish mumkin - polling takrorlanmaydi)
+import asyncio
+import logging
+import sys
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from database import init_db
+from bot import bot, dp, check_debts
+from utils.broadcast import resume_broadcasts
+from utils.reorder import refresh_reorder_suggestions
+from utils.client_ledger import refresh_debt_aging
+from utils.settings_provider import settings_provider
+from utils.idempotency import purge_expired_keys
+from utils.outbox import run_outbox_worker, purge_outbox
+
+
+def create_scheduler(bot) -> AsyncIOScheduler:
+    scheduler = AsyncIOScheduler()
+    # Har kuni ertalab soat 9:00 da qarzni tekshirish
+    scheduler.add_job(check_debts, 'cron', hour=9, minute=0, args=[bot])
+    # Har kecha soat 3:00 da buyurtma tavsiyalarini qayta hisoblash
+    scheduler.add_job(refresh_reorder_suggestions, 'cron', hour=3, minute=0)
+    # Har kecha qarzlarni yoshi bo'yicha qayta taqsimlash (0-30 / 31-60 / 60+ kun)
+    scheduler.add_job(refresh_debt_aging, 'cron', hour=3, minute=30)
+    # Har soatda eskirgan idempotency kalitlarini va yuborilgan outbox xabarlarini tozalash
+    scheduler.add_job(purge_expired_keys, 'interval', hours=1)
+    scheduler.add_job(purge_outbox, 'interval', hours=1)
+    # Eskirgan FSM holatlarini tozalash
+    scheduler.add_job(dp.storage.purge_expired, 'interval', hours=1)
+    # Har soatda bazani backup qilish (ixtiyoriy)
+    # scheduler.add_job(create_backup, 'interval', hours=1)
+    return scheduler
+
+
+async def start_background(bot):
+    """Scheduler, outbox yuboruvchi va tugallanmagan broadcastlarni ishga tushiradi"""
+    scheduler = create_scheduler(bot)
+    scheduler.start()
+    outbox_task = asyncio.create_task(run_outbox_worker(bot))
+    # Tugallanmagan reklama xabarlarini davom ettirish
+    await resume_broadcasts(bot)
+    return scheduler, outbox_task
+
+
+async def stop_background(scheduler, outbox_task):
+    scheduler.shutdown()
+    outbox_task.cancel()
+    try:
+        await asyncio.wait([outbox_task], timeout=2.0)
+    except Exception as e:
+        print(f"Cleanup error: {e}")
+
+
+async def main() -> None:
+    await init_db()
+    await settings_provider.load()
+
+    scheduler, outbox_task = await start_background(bot)
+    print("Bot worker: polling boshlandi.")
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await stop_background(scheduler, outbox_task)
+        await bot.session.close()
+        print("Bot worker: to'xtatildi.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    asyncio.run(main())
@@ -1,7 +1,7 @@
 # database.py
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, JSON, Text, BigInteger
+from sqlalchemy.orm import sessionmaker, declarative_base, relationship, validates, Session
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Date, JSON, Text, BigInteger, UniqueConstraint, Index
 from datetime import datetime, timezone
 
 import os
@@ -12,27 +12,192 @@ load_dotenv()
 # Baza fayli nomi (sqlite)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(BASE_DIR, 'market.db')}")
+# Ixtiyoriy: hisobot va eksport so'rovlari uchun read-only replika (bo'sh bo'lsa asosiy baza ishlatiladi)
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
 
-# Render/Heroku postgres:// URLs require +asyncpg for SQLAlchemy async engine
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql+asyncpg://", 1)
-elif DATABASE_URL.startswith("postgresql://"):
-    DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+def _async_url(url):
+    # Render/Heroku postgres:// URLs require +asyncpg for SQLAlchemy async engine
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+asyncpg://", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
+
+DATABASE_URL = _async_url(DATABASE_URL)
+if DATABASE_REPLICA_URL:
+    DATABASE_REPLICA_URL = _async_url(DATABASE_REPLICA_URL)
 
 from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError, DisconnectionError
+from collections import deque
+from fastapi import Request, Depends
+import time
 
 # SQLite setup differs from PostgreSQL
 is_sqlite = DATABASE_URL.startswith("sqlite")
 
-engine_args = {
-    "echo": False,
-    "pool_pre_ping": True
-}
-
-if is_sqlite:
-    engine_args["connect_args"] = {"check_same_thread": False}
-
-engine = create_async_engine(DATABASE_URL, **engine_args)
+# --- CONNECTION POOL ---
+# Peak soatga moslash uchun env orqali sozlanadi. Server tomonda uzilgan ulanishlar (Postgres restart,
+# failover, Render bo'sh ulanishlarni uzishi) checkoutda aniqlanadi: default holatda faqat
+# DB_POOL_PING_IDLE_SECONDS dan ko'p bo'sh turgan ulanish ping qilinadi (LIFO bilan aynan shular -
+# peak paytida beriladigan ortiqcha ulanishlar). Tez-tez ishlatilayotganlari qo'shimcha so'rovsiz beriladi,
+# pool_recycle esa yoshi bo'yicha zaxira. DB_POOL_PRE_PING=true - har bir checkoutda ping (eski xatti-harakat).
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # soniya (Render Postgres bo'sh ulanishlarni uzadi)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+DB_POOL_PING_IDLE_SECONDS = float(os.getenv("DB_POOL_PING_IDLE_SECONDS", "30"))  # manfiy - o'chiq
+DB_POOL_USE_LIFO = os.getenv("DB_POOL_USE_LIFO", "true").lower() in ("1", "true", "yes")
+
+
+class PoolMetrics:
+    """Pool va sessiya statistikasi (pool hajmini tanlash uchun)"""
+
+    SAMPLE_SIZE = 500  # p95 uchun oxirgi qiymatlar
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.waited = 0  # 10ms dan ko'p kutgan checkoutlar
+        self.peak_checked_out = 0
+        self.idle_pings = 0  # bo'sh turgan ulanishni tekshirish
+        self.stale_discarded = 0  # ping o'tmagan (uzilgan) ulanishlar
+        self._waits = deque(maxlen=self.SAMPLE_SIZE)
+        self.sessions = {}  # route -> {"count", "total", "max", "samples"}
+
+    def record_checkout(self, wait: float, checked_out: int):
+        self.checkouts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        if wait > 0.01:
+            self.waited += 1
+        self._waits.append(wait)
+        self.peak_checked_out = max(self.peak_checked_out, checked_out)
+
+    def record_session(self, route: str, seconds: float):
+        s = self.sessions.get(route)
+        if s is None:
+            s = self.sessions[route] = {"count": 0, "total": 0.0, "max": 0.0, "samples": deque(maxlen=self.SAMPLE_SIZE)}
+        s["count"] += 1
+        s["total"] += seconds
+        s["max"] = max(s["max"], seconds)
+        s["samples"].append(seconds)
+
+    @staticmethod
+    def _p95(samples) -> float:
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def snapshot(self, pool=None) -> dict:
+        data = {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "waited_checkouts": self.waited,
+            "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+            "wait_p95_ms": round(self._p95(self._waits) * 1000, 2),
+            "wait_max_ms": round(self.wait_max * 1000, 2),
+            "peak_checked_out": self.peak_checked_out,
+            "idle_pings": self.idle_pings,
+            "stale_discarded": self.stale_discarded,
+            "sessions": {
+                route: {
+                    "count": s["count"],
+                    "avg_ms": round(s["total"] / s["count"] * 1000, 2),
+                    "p95_ms": round(self._p95(s["samples"]) * 1000, 2),
+                    "max_ms": round(s["max"] * 1000, 2),
+                }
+                for route, s in sorted(self.sessions.items())
+            },
+        }
+        if isinstance(pool, AsyncAdaptedQueuePool):
+            capacity = pool.size() + max(pool._max_overflow, 0)
+            data.update({
+                "pool_size": pool.size(),
+                "max_overflow": pool._max_overflow,
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "saturation": round(pool.checkedout() / capacity, 4) if capacity else 0.0,
+                "peak_saturation": round(self.peak_checked_out / capacity, 4) if capacity else 0.0,
+            })
+        return data
+
+
+pool_metrics = PoolMetrics()
+read_pool_metrics = PoolMetrics()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Checkout kutish vaqtini o'lchaydigan pool"""
+
+    metrics = pool_metrics
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        self.metrics.record_checkout(time.perf_counter() - started, self.checkedout())
+        return conn
+
+
+class ReadInstrumentedPool(InstrumentedPool):
+    metrics = read_pool_metrics
+
+
+def _engine_args(url, poolclass):
+    args = {
+        "echo": False,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if url.startswith("sqlite"):
+        args["connect_args"] = {"check_same_thread": False}
+    if ":memory:" not in url:
+        args.update({
+            "poolclass": poolclass,
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_use_lifo": DB_POOL_USE_LIFO,
+        })
+    return args
+
+engine = create_async_engine(DATABASE_URL, **_engine_args(DATABASE_URL, InstrumentedPool))
+read_engine = create_async_engine(DATABASE_REPLICA_URL, **_engine_args(DATABASE_REPLICA_URL, ReadInstrumentedPool)) if DATABASE_REPLICA_URL else engine
+
+def _install_idle_ping(target, metrics: PoolMetrics):
+    """Faqat uzoq bo'sh turgan ulanishni checkoutda ping qilish (pre_ping ning arzon varianti).
+
+    Ping o'tmasa DisconnectionError - pool ulanishni tashlab, yangisini oladi.
+    """
+    @event.listens_for(target.sync_engine, "checkin")
+    def _mark_idle(dbapi_connection, connection_record):
+        connection_record.info["checked_in_at"] = time.monotonic()
+
+    @event.listens_for(target.sync_engine, "checkout")
+    def _ping_if_idle(dbapi_connection, connection_record, connection_proxy):
+        checked_in_at = connection_record.info.pop("checked_in_at", None)
+        if checked_in_at is None or time.monotonic() - checked_in_at < DB_POOL_PING_IDLE_SECONDS:
+            return
+        metrics.idle_pings += 1
+        try:
+            target.dialect.do_ping(dbapi_connection)
+        except Exception as e:
+            metrics.stale_discarded += 1
+            raise DisconnectionError(f"Bo'sh turgan ulanish uzilgan: {e}") from e
+
+if not is_sqlite and not DB_POOL_PRE_PING and DB_POOL_PING_IDLE_SECONDS >= 0:
+    _install_idle_ping(engine, pool_metrics)
+    if read_engine is not engine:
+        _install_idle_ping(read_engine, read_pool_metrics)
 
 if is_sqlite:
     @event.listens_for(engine.sync_engine, "connect")
@@ -42,9 +207,88 @@ if is_sqlite:
         cursor.execute("PRAGMA synchronous=NORMAL")
         cursor.close()
 
-SessionLocal = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+class PrimarySession(Session):
+    """Asosiy bazadagi sessiyalar (commit hodisasini kuzatish uchun alohida klass)"""
+
+SessionLocal = sessionmaker(bind=engine, class_=AsyncSession, sync_session_class=PrimarySession, expire_on_commit=False)
+ReadSessionLocal = sessionmaker(bind=read_engine, class_=AsyncSession, expire_on_commit=False) if DATABASE_REPLICA_URL else SessionLocal
+
+# Read-your-writes: yozgan foydalanuvchining o'qishlari shu vaqt davomida asosiy bazaga boradi (replika kechikishi).
+# Yozuv vaqti javobda X-Last-Write headerida qaytadi va mijoz uni keyingi so'rovlarda yuboradi - shunda
+# bir nechta uvicorn worker bo'lsa ham o'qish boshqa workerda asosiy bazaga tushadi.
+# Headerni qaytarmaydigan mijozlar (skriptlar) uchun jarayon ichidagi ro'yxat ham bor - u faqat bitta workerda ishlaydi.
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "10"))
+LAST_WRITE_HEADER = "X-Last-Write"
+_recent_writers = {}  # token -> oxirgi commit vaqti (monotonic)
+
+@event.listens_for(PrimarySession, "after_commit")
+def _mark_session_wrote(session):
+    session.info["wrote"] = True
+    request = session.info.get("request")
+    if request is not None:
+        request.state.db_wrote_at = time.time()
+
+def _writer_key(request: Request) -> str:
+    # Bir foydalanuvchining barcha so'rovlari bitta JWT bilan keladi
+    return request.headers.get("authorization") or (request.client.host if request.client else "")
+
+def _mark_recent_writer(request: Request):
+    now = time.monotonic()
+    _recent_writers[_writer_key(request)] = now
+    if len(_recent_writers) > 10000:
+        cutoff = now - READ_YOUR_WRITES_SECONDS
+        for key in [k for k, t in _recent_writers.items() if t < cutoff]:
+            _recent_writers.pop(key, None)
+
+def wrote_recently(request: Request) -> bool:
+    try:
+        client_written_at = float(request.headers.get(LAST_WRITE_HEADER) or 0)
+    except ValueError:
+        client_written_at = 0
+    if 0 <= time.time() - client_written_at < READ_YOUR_WRITES_SECONDS:
+        return True
+    written_at = _recent_writers.get(_writer_key(request))
+    return written_at is not None and time.monotonic() - written_at < READ_YOUR_WRITES_SECONDS
+
+class LastWriteMiddleware:
+    """Pure ASGI middleware: so'rov asosiy bazaga commit qilgan bo'lsa, javobga X-Last-Write (unix vaqt) qo'shadi"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        state = scope.setdefault("state", {})
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and state.get("db_wrote_at"):
+                message["headers"] = list(message.get("headers", [])) + [
+                    (LAST_WRITE_HEADER.lower().encode(), b"%.3f" % state["db_wrote_at"])
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
 Base = declarative_base()
 
+def phone_key(phone):
+    """Telefonning oxirgi 9 ta raqami: formatdan qat'i nazar solishtirish uchun (+998 90 123-45-67 -> 901234567)"""
+    if not phone:
+        return None
+    digits = "".join(filter(str.isdigit, str(phone)))
+    return digits[-9:] or None
+
+def name_key(name):
+    """Ism bo'yicha prefiks qidiruv uchun: kichik harf, bitta probel, apostrof turlari bir xil (G'ani, Gʻani -> g'ani)"""
+    if not name:
+        return None
+    text = str(name).lower()
+    for mark in ("ʻ", "ʼ", "‘", "’", "`"):
+        text = text.replace(mark, "'")
+    return " ".join(text.split()) or None
+
 # --- JADVALLAR (MODELS) ---
 
 # 0. Xodimlar (Admin, Manager, Kassir)
@@ -63,6 +307,12 @@ class Employee(Base):
     passport = Column(String, nullable=True) # Pasport seriyasi
     notes = Column(String, nullable=True) # Qo'shimcha izohlar
     telegram_id = Column(BigInteger, unique=True, nullable=True, index=True) # Telegram bot uchun
+    phone_key = Column(String(9), nullable=True, index=True) # phone_key(phone), avtomatik to'ldiriladi
+
+    @validates("phone")
+    def _sync_phone_key(self, key, value):
+        self.phone_key = phone_key(value)
+        return value
 
 class Category(Base):
     __tablename__ = "categories"
@@ -81,6 +331,7 @@ class Product(Base):
     unit = Column(String, default="dona") # dona, kg, litr
     category_id = Column(Integer, ForeignKey("categories.id"), nullable=True)
     is_favorite = Column(Boolean, default=False) # Sevimli mahsulot (kassada yuqorida)
+    supplier_id = Column(Integer, ForeignKey("suppliers.id"), nullable=True, index=True) # Asosiy yetkazib beruvchi firma
 
 # 2. Mijozlar (Bot uchun)
 class User(Base):
@@ -94,6 +345,12 @@ class User(Base):
 # 7. Mijozlar (CRM) - Moved up for FK reference
 class Client(Base):
     __tablename__ = "clients"
+    # Ro'yxat saralash va keyset sahifalash uchun (qiymat, id)
+    __table_args__ = (
+        Index("ix_clients_name_key_id", "name_key", "id"),
+        Index("ix_clients_balance_id", "balance", "id"),
+        Index("ix_clients_debt_due_date_id", "debt_due_date", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     phone = Column(String, nullable=True)
@@ -102,6 +359,21 @@ class Client(Base):
     bonus_balance = Column(Float, default=0) # Keshbek ballari
     debt_due_date = Column(DateTime, nullable=True) # Qarz qaytarish muddati
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    phone_key = Column(String(9), nullable=True, index=True) # phone_key(phone), avtomatik to'ldiriladi
+    # name_key(name), avtomatik to'ldiriladi. PostgreSQL da "C" collation: prefiks diapazoni (crm._prefix_range)
+    # baytlar bo'yicha solishtirishga tayanadi, en_US.UTF-8 esa apostrofni e'tiborsiz qoldiradi (g', o').
+    # SQLite ning default BINARY collation i allaqachon shunday
+    name_key = Column(String().with_variant(String(collation="C"), "postgresql"), nullable=True)
+
+    @validates("phone")
+    def _sync_phone_key(self, key, value):
+        self.phone_key = phone_key(value)
+        return value
+
+    @validates("name")
+    def _sync_name_key(self, key, value):
+        self.name_key = name_key(value)
+        return value
 
 # 3. Savdo Cheklari (Tarix)
 class Sale(Base):
@@ -112,7 +384,9 @@ class Sale(Base):
     payment_method = Column(String) # cash, plastic, card
     cashier_id = Column(Integer, ForeignKey("employees.id")) # Fix: Point to employees
     client_id = Column(Integer, ForeignKey("clients.id"), nullable=True) # Mijoz (optional)
-    status = Column(String, default="completed") # completed, refunded
+    status = Column(String, default="completed") # completed, refunded (qisman qaytarilgan savdo - completed, refunded_amount > 0)
+    client_uuid = Column(String(36), unique=True, nullable=True, index=True) # Offline kassa yaratgan UUID (sinxronlash uchun)
+    shift_id = Column(Integer, ForeignKey("shifts.id"), nullable=True, index=True) # Qaysi smenada sotilgan
     
     # Split Payment Columns
     cash_amount = Column(Float, default=0)
@@ -123,6 +397,7 @@ class Sale(Base):
     # Bonus Fields
     bonus_earned = Column(Float, default=0) # Ushbu savdodan to'plangan bonus
     bonus_spent = Column(Float, default=0) # Ushbu savdoda ishlatilgan bonus
+    refunded_amount = Column(Float, default=0) # Qaytarilgan summa (qisman qaytarishlar yig'indisi)
     
     # Relationships
     items = relationship("SaleItem", back_populates="sale")
@@ -132,15 +407,34 @@ class Sale(Base):
 class SaleItem(Base):
     __tablename__ = "sale_items"
     id = Column(Integer, primary_key=True, index=True)
-    sale_id = Column(Integer, ForeignKey("sales.id"))
+    sale_id = Column(Integer, ForeignKey("sales.id"), index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
     quantity = Column(Float) # Nechta?
     price = Column(Float) # Qanchadan sotildi?
+    refunded_quantity = Column(Float, default=0) # Shundan qaytarilgani
     
     # Relationships
     sale = relationship("Sale", back_populates="items")
     product = relationship("Product")
 
+# 18. Qaytarilgan qatorlar (qisman va to'liq qaytarishlar). Pul savdo to'lov turlariga proporsional taqsimlanadi
+class RefundItem(Base):
+    __tablename__ = "refund_items"
+    id = Column(Integer, primary_key=True, index=True)
+    sale_id = Column(Integer, ForeignKey("sales.id"), index=True)
+    sale_item_id = Column(Integer, ForeignKey("sale_items.id"))
+    product_id = Column(Integer, ForeignKey("products.id"))
+    quantity = Column(Float)
+    amount = Column(Float) # Mijozga qaytarilgan summa (= cash + card + transfer + debt)
+    cash_amount = Column(Float, default=0)
+    card_amount = Column(Float, default=0)
+    transfer_amount = Column(Float, default=0)
+    debt_amount = Column(Float, default=0) # Qarzdan ayirilgan qismi
+    bonus_amount = Column(Float, default=0) # Mijozdan qaytarib olingan bonus
+    created_by = Column(Integer, ForeignKey("employees.id"), nullable=True)
+    shift_id = Column(Integer, ForeignKey("shifts.id"), nullable=True, index=True) # Qaytargan xodimning ochiq smenasi (jamlari shu smenadan ayriladi)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
 # 5. Xarajatlar (Expenses)
 class Expense(Base):
     __tablename__ = "expenses"
@@ -199,12 +493,38 @@ class Payment(Base):
     note = Column(String, nullable=True) # Izoh
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     created_by = Column(Integer, ForeignKey("employees.id"), nullable=True)
-    shift_id = Column(Integer, ForeignKey("shifts.id"), nullable=True) # Qaysi smenada qabul qilingan
+    shift_id = Column(Integer, ForeignKey("shifts.id"), nullable=True, index=True) # Qaysi smenada qabul qilingan
 
     # Relationships
     client = relationship("Client")
     employee = relationship("Employee")
 
+# 19. Mijoz hisobi (append-only): Client.balance ning har bir o'zgarishi va undan keyingi qoldiq
+class ClientLedger(Base):
+    __tablename__ = "client_ledger"
+    __table_args__ = (Index("ix_client_ledger_client_id_id", "client_id", "id"),)
+    id = Column(Integer, primary_key=True, index=True)
+    client_id = Column(Integer, ForeignKey("clients.id"))
+    entry_type = Column(String) # opening, sale, refund, payment
+    amount = Column(Float) # Balansga ta'siri: qarz (-), to'lov va qaytarish (+)
+    balance_after = Column(Float) # Shu yozuvdan keyingi Client.balance
+    open_amount = Column(Float, default=0, index=True) # Qarz yozuvining hali to'lanmagan qismi (FIFO bo'yicha yopiladi)
+    sale_id = Column(Integer, ForeignKey("sales.id"), nullable=True)
+    payment_id = Column(Integer, ForeignKey("payments.id"), nullable=True)
+    created_by = Column(Integer, ForeignKey("employees.id"), nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+# 20. Qarz yoshi bo'yicha jamlar (faqat qarzdorlar). Har bir yozuvda yangilanadi, kun chegaralari har kecha qayta hisoblanadi
+class ClientDebtAging(Base):
+    __tablename__ = "client_debt_aging"
+    client_id = Column(Integer, ForeignKey("clients.id"), primary_key=True)
+    total_debt = Column(Float, default=0, index=True)
+    days_0_30 = Column(Float, default=0)
+    days_31_60 = Column(Float, default=0)
+    days_60_plus = Column(Float, default=0)
+    oldest_debt_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
 # 8. Kassir Smenasi (Cashier Shifts)
 class Shift(Base):
     __tablename__ = "shifts"
@@ -212,11 +532,23 @@ class Shift(Base):
     cashier_id = Column(Integer, ForeignKey("employees.id"))
     opening_balance = Column(Float, default=0) # Boshlanish kassadagi pul
     closing_balance = Column(Float, nullable=True) # Yopilgandagi kassadagi pul
-    opened_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
-    closed_at = Column(DateTime, nullable=True)
+    opened_at = Column(DateTime, default=lambda: datetime.now(timezone.utc)) # UTC (savdo vaqtlari bilan bir xil)
+    closed_at = Column(DateTime, nullable=True) # UTC
+    utc_times = Column(Boolean, default=True) # False - eski yozuv, vaqtlar server mahalliy vaqtida (update_db o'giradi)
     status = Column(String, default="open") # open, closed
     note = Column(String, nullable=True) # Izoh
 
+    # Joriy jamlar: savdo, qaytarish va qarz to'lovida SQL increment bilan yangilanadi (utils/shift_totals.py)
+    sales_count = Column(Integer, default=0)
+    sales_total = Column(Float, default=0)
+    total_cash = Column(Float, default=0)
+    total_card = Column(Float, default=0) # card + transfer
+    total_debt = Column(Float, default=0)
+    refunds_count = Column(Integer, default=0)
+    refunds_total = Column(Float, default=0)
+    debt_collected = Column(Float, default=0) # Smenada qabul qilingan qarz to'lovlari
+    debt_collected_cash = Column(Float, default=0) # ...shundan naqd
+
     # Relationships
     cashier = relationship("Employee")
 
@@ -230,6 +562,9 @@ class Attendance(Base):
 
     employee = relationship("Employee")
 
+    # Har bir xodimning oxirgi holati shu indeks orqali topiladi
+    __table_args__ = (Index("ix_attendance_employee_created", "employee_id", "created_at"),)
+
 # 9. Vazifalar (Tasks for Employees)
 class Task(Base):
     __tablename__ = "tasks"
@@ -258,10 +593,13 @@ class Supplier(Base):
 
 class SupplyReceipt(Base):
     __tablename__ = "supply_receipts"
+    __table_args__ = (Index("ix_supply_receipts_supplier_date", "supplier_id", "date", "id"),)
     id = Column(Integer, primary_key=True, index=True)
     supplier_id = Column(Integer, ForeignKey("suppliers.id"))
     total_amount = Column(Float) # Jami kelgan mol summasi
     invoice_image = Column(String, nullable=True) # Nakladnoy rasmi yo'li
+    invoice_thumbnail = Column(String, nullable=True) # Kichik WebP (fon vazifada yaratiladi)
+    invoice_preview = Column(String, nullable=True) # Ko'rish uchun siqilgan WebP
     date = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     note = Column(String, nullable=True)
     
@@ -269,6 +607,7 @@ class SupplyReceipt(Base):
 
 class SupplierPayment(Base):
     __tablename__ = "supplier_payments"
+    __table_args__ = (Index("ix_supplier_payments_supplier_date", "supplier_id", "date", "id"),)
     id = Column(Integer, primary_key=True, index=True)
     supplier_id = Column(Integer, ForeignKey("suppliers.id"))
     amount = Column(Float) # To'langan summa
@@ -278,6 +617,114 @@ class SupplierPayment(Base):
     
     supplier = relationship("Supplier")
 
+# 21. Firma hisobi (append-only): kirim va to'lovlar bitta jadvalda, har biridan keyingi Supplier.balance bilan
+class SupplierLedger(Base):
+    __tablename__ = "supplier_ledger"
+    __table_args__ = (Index("ix_supplier_ledger_supplier_id_id", "supplier_id", "id"),)
+    id = Column(Integer, primary_key=True, index=True)
+    supplier_id = Column(Integer, ForeignKey("suppliers.id"))
+    entry_type = Column(String) # opening, receipt, payment
+    amount = Column(Float) # Balansga ta'siri: kirim (+, qarzimiz oshadi), to'lov (-)
+    balance_after = Column(Float) # Shu yozuvdan keyingi Supplier.balance
+    receipt_id = Column(Integer, ForeignKey("supply_receipts.id"), nullable=True, index=True)
+    payment_id = Column(Integer, ForeignKey("supplier_payments.id"), nullable=True, index=True)
+    created_by = Column(Integer, ForeignKey("employees.id"), nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+# 12. Buyurtma tavsiyalari (Reorder suggestions) - rejalashtirilgan job tomonidan to'ldiriladi
+class ReorderSuggestion(Base):
+    __tablename__ = "reorder_suggestions"
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), unique=True, index=True)
+    supplier_id = Column(Integer, ForeignKey("suppliers.id"), nullable=True, index=True)
+    stock = Column(Float, default=0) # Hisoblash paytidagi qoldiq
+    daily_velocity = Column(Float, default=0) # Kunlik o'rtacha sotuv (EW)
+    days_of_cover = Column(Float, nullable=True) # Qoldiq necha kunga yetadi (sotuv bo'lmasa None)
+    reorder_quantity = Column(Float, default=0) # Buyurtma qilish tavsiya etilgan miqdor
+    computed_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    product = relationship("Product")
+    supplier = relationship("Supplier")
+
+# 13. Takroriy so'rovlardan himoya (Idempotency keys) - POS qayta urinishlari uchun
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String(32)) # sales, crm_pay, finance_payment
+    user_id = Column(Integer, ForeignKey("employees.id"))
+    key = Column(String(64)) # Mijoz (frontend) yuborgan Idempotency-Key
+    request_hash = Column(String(64), nullable=True) # sha256(method, path, body) - kalit boshqa so'rovga ishlatilmasin
+    status_code = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True) # None - so'rov hali bajarilmoqda
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+
+    __table_args__ = (UniqueConstraint("scope", "user_id", "key", name="uq_idempotency_scope_user_key"),)
+
+# 14. Reklama xabarlari (Telegram broadcast) va yetkazish jurnali
+class Broadcast(Base):
+    __tablename__ = "broadcasts"
+    id = Column(Integer, primary_key=True, index=True)
+    admin_chat_id = Column(BigInteger) # Progress shu chatga yoziladi
+    progress_message_id = Column(Integer, nullable=True)
+    content_type = Column(String) # text, photo, video
+    text = Column(Text, nullable=True) # Matn yoki rasm/video izohi
+    file_id = Column(String, nullable=True)
+    status = Column(String, default="pending", index=True) # pending, running, done
+    total = Column(Integer, default=0)
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    blocked = Column(Integer, default=0) # Botni bloklagan mijozlar
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    finished_at = Column(DateTime, nullable=True)
+
+class BroadcastDelivery(Base):
+    __tablename__ = "broadcast_deliveries"
+    id = Column(Integer, primary_key=True, index=True)
+    broadcast_id = Column(Integer, ForeignKey("broadcasts.id"))
+    chat_id = Column(BigInteger)
+    status = Column(String) # sent, failed, blocked
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (UniqueConstraint("broadcast_id", "chat_id", name="uq_broadcast_delivery_chat"),)
+
+# 15. Yuborilgan qarz eslatmalari (bir kunda bir mijozga bir marta)
+class DebtReminder(Base):
+    __tablename__ = "debt_reminders"
+    id = Column(Integer, primary_key=True, index=True)
+    client_id = Column(Integer, ForeignKey("clients.id"))
+    reminder_date = Column(Date) # Qaysi kun uchun yuborilgan
+    days_left = Column(Integer) # Muddatgacha qolgan kun (-1 = kechiktirilgan)
+    status = Column(String) # sent, blocked
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (UniqueConstraint("client_id", "reminder_date", name="uq_debt_reminder_client_day"),)
+
+# 16. Telegram xabarlari navbati (transactional outbox) - bot worker yuboradi
+class OutboxMessage(Base):
+    __tablename__ = "outbox_messages"
+    id = Column(Integer, primary_key=True, index=True)
+    chat_id = Column(BigInteger)
+    text = Column(Text)
+    parse_mode = Column(String, nullable=True) # HTML yoki None
+    status = Column(String, default="pending") # pending, sending, sent, blocked, failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=lambda: datetime.now(timezone.utc)) # sending uchun - lease muddati
+    claim_token = Column(String(32), nullable=True) # Qaysi worker olganini bildiradi
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (Index("ix_outbox_status_next_attempt", "status", "next_attempt_at"),)
+
+# 17. Bot FSM holatlari (ro'yxatdan o'tish, broadcast) - qayta ishga tushganda yo'qolmasligi uchun
+class FsmState(Base):
+    __tablename__ = "fsm_states"
+    key = Column(String(255), primary_key=True) # DefaultKeyBuilder: fsm:<bot>:<chat>:<user>:<destiny>
+    state = Column(String, nullable=True)
+    data = Column(Text, nullable=True) # JSON
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+
 # Do'kon Sozlamalari (Store Settings)
 class StoreSetting(Base):
     __tablename__ = "store_settings"
@@ -293,12 +740,46 @@ class StoreSetting(Base):
     # New V2 Settings
     bonus_percentage = Column(Float, default=1.0) # Har bir xarid uchun necha % bonus (1% default)
     debt_reminder_days = Column(Integer, default=3) # To'lov muddatidan necha kun oldin eslatish
+    version = Column(Integer, default=1) # Har o'zgarishda oshadi (workerlar keshini yangilash uchun)
 
 # Bazani yaratish funksiyasi
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
-async def get_db():
-    async with SessionLocal() as db:
-        yield db
\ No newline at end of file
+def _record_session(request: Request, metrics: PoolMetrics, started: float):
+    # Sessiya necha vaqt ochiq turgani (route shabloni bo'yicha, masalan /sales/{sale_id})
+    route = request.scope.get("route")
+    metrics.record_session(f"{request.method} {getattr(route, 'path', request.url.path)}", time.perf_counter() - started)
+
+async def get_db(request: Request):
+    """Asosiy (read-write) sessiya"""
+    started = time.perf_counter()
+    db = None
+    try:
+        async with SessionLocal() as db:
+            db.info["request"] = request
+            yield db
+    finally:
+        if db is not None and db.info.get("wrote"):
+            _mark_recent_writer(request)
+        _record_session(request, pool_metrics, started)
+
+async def get_read_db(request: Request, db: AsyncSession = Depends(get_db)):
+    """Hisobot/eksport uchun read-only sessiya (replika bo'lsa - replikadan).
+
+    Yaqinda yozgan foydalanuvchi READ_YOUR_WRITES_SECONDS davomida asosiy bazadan o'qiydi.
+    Asosiy sessiya so'rov ichida bitta (get_current_user bilan umumiy).
+    """
+    if ReadSessionLocal is SessionLocal or wrote_recently(request):
+        yield db
+        return
+
+    # Autentifikatsiya uchun olingan asosiy ulanishni og'ir so'rov davomida band qilmaymiz
+    await db.close()
+    started = time.perf_counter()
+    try:
+        async with ReadSessionLocal() as read_db:
+            yield read_db
+    finally:
+        _record_session(request, read_pool_metrics, started)
\ No newline at end of file
@@ -5,36 +5,42 @@ import asyncio
 from typing import Optional
 import os
 import logging
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
-from database import init_db, engine, Base, SessionLocal, Employee
+from database import init_db, engine, read_engine, Base, SessionLocal, Employee, pool_metrics, LastWriteMiddleware, LAST_WRITE_HEADER
 from core import get_password_hash, limiter
-from bot import bot, dp, check_debts
-from routers import auth, inventory, pos, crm, finance, tasks, sales, audit, settings, suppliers
+from bot import bot, dp
+from bot_worker import start_background, stop_background
+from utils.settings_provider import settings_provider
+from utils.metrics import MetricsMiddleware, install_sql_hooks, metrics_registry
+from utils.compression import CompressionMiddleware, compression_stats
+from utils.events import event_bus
+from utils.cache import response_cache
+from routers import auth, inventory, pos, crm, finance, tasks, sales, audit, settings, suppliers, events
 from fastapi.staticfiles import StaticFiles
 
 # Configure Rate Limiting - MOVED TO core.py
 
+# false bo'lsa bot polling va fon vazifalari API da ishga tushmaydi (bot_worker.py alohida ishlaydi)
+RUN_BOT_IN_API = os.getenv("RUN_BOT_IN_API", "true").lower() in ("1", "true", "yes")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Startup: Initializing DB...")
     await init_db()
+    await settings_provider.load()
     
-    # Start Scheduler for background tasks
-    print("Startup: Starting scheduler...")
-    scheduler = AsyncIOScheduler()
-    # Har kuni ertalab soat 9:00 da qarzni tekshirish
-    scheduler.add_job(check_debts, 'cron', hour=9, minute=0, args=[bot])
-    # Har soatda bazani backup qilish (ixtiyoriy)
-    # scheduler.add_job(create_backup, 'interval', hours=1)
-    scheduler.start()
-    
-    # Start Bot tasks
-    print("Startup: Starting bot polling...")
-    bot_task = asyncio.create_task(dp.start_polling(bot))
+    bot_task = None
+    if RUN_BOT_IN_API:
+        # Bitta jarayonli rejim: bot, scheduler va outbox API bilan birga ishlaydi
+        print("Startup: Starting scheduler and outbox...")
+        scheduler, outbox_task = await start_background(bot)
+        print("Startup: Starting bot polling...")
+        bot_task = asyncio.create_task(dp.start_polling(bot))
+    else:
+        print("Startup: Bot alohida jarayonda ishlaydi (python bot_worker.py)")
 
     # Create admin if not exists
     async with SessionLocal() as db:
@@ -57,16 +63,16 @@ async def lifespan(app: FastAPI):
         yield
     finally:
         print("Shutdown: Stopping scheduler and bot...")
-        scheduler.shutdown()
-        bot_task.cancel()
-        
+        if bot_task:
+            await stop_background(scheduler, outbox_task)
+            bot_task.cancel()
+            try:
+                await asyncio.wait([bot_task], timeout=2.0)
+            except Exception as e:
+                print(f"Cleanup error: {e}")
+
         await bot.session.close()
         
-        try:
-            await asyncio.wait([bot_task], timeout=2.0)
-        except Exception as e:
-            print(f"Cleanup error: {e}")
-        
         print("Shutdown: Complete.")
 
 app = FastAPI(lifespan=lifespan, title="Kassa API", version="2.0.0")
@@ -102,8 +108,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", LAST_WRITE_HEADER], # /crm/clients keyset sahifalash; replika uchun read-your-writes
 )
 
+# Yozgan so'rov javobiga X-Last-Write: mijoz uni qaytarib yuboradi va o'qishlari asosiy bazaga tushadi
+app.add_middleware(LastWriteMiddleware)
+
+# Katta JSON va CSV javoblarini siqish (sekin mobil internetdagi filiallar uchun)
+app.add_middleware(CompressionMiddleware)
+
+# So'rovlar metrikasi: latency, SQL soni, sekin so'rovlar logi (/metrics)
+install_sql_hooks(engine, read_engine)
+app.add_middleware(MetricsMiddleware)
+
 # Include Routers
 app.include_router(auth.router)
 app.include_router(inventory.router)
@@ -115,16 +132,57 @@ app.include_router(sales.router)
 app.include_router(audit.router)
 app.include_router(settings.router)
 app.include_router(suppliers.router)
+app.include_router(events.router)
 
 # Static files for invoices
 if not os.path.exists("uploads"):
     os.makedirs("uploads")
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+class UploadFiles(StaticFiles):
+    """Yuklangan fayllar nomi noyob (uuid yoki kontent xeshi) va o'zgarmaydi - brauzer uzoq keshlay oladi"""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+app.mount("/uploads", UploadFiles(directory="uploads"), name="uploads")
 
 @app.get('/favicon.ico', include_in_schema=False)
 async def favicon():
     return Response(content=b"", media_type="image/x-icon")
 
+# Prometheus uchun. METRICS_TOKEN berilgan bo'lsa "Authorization: Bearer <token>" talab qilinadi
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        return JSONResponse(status_code=401, content={"detail": "Ruxsat berilmagan"})
+
+    cache = response_cache.stats()
+    pool = pool_metrics.snapshot(engine.pool)
+    gauges = {
+        "kassa_cache_hits_total": ("Javoblar keshi: topildi", cache["hits"]),
+        "kassa_cache_misses_total": ("Javoblar keshi: topilmadi", cache["misses"]),
+        "kassa_cache_hit_ratio": ("Javoblar keshi: hit ulushi", cache["hit_rate"]),
+        "kassa_db_pool_checkouts_total": ("Pooldan olingan ulanishlar", pool["checkouts"]),
+        "kassa_db_pool_timeouts_total": ("Pool timeoutlari", pool["timeouts"]),
+        "kassa_db_pool_wait_p95_seconds": ("Ulanish kutish vaqti p95", pool["wait_p95_ms"] / 1000),
+        "kassa_db_pool_wait_max_seconds": ("Ulanish kutish vaqti max", pool["wait_max_ms"] / 1000),
+    }
+    bus = event_bus.stats()
+    gauges["kassa_sse_subscribers"] = ("Ochiq SSE ulanishlar", bus["subscribers"])
+    gauges["kassa_sse_events_total"] = ("Yuborilgan hodisalar", bus["published"])
+    gauges["kassa_sse_dropped_total"] = ("Navbati to'lgan ulanishlar (resync)", bus["dropped"])
+    compressed = compression_stats.snapshot()
+    gauges["kassa_compression_bytes_in_total"] = ("Siqishdan oldingi baytlar", compressed["bytes_in"])
+    gauges["kassa_compression_bytes_out_total"] = ("Siqilgan baytlar", compressed["bytes_out"])
+    gauges["kassa_compression_cache_hits_total"] = ("Siqilgan katalog keshi: topildi", compressed["cache_hits"])
+    if "checked_out" in pool:
+        gauges["kassa_db_pool_checked_out"] = ("Band ulanishlar", pool["checked_out"])
+        gauges["kassa_db_pool_saturation"] = ("Pool bandligi (0-1)", pool["saturation"])
+    return Response(content=metrics_registry.render(gauges), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def root():
     return {"message": "Kassa API is running", "version": "2.0.0"}
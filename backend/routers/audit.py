@@ -4,7 +4,7 @@ from sqlalchemy import select
 from sqlalchemy.orm import joinedload
 from typing import List, Optional
 
-from database import get_db, AuditLog, Employee
+from database import get_db, get_read_db, AuditLog, Employee
 from schemas import EmployeeOut # For reference if needed
 from core import get_current_user
 from pydantic import BaseModel, ConfigDict
@@ -32,7 +32,7 @@ async def get_audit_logs(
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
     current_user: Employee = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Barcha tizim amallari tarixini ko'rish (Faqat Admin uchun)"""
     if current_user.role != "admin":
@@ -69,7 +69,7 @@ async def export_audit_excel(
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
     current_user: Employee = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Audit jurnallarini Excel formatda yuklab olish"""
     if current_user.role != "admin":
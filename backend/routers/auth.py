@@ -6,9 +6,10 @@ from datetime import timedelta
 from typing import List, Optional
 
 from database import get_db, Employee
-from schemas import Token, EmployeeCreate, EmployeeOut, EmployeeUpdate
+from schemas import Token, EmployeeCreate, EmployeeOut, EmployeeUpdate, AttendanceLiveOut
 from core import verify_password, get_password_hash, create_access_token, get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES, limiter
 from routers.audit import log_action
+from utils.attendance import get_working_now
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -176,6 +177,26 @@ async def delete_employee(
     await db.commit()
     return None
 
+@router.get("/attendance/live", response_model=List[AttendanceLiveOut])
+async def get_attendance_live(
+    current_user: Employee = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Hozirda ishda bo'lgan xodimlar (botdagi "Kim ishda?" bilan bir xil)"""
+    if current_user.role not in ["admin", "manager"]:
+        raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
+
+    return [
+        AttendanceLiveOut(
+            employee_id=emp.id,
+            username=emp.username,
+            full_name=emp.full_name,
+            role=emp.role,
+            since=since
+        )
+        for emp, since in await get_working_now(db)
+    ]
+
 @router.get("/attendance")
 async def get_attendance(
     employee_id: Optional[int] = None,
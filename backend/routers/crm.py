@@ -1,19 +1,157 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, tuple_
 from typing import List, Optional
+from datetime import datetime
+from urllib.parse import urlencode
+import base64
 
-from database import get_db, Client, Employee
-from schemas import ClientCreate, ClientOut, ClientUpdate
+from database import get_db, get_read_db, Client, Employee, ClientLedger, ClientDebtAging, phone_key, name_key
+from schemas import ClientCreate, ClientOut, ClientUpdate, ClientLedgerOut, DebtReportOut, ClientBriefOut
 from core import get_current_user
 from routers.audit import log_action
+from utils.cache import response_cache
+from utils.idempotency import begin_idempotent, finish_idempotent
+from utils.fast_json import Projection, dumps, json_response
+from utils.events import event_bus
+from utils import shift_totals, client_ledger
+import json
 
 router = APIRouter(prefix="/crm", tags=["crm"])
 
+CLIENT_COLUMNS = Projection(Client, ClientOut)
+TYPEAHEAD_LIMIT = 20
+
+# sort parametri -> saralash ustuni (har biri (ustun, id) indeksiga ega)
+CLIENT_SORTS = {
+    "id": Client.id,
+    "name": Client.name_key,
+    "balance": Client.balance,
+    "debt_due_date": Client.debt_due_date,
+}
+
+
+def _prefix_range(column, prefix: str):
+    """LIKE 'abc%' o'rniga diapazon: column >= 'abc' AND column < 'abd' - oddiy indeks ishlatiladi.
+
+    Faqat baytlar bo'yicha collation da to'g'ri (SQLite BINARY, PostgreSQL da name_key "C" collation bilan)
+    """
+    return (column >= prefix) & (column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def client_search(q: str):
+    """(ustun, prefiks): raqamlar bo'lsa - telefon boshi (phone_key, +998 siz), aks holda ism boshi (name_key)"""
+    q = q.strip()
+    digits = "".join(filter(str.isdigit, q))
+    if len(digits) >= 2 and not any(ch.isalpha() for ch in q):
+        if digits.startswith("998") and (q.startswith("+") or len(digits) > 9):
+            digits = digits[3:]
+        return (Client.phone_key, digits[-9:]) if digits else None
+    key = name_key(q)
+    return (Client.name_key, key) if key else None
+
+
+def _encode_cursor(value, row_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(dumps([value, row_id])).decode()
+
+
+def _decode_cursor(cursor: str, sort: str):
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if sort == "debt_due_date":
+            value = datetime.fromisoformat(value)
+        return value, int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Noto'g'ri cursor")
+
+
+async def clients_json(
+    db: AsyncSession,
+    q: Optional[str] = None,
+    sort: str = "id",
+    order: str = "asc",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+):
+    """(JSON, keyingi sahifa cursori). Keyset: WHERE (ustun, id) > (oxirgi qiymat, oxirgi id) - OFFSET siz"""
+    search = client_search(q) if q else None
+    if q and search is None:
+        # "+998", "+" kabi kalitsiz qidiruv butun jadvalga aylanib ketmasin (typeahead dagi kabi)
+        return b"[]", None
+    column = CLIENT_SORTS[sort]
+    stmt = select(*CLIENT_COLUMNS.columns, column)
+    if search is not None:
+        stmt = stmt.where(_prefix_range(*search))
+    if sort == "debt_due_date":
+        stmt = stmt.where(Client.debt_due_date.isnot(None))
+    key = tuple_(column, Client.id) if sort != "id" else Client.id
+    if cursor:
+        value, last_id = _decode_cursor(cursor, sort)
+        last = tuple_(value, last_id) if sort != "id" else last_id
+        stmt = stmt.where(key > last if order == "asc" else key < last)
+    if order == "asc":
+        stmt = stmt.order_by(column.asc(), Client.id.asc()) if sort != "id" else stmt.order_by(Client.id.asc())
+    else:
+        stmt = stmt.order_by(column.desc(), Client.id.desc()) if sort != "id" else stmt.order_by(Client.id.desc())
+    if limit:
+        stmt = stmt.limit(limit + 1)
+    rows = (await db.execute(stmt)).all()
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        last_row = rows[-1]
+        next_cursor = _encode_cursor(last_row[-1], last_row[CLIENT_COLUMNS.id_index])
+    return dumps(CLIENT_COLUMNS.build_all(rows)), next_cursor
+
+
 @router.get("/clients", response_model=List[ClientOut])
-async def get_clients(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Client))
-    return result.scalars().all()
+async def get_clients(
+    q: Optional[str] = Query(None, max_length=100, description="Ism yoki telefon boshi"),
+    sort: str = Query("id", pattern="^(id|name|balance|debt_due_date)$",
+                      description="debt_due_date - faqat qarz muddati belgilangan mijozlar"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Berilmasa - hammasi (eski xatti-harakat)"),
+    cursor: Optional[str] = Query(None, description="Oldingi javobning X-Next-Cursor headeri"),
+    current_user: Employee = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Mijozlar ro'yxati. Javob - oddiy massiv, keyingi sahifa bo'lsa X-Next-Cursor headerida.
+
+    Qidiruvsiz to'liq ro'yxatlar keshlanadi (kalitda sort/order bor), sahifalar va qidiruv - indeksli so'rov.
+    """
+    cacheable = not q and not limit and not cursor
+    params = urlencode({"sort": sort, "order": order})
+    if cacheable:
+        cached = await response_cache.get("crm/clients", "public", params)
+        if cached is not None:
+            return cached
+    body, next_cursor = await clients_json(db, q, sort, order, limit, cursor)
+    if cacheable:
+        return await response_cache.store_bytes("crm/clients", "public", body, params)
+    return json_response(body, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
+
+
+@router.get("/clients/typeahead", response_model=List[ClientBriefOut])
+async def client_typeahead(
+    q: str = Query(..., min_length=1, max_length=100, description="Ism yoki telefon boshi"),
+    limit: int = Query(TYPEAHEAD_LIMIT, ge=1, le=TYPEAHEAD_LIMIT),
+    current_user: Employee = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """POS mijoz tanlash uchun: faqat id, ism, telefon - ko'pi bilan 20 ta"""
+    search = client_search(q)
+    if search is None:
+        return json_response(b"[]")
+    column, prefix = search
+    result = await db.execute(
+        select(Client.id, Client.name, Client.phone)
+        .where(_prefix_range(column, prefix))
+        .order_by(column, Client.id)
+        .limit(limit)
+    )
+    return json_response([dict(row._mapping) for row in result.all()])
 
 @router.post("/clients", response_model=ClientOut)
 async def create_client(
@@ -22,16 +160,92 @@ async def create_client(
     db: AsyncSession = Depends(get_db)
 ):
     db_client = Client(**client.model_dump())
+    # Boshlang'ich qarz yoki oldindan to'lov ham hisobga yoziladi
+    opening_balance, db_client.balance = db_client.balance or 0, 0
     db.add(db_client)
+    await db.flush()
+    await client_ledger.post(db, db_client.id, opening_balance, "opening", created_by=current_user.id)
     
     await log_action(db, current_user.id, "YANGI_MIJOZ", f"Mijoz qo'shildi: {db_client.name} (Tel: {db_client.phone or '-'})")
     
     await db.commit()
     await db.refresh(db_client)
+    await response_cache.invalidate("crm/clients")
     return db_client
 
+@router.get("/clients/by-phone", response_model=List[ClientOut])
+async def find_clients_by_phone(
+    phone: str = Query(..., description="Istalgan formatda: +998 90 123-45-67, 901234567"),
+    current_user: Employee = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Telefon raqami bo'yicha mijoz qidirish (oxirgi 9 ta raqam, indeksli)"""
+    key = phone_key(phone)
+    if not key or len(key) < 9:
+        raise HTTPException(status_code=400, detail="Telefon raqami kamida 9 ta raqamdan iborat bo'lishi kerak")
+    result = await db.execute(select(Client).where(Client.phone_key == key).order_by(Client.id))
+    return result.scalars().all()
+
+@router.get("/debts", response_model=DebtReportOut)
+async def get_debt_report(
+    older_than: Optional[int] = Query(None, ge=0, description="Faqat shu kundan eski qarzi bor mijozlar (30 yoki 60)"),
+    current_user: Employee = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Qarzlar yoshi bo'yicha hisobot (0-30 / 31-60 / 60+ kun).
+
+    client_debt_aging jadvalidan bitta so'rov - savdo va to'lovlar qayta yig'ilmaydi.
+    """
+    if current_user.role not in ["admin", "manager"]:
+        raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
+
+    query = (
+        select(
+            ClientDebtAging.client_id, Client.name, Client.phone, Client.balance, Client.debt_due_date,
+            ClientDebtAging.total_debt, ClientDebtAging.days_0_30, ClientDebtAging.days_31_60,
+            ClientDebtAging.days_60_plus, ClientDebtAging.oldest_debt_at, ClientDebtAging.updated_at
+        )
+        .join(Client, Client.id == ClientDebtAging.client_id)
+        .order_by(ClientDebtAging.total_debt.desc())
+    )
+    if older_than is not None and older_than >= 60:
+        query = query.where(ClientDebtAging.days_60_plus > 0)
+    elif older_than is not None and older_than >= 30:
+        query = query.where(ClientDebtAging.days_31_60 + ClientDebtAging.days_60_plus > 0)
+
+    clients = [dict(row._mapping) for row in (await db.execute(query)).all()]
+    report = {"client_count": len(clients)}
+    for field in ("total_debt", "days_0_30", "days_31_60", "days_60_plus"):
+        report[field] = sum(row[field] or 0 for row in clients)
+    report["clients"] = clients
+    return json_response(report)
+
+@router.get("/clients/{client_id}/ledger", response_model=List[ClientLedgerOut])
+async def get_client_ledger(
+    client_id: int,
+    before_id: Optional[int] = Query(None, description="Keyingi sahifa: oldingi javobdagi oxirgi id"),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: Employee = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Mijoz hisobi: yangilaridan eskisiga, har bir yozuvdan keyingi balans bilan"""
+    if current_user.role not in ["admin", "manager"]:
+        raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
+    if not await db.scalar(select(Client.id).where(Client.id == client_id)):
+        raise HTTPException(status_code=404, detail="Mijoz topilmadi")
+
+    query = select(ClientLedger).where(ClientLedger.client_id == client_id)
+    if before_id is not None:
+        query = query.where(ClientLedger.id < before_id)
+    result = await db.execute(query.order_by(ClientLedger.id.desc()).limit(limit))
+    return result.scalars().all()
+
 @router.get("/clients/{client_id}", response_model=ClientOut)
-async def get_client(client_id: int, db: AsyncSession = Depends(get_db)):
+async def get_client(
+    client_id: int,
+    current_user: Employee = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
     result = await db.execute(select(Client).where(Client.id == client_id))
     client = result.scalars().first()
     if not client:
@@ -61,6 +275,7 @@ async def update_client(
     
     await db.commit()
     await db.refresh(db_client)
+    await response_cache.invalidate("crm/clients")
     return db_client
 
 @router.delete("/clients/{client_id}")
@@ -83,6 +298,7 @@ async def delete_client(
     await db.delete(db_client)
     await log_action(db, current_user.id, "MIJOZ_OCHIRILDI", f"Mijoz o'chirildi: {db_client.name} (ID: {client_id})")
     await db.commit()
+    await response_cache.invalidate("crm/clients")
     return {"message": "Client deleted"}
 
 from schemas import PaymentCreate
@@ -92,9 +308,15 @@ from database import Payment, Shift
 async def pay_debt(
     client_id: int,
     payment_data: PaymentCreate,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None),
     current_user: Employee = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
+    replay, idem_record = await begin_idempotent(db, "crm_pay", current_user.id, idempotency_key, request)
+    if replay is not None:
+        return replay
+
     # 1. Mijozni tekshirish
     result = await db.execute(select(Client).where(Client.id == client_id))
     client = result.scalars().first()
@@ -107,10 +329,7 @@ async def pay_debt(
     )
     shift = shift_result.scalars().first()
 
-    # 3. Balansni yangilash (Qarz kamayadi, ya'ni balans oshadi)
-    client.balance += payment_data.amount
-
-    # 4. To'lov tarixini yaratish
+    # 3. To'lov tarixini yaratish
     db_payment = Payment(
         client_id=client_id,
         amount=payment_data.amount,
@@ -121,10 +340,25 @@ async def pay_debt(
     )
     
     db.add(db_payment)
+    await db.flush()
+
+    # 4. Balansni yangilash (Qarz kamayadi, ya'ni balans oshadi) - eng eski qarzlar birinchi yopiladi
+    await client_ledger.post(db, client_id, payment_data.amount, "payment", payment_id=db_payment.id, created_by=current_user.id)
+    db_payment.shift_id = await shift_totals.add_debt_payment(db, db_payment.shift_id, payment_data.amount, payment_data.payment_method)
     
     await log_action(db, current_user.id, "MIJOZ_TOLOV", f"Mijoz: {client.name}. Summa: {payment_data.amount:,.0f} so'm. Usul: {payment_data.payment_method}")
     
+    response = {"message": "To'lov qabul qilindi", "new_balance": client.balance}
+    finish_idempotent(idem_record, json.dumps(response))
+
     await db.commit()
-    await db.refresh(client)
+    await response_cache.invalidate("crm/clients")
+    event_bus.publish("debt_payment", {
+        "client_id": client_id,
+        "amount": payment_data.amount,
+        "payment_method": payment_data.payment_method,
+        "new_balance": response["new_balance"],
+        "shift_id": db_payment.shift_id
+    }, current_user.id, current_user.role)
     
-    return {"message": "To'lov qabul qilindi", "new_balance": client.balance}
+    return response
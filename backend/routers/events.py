@@ -0,0 +1,94 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from jose import JWTError, jwt
+from sqlalchemy import select
+
+from database import SessionLocal, Employee
+from core import get_current_user, oauth2_scheme, SECRET_KEY, ALGORITHM
+from utils.events import event_bus
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+EVENT_TICKET_SECONDS = int(os.getenv("EVENT_TICKET_SECONDS", "60"))  # Oqimni ochish uchun chipta muddati
+TICKET_TYPE = "sse"
+
+
+def _token_exp(token: str) -> Optional[float]:
+    try:
+        return jwt.get_unverified_claims(token).get("exp")
+    except JWTError:
+        return None
+
+
+@router.post("/ticket")
+async def create_ticket(
+    token: str = Depends(oauth2_scheme),
+    current_user: Employee = Depends(get_current_user)
+):
+    """SSE uchun qisqa muddatli chipta.
+
+    EventSource header yubora olmaydi - access token URL da loglarga tushmasligi uchun
+    ?ticket= ga faqat shu chipta qo'yiladi. Oqim access token muddati bilan birga tugaydi.
+    """
+    if current_user.role not in ["admin", "manager", "cashier"]:
+        raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
+    ticket = jwt.encode({
+        "sub": current_user.username,
+        "typ": TICKET_TYPE,
+        "session_exp": _token_exp(token),
+        "exp": datetime.now(timezone.utc) + timedelta(seconds=EVENT_TICKET_SECONDS)
+    }, SECRET_KEY, algorithm=ALGORITHM)
+    return {"ticket": ticket, "expires_in": EVENT_TICKET_SECONDS}
+
+
+@router.get("/stream")
+async def event_stream(request: Request, ticket: Optional[str] = None):
+    """Dashboard va smena jamlari uchun SSE oqimi.
+
+    Brauzer ?ticket= (POST /events/ticket), boshqa mijozlar Authorization: Bearer bilan ulanadi.
+    Hodisalar: sale, refund, expense, debt_payment, resync (to'liq qayta yuklash kerak),
+    expired (token muddati tugadi yoki xodim bloklandi - yangi chipta bilan qayta ulanish kerak).
+    """
+    credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials")
+    # Oqim uzoq yashaydi - DB sessiyasini faqat foydalanuvchini tekshirish uchun ochamiz
+    async with SessionLocal() as db:
+        if ticket:
+            try:
+                payload = jwt.decode(ticket, SECRET_KEY, algorithms=[ALGORITHM])
+            except JWTError:
+                raise credentials_exception
+            if payload.get("typ") != TICKET_TYPE or not payload.get("sub"):
+                raise credentials_exception
+            expires_at = payload.get("session_exp")
+            user = (await db.execute(select(Employee).where(Employee.username == payload["sub"]))).scalars().first()
+            if user is None:
+                raise credentials_exception
+            if not user.is_active:
+                raise HTTPException(status_code=403, detail="Foydalanuvchi faol emas (bloklangan)")
+        else:
+            auth = request.headers.get("authorization", "")
+            token = auth[7:] if auth.lower().startswith("bearer ") else None
+            if not token:
+                raise credentials_exception
+            user = await get_current_user(token=token, db=db)
+            expires_at = _token_exp(token)
+
+    if user.role not in ["admin", "manager", "cashier"]:
+        raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
+
+    user_id, role = user.id, user.role
+
+    async def still_allowed() -> bool:
+        async with SessionLocal() as db:
+            row = (await db.execute(select(Employee.is_active, Employee.role).where(Employee.id == user_id))).first()
+        return row is not None and row.is_active and row.role == role
+
+    return StreamingResponse(
+        event_bus.stream(user_id, role, expires_at=expires_at, still_allowed=still_allowed),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
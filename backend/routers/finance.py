@@ -1,19 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, case
 from typing import List, Optional
 from datetime import datetime, timezone, timedelta
 
-from database import get_db, Expense, Payment, Employee, Client, Product, Sale, SaleItem, StoreSetting, Task
-from schemas import ExpenseCreate, ExpenseOut, PaymentCreate
+from database import get_db, get_read_db, Expense, Payment, Employee, Client, Product, Sale, SaleItem, Task
+from schemas import ExpenseCreate, ExpenseOut, PaymentCreate, ExpenseCategoryOut
 from core import get_current_user
 # from sqlalchemy import func # Already imported above
 from sqlalchemy.orm import joinedload
 from routers.audit import log_action
+from utils.cache import response_cache
+from utils.settings_provider import settings_provider
+from utils.idempotency import begin_idempotent, finish_idempotent
+from utils.events import event_bus
+from utils import client_ledger
+import json
+from pydantic import TypeAdapter
 import io
 
 router = APIRouter(prefix="/finance", tags=["finance"])
 
+EXPENSE_CATEGORIES_ADAPTER = TypeAdapter(List[ExpenseCategoryOut])
+
+# Sof tushum va miqdor: qisman qaytarilgan savdolar "completed" bo'lib qoladi, qaytarilgan qismi ayriladi
+NET_SALE_AMOUNT = Sale.total_amount - func.coalesce(Sale.refunded_amount, 0)
+NET_ITEM_QUANTITY = SaleItem.quantity - func.coalesce(SaleItem.refunded_quantity, 0)
+
 def parse_date(date_val: Optional[str], default_time=datetime.min.time()):
     if not date_val:
         return None
@@ -37,7 +50,7 @@ async def get_stats(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     current_user: Employee = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     # Allow admin, manager, and cashier (but cashier is restricted)
     if current_user.role not in ["admin", "manager", "cashier"]:
@@ -63,7 +76,7 @@ async def get_stats(
     if not end_date:
         end_date = datetime.now(timezone.utc)
     
-    sales_query = select(func.sum(Sale.total_amount)).where(
+    sales_query = select(func.sum(NET_SALE_AMOUNT)).where(
         Sale.created_at >= start_date,
         Sale.created_at <= end_date,
         Sale.status == "completed"
@@ -76,7 +89,8 @@ async def get_stats(
     
     # 1.1 Total Cost (Buy Price * Quantity)
     cost_query = (
-        select(func.sum(SaleItem.quantity * Product.buy_price))
+        select(func.sum(NET_ITEM_QUANTITY * Product.buy_price))
+        .select_from(SaleItem)
         .join(Product, SaleItem.product_id == Product.id)
         .join(Sale, SaleItem.sale_id == Sale.id)
         .where(
@@ -116,9 +130,8 @@ async def get_stats(
     client_count = client_result.scalar() or 0
     
     # 3. Low Stock Items List
-    settings_result = await db.execute(select(StoreSetting))
-    settings = settings_result.scalars().first()
-    threshold = settings.low_stock_threshold if settings else 5
+    settings = await settings_provider.get(db)
+    threshold = settings.low_stock_threshold
 
     stock_query = select(Product).where(Product.stock <= threshold).limit(10)
     stock_result = await db.execute(stock_query)
@@ -155,7 +168,7 @@ async def get_expenses_by_category(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     current_user: Employee = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     if current_user.role not in ["admin", "manager"]:
         raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
@@ -180,7 +193,7 @@ async def get_employee_performance(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     current_user: Employee = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Get sales and task statistics for all employees (Admin/Manager only)"""
     if current_user.role not in ["admin", "manager"]:
@@ -207,7 +220,7 @@ async def get_employee_performance(
     for emp in employees:
         # Sales count and total
         sales_query = (
-            select(func.count(Sale.id), func.sum(Sale.total_amount))
+            select(func.count(Sale.id), func.sum(NET_SALE_AMOUNT))
             .where(Sale.cashier_id == emp.id, Sale.created_at >= start_date_parsed, Sale.created_at <= end_date_parsed)
         )
         sales_result = await db.execute(sales_query)
@@ -241,7 +254,7 @@ async def get_employee_performance(
 async def get_profit_chart(
     days: int = 7,
     current_user: Employee = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     if current_user.role not in ["admin", "manager"]:
         raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
@@ -256,7 +269,7 @@ async def get_profit_chart(
         day_end = datetime.combine(day, datetime.max.time())
         
         # Revenue
-        rev_query = select(func.sum(Sale.total_amount)).where(
+        rev_query = select(func.sum(NET_SALE_AMOUNT)).where(
             Sale.created_at >= day_start,
             Sale.created_at <= day_end,
             Sale.status == "completed"
@@ -274,7 +287,8 @@ async def get_profit_chart(
         
         # Cost of Goods Sold (COGS)
         cost_query = (
-            select(func.sum(SaleItem.quantity * Product.buy_price))
+            select(func.sum(NET_ITEM_QUANTITY * Product.buy_price))
+            .select_from(SaleItem)
             .join(Product, SaleItem.product_id == Product.id)
             .join(Sale, SaleItem.sale_id == Sale.id)
             .where(
@@ -306,7 +320,7 @@ async def get_profit_chart(
 async def get_dashboard_chart(
     employee_id: Optional[int] = None,
     current_user: Employee = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     # Cashier can only see their own chart
     if current_user.role == "cashier":
@@ -323,7 +337,7 @@ async def get_dashboard_chart(
         day_start = datetime.combine(day, datetime.min.time())
         day_end = datetime.combine(day, datetime.max.time())
         
-        query = select(func.sum(Sale.total_amount)).where(
+        query = select(func.sum(NET_SALE_AMOUNT)).where(
             Sale.created_at >= day_start,
             Sale.created_at <= day_end,
             Sale.status == "completed"
@@ -345,17 +359,17 @@ async def get_top_products(
     employee_id: Optional[int] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     start_date = parse_date(start_date, datetime.min.time())
     end_date = parse_date(end_date, datetime.max.time())
     query = (
-        select(Product.name, func.sum(SaleItem.quantity).label("total_qty"))
+        select(Product.name, func.sum(NET_ITEM_QUANTITY).label("total_qty"))
         .join(SaleItem, Product.id == SaleItem.product_id)
         .join(Sale, Sale.id == SaleItem.sale_id)
         .where(Sale.status == "completed")
         .group_by(Product.id)
-        .order_by(func.sum(SaleItem.quantity).desc())
+        .order_by(func.sum(NET_ITEM_QUANTITY).desc())
         .limit(limit)
     )
     if employee_id:
@@ -375,7 +389,7 @@ async def get_expenses(
     employee_id: Optional[int] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     start_date = parse_date(start_date, datetime.min.time())
     end_date = parse_date(end_date, datetime.max.time())
@@ -409,14 +423,27 @@ async def create_expense(
 
     await db.commit()
     await db.refresh(db_expense)
+    event_bus.publish("expense", {
+        "expense_id": db_expense.id,
+        "amount": db_expense.amount,
+        "category": db_expense.category,
+        "created_by": db_expense.created_by,
+        "created_at": db_expense.created_at
+    }, current_user.id, current_user.role)
     return db_expense
 
 @router.post("/payments")
 async def create_payment(
     payment: PaymentCreate,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None),
     current_user: Employee = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
+    replay, idem_record = await begin_idempotent(db, "finance_payment", current_user.id, idempotency_key, request)
+    if replay is not None:
+        return replay
+
     # Payment usually means client paying back debt
     db_payment = Payment(
         **payment.model_dump(),
@@ -424,17 +451,22 @@ async def create_payment(
         created_at=datetime.now(timezone.utc)
     )
     db.add(db_payment)
+    await db.flush()
     
-    # Update client balance
+    # Update client balance (mijoz hisobi orqali)
     result = await db.execute(select(Client).where(Client.id == payment.client_id))
     client = result.scalars().first()
     if client:
-        client.balance += payment.amount
+        await client_ledger.post(db, client.id, payment.amount, "payment", payment_id=db_payment.id, created_by=current_user.id)
         
     await log_action(db, current_user.id, "MIJOZ_TOLOV", f"Mijoz: {client.name if client else 'Nomalum'}. Summa: {payment.amount:,.0f} so'm. Usul: {payment.payment_method}")
         
+    response = {"status": "success", "message": "To'lov qabul qilindi"}
+    finish_idempotent(idem_record, json.dumps(response))
+
     await db.commit()
-    return {"status": "success", "message": "To'lov qabul qilindi"}
+    await response_cache.invalidate("crm/clients")
+    return response
 
 import csv
 import io
@@ -445,7 +477,7 @@ async def export_sales(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     current_user: Employee = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
@@ -499,7 +531,7 @@ async def export_sales_excel(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     current_user: Employee = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
@@ -550,10 +582,11 @@ async def export_sales_excel(
         headers={"Content-Disposition": f"attachment; filename=sotuvlar_{datetime.now().strftime('%Y%m%d')}.xlsx"}
     )
 
-@router.get("/categories")
+@router.get("/categories", response_model=List[ExpenseCategoryOut])
 async def get_expense_categories(db: AsyncSession = Depends(get_db)):
-    # You might have an ExpenseCategory table, let's check database.py
-    # From database.py: class ExpenseCategory(Base): __tablename__ = "expense_categories"
+    cached = await response_cache.get("finance/categories", "public")
+    if cached is not None:
+        return cached
     from database import ExpenseCategory
     result = await db.execute(select(ExpenseCategory))
-    return result.scalars().all()
+    return await response_cache.store("finance/categories", "public", EXPENSE_CATEGORIES_ADAPTER, result.scalars().all())
@@ -3,14 +3,49 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, delete
 from typing import List, Optional
 
-from database import get_db, Product, Category, Employee, Supply, StockMove
-from schemas import ProductCreate, ProductOut, CategoryCreate, CategoryOut, SupplyCreate, SupplyOut, StockMoveOut
+from database import get_db, get_read_db, Product, Category, Employee, Supply, StockMove, Supplier, ReorderSuggestion
+from schemas import ProductCreate, ProductOut, CategoryCreate, CategoryOut, SupplyCreate, SupplyOut, StockMoveOut, SupplierReorderOut
 from core import get_current_user
 
 from routers.audit import log_action
+from utils.cache import response_cache
+from utils.fast_json import Projection, dumps, json_response
+from pydantic import TypeAdapter
 
 router = APIRouter(prefix="/inventory", tags=["inventory"])
 
+CATEGORIES_ADAPTER = TypeAdapter(List[CategoryOut])
+
+# Katta ro'yxatlar uchun ustunlar (ORM obyektlari yaratilmaydi, javob to'g'ridan-to'g'ri JSON baytlarga yoziladi)
+PRODUCT_COLUMNS = Projection(Product, ProductOut)
+STOCK_MOVE_COLUMNS = Projection(StockMove, StockMoveOut, nested=("product",))
+
+
+async def products_json(db: AsyncSession, category_id: Optional[int] = None, query: Optional[str] = None) -> bytes:
+    stmt = select(*PRODUCT_COLUMNS.columns)
+    if category_id:
+        stmt = stmt.where(Product.category_id == category_id)
+    if query:
+        stmt = stmt.where(Product.name.contains(query) | Product.barcode.contains(query))
+    result = await db.execute(stmt)
+    return dumps(PRODUCT_COLUMNS.build_all(result.all()))
+
+
+async def stock_logs_json(db: AsyncSession, product_id: Optional[int] = None) -> bytes:
+    stmt = (
+        select(*STOCK_MOVE_COLUMNS.columns, *PRODUCT_COLUMNS.columns)
+        .outerjoin(Product, StockMove.product_id == Product.id)
+        .order_by(StockMove.created_at.desc())
+    )
+    if product_id:
+        stmt = stmt.where(StockMove.product_id == product_id)
+    result = await db.execute(stmt)
+    offset = STOCK_MOVE_COLUMNS.width
+    return dumps([
+        STOCK_MOVE_COLUMNS.build(row, product=PRODUCT_COLUMNS.build_optional(row, offset))
+        for row in result.all()
+    ])
+
 # --- SUPPLIES ---
 @router.post("/supplies", response_model=SupplyOut)
 async def create_supply(
@@ -71,17 +106,72 @@ async def get_supplies(
 async def get_stock_logs(
     product_id: Optional[int] = None,
     current_user: Employee = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    if current_user.role not in ["admin", "manager", "warehouse"]:
+        raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
+
+    return json_response(await stock_logs_json(db, product_id))
+
+# --- REORDER SUGGESTIONS ---
+@router.get("/reorder-suggestions", response_model=List[SupplierReorderOut])
+async def get_reorder_suggestions(
+    supplier_id: Optional[int] = None,
+    only_needed: bool = True,
+    current_user: Employee = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
+    """Oldindan hisoblangan buyurtma tavsiyalari (firmalar bo'yicha guruhlangan)"""
     if current_user.role not in ["admin", "manager", "warehouse"]:
         raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
-        
-    stmt = select(StockMove).options(joinedload(StockMove.product), joinedload(StockMove.user)).order_by(StockMove.created_at.desc())
-    if product_id:
-        stmt = stmt.where(StockMove.product_id == product_id)
-        
+
+    stmt = (
+        select(ReorderSuggestion, Product.name, Product.unit, Supplier.name)
+        .join(Product, ReorderSuggestion.product_id == Product.id)
+        .outerjoin(Supplier, ReorderSuggestion.supplier_id == Supplier.id)
+        .order_by(ReorderSuggestion.supplier_id, ReorderSuggestion.days_of_cover)
+    )
+    if supplier_id:
+        stmt = stmt.where(ReorderSuggestion.supplier_id == supplier_id)
+    if only_needed:
+        stmt = stmt.where(ReorderSuggestion.reorder_quantity > 0)
+
     result = await db.execute(stmt)
-    return result.scalars().all()
+
+    groups = {}
+    for suggestion, product_name, unit, supplier_name in result.all():
+        group = groups.setdefault(suggestion.supplier_id, {
+            "supplier_id": suggestion.supplier_id,
+            "supplier_name": supplier_name,
+            "total_quantity": 0,
+            "items": []
+        })
+        group["total_quantity"] += suggestion.reorder_quantity
+        group["items"].append({
+            "product_id": suggestion.product_id,
+            "product_name": product_name,
+            "unit": unit,
+            "stock": suggestion.stock,
+            "daily_velocity": suggestion.daily_velocity,
+            "days_of_cover": suggestion.days_of_cover,
+            "reorder_quantity": suggestion.reorder_quantity,
+            "computed_at": suggestion.computed_at
+        })
+    return list(groups.values())
+
+@router.post("/reorder-suggestions/refresh")
+async def refresh_reorder(
+    current_user: Employee = Depends(get_current_user)
+):
+    """Tavsiyalarni qo'lda qayta hisoblash (Admin/Menejer)"""
+    if current_user.role not in ["admin", "manager"]:
+        raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
+
+    from utils.reorder import refresh_reorder_suggestions
+    count = await refresh_reorder_suggestions()
+    if count is None:
+        raise HTTPException(status_code=500, detail="Tavsiyalarni hisoblashda xatolik yuz berdi")
+    return {"status": "success", "count": count}
 
 # --- PRODUCTS ---
 @router.get("/products", response_model=List[ProductOut])
@@ -90,14 +180,7 @@ async def get_products(
     query: Optional[str] = None,
     db: AsyncSession = Depends(get_db)
 ):
-    stmt = select(Product)
-    if category_id:
-        stmt = stmt.where(Product.category_id == category_id)
-    if query:
-        stmt = stmt.where(Product.name.contains(query) | Product.barcode.contains(query))
-    
-    result = await db.execute(stmt)
-    return result.scalars().all()
+    return json_response(await products_json(db, category_id, query))
 
 @router.post("/products", response_model=ProductOut)
 async def create_product(
@@ -113,6 +196,7 @@ async def create_product(
     
     # Stock Log if initial stock > 0
     if db_product.stock > 0:
+        await db.flush()  # product.id kerak
         db_move = StockMove(
             product_id=db_product.id,
             quantity=db_product.stock,
@@ -199,8 +283,11 @@ async def delete_product(
 # --- CATEGORIES ---
 @router.get("/categories", response_model=List[CategoryOut])
 async def get_categories(db: AsyncSession = Depends(get_db)):
+    cached = await response_cache.get("inventory/categories", "public")
+    if cached is not None:
+        return cached
     result = await db.execute(select(Category))
-    return result.scalars().all()
+    return await response_cache.store("inventory/categories", "public", CATEGORIES_ADAPTER, result.scalars().all())
 
 @router.post("/categories", response_model=CategoryOut)
 async def create_category(
@@ -216,6 +303,7 @@ async def create_category(
     await log_action(db, current_user.id, "YANGI_KATEGORIYA", f"Kategoriya: {category.name}")
     await db.commit()
     await db.refresh(db_category)
+    await response_cache.invalidate("inventory/categories")
     return db_category
 @router.post("/products/{product_id}/toggle-favorite", response_model=ProductOut)
 async def toggle_favorite(
@@ -7,10 +7,12 @@ from datetime import datetime, timezone, date, time
 
 
 # ... (imports)
-from database import get_db, Sale, SaleItem, Product, Shift, Employee, Client
-from schemas import SaleCreate, SaleOut, ShiftOpen, ShiftClose, ShiftOut
+from database import get_db, get_read_db, Sale, SaleItem, Product, Shift, Employee, Client
+from schemas import SaleCreate, SaleOut, ShiftOpen, ShiftClose, ShiftOut, ShiftCloseOut
 from core import get_current_user
 from routers.audit import log_action
+from utils.outbox import enqueue_message
+from utils import shift_totals
 
 router = APIRouter(prefix="/pos", tags=["pos"])
 
@@ -23,7 +25,7 @@ async def get_shifts_history(
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
     current_user: Employee = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Get history of shifts. Admins see all, others see only their own."""
     query = select(Shift).options(joinedload(Shift.cashier))
@@ -53,35 +55,12 @@ async def get_active_shift(
     db: AsyncSession = Depends(get_db)
 ):
     """Check if the current user has an active (open) shift and return it with totals."""
-    from sqlalchemy import func
-    from database import Sale
-    
+    # Jamlar smena qatorida saqlanadi (savdo/qaytarish/qarz to'lovida yangilanadi) - savdolarni qayta yig'ish shart emas
     result = await db.execute(
         select(Shift)
         .where(Shift.cashier_id == current_user.id, Shift.status == "open")
     )
-    shift = result.scalars().first()
-    
-    if shift:
-        # Calculate totals from sales since the shift started
-        sales_query = select(
-            func.sum(Sale.cash_amount).label("total_cash"),
-            func.sum(Sale.card_amount + Sale.transfer_amount).label("total_card"),
-            func.sum(Sale.debt_amount).label("total_debt")
-        ).where(
-            Sale.cashier_id == current_user.id,
-            Sale.created_at >= shift.opened_at,
-            Sale.status == "completed"
-        )
-        
-        sales_result = await db.execute(sales_query)
-        totals = sales_result.one()
-        
-        shift.total_cash = totals.total_cash or 0
-        shift.total_card = totals.total_card or 0
-        shift.total_debt = totals.total_debt or 0
-        
-    return shift
+    return result.scalars().first()
 
 @router.post("/shifts/open", response_model=ShiftOut)
 async def open_shift(
@@ -101,7 +80,7 @@ async def open_shift(
         cashier_id=current_user.id,
         opening_balance=shift_data.opening_balance,
         status="open",
-        opened_at=datetime.now()
+        opened_at=datetime.now(timezone.utc)  # savdolar kabi UTC - offline savdo smena oynasiga shu bo'yicha tushadi
     )
     db.add(db_shift)
     
@@ -114,52 +93,63 @@ async def open_shift(
     result = await db.execute(select(Shift).where(Shift.id == db_shift.id).options(joinedload(Shift.cashier)))
     return result.scalars().first()
 
-@router.post("/shifts/close", response_model=ShiftOut)
+@router.post("/shifts/close", response_model=ShiftCloseOut)
 async def close_shift(
     shift_data: ShiftClose,
     current_user: Employee = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """Close the currently active shift."""
-    result = await db.execute(
-        select(Shift)
+    # Avval bitta shartli UPDATE bilan yopamiz (SQLite da ham ishlaydi - with_for_update u yerda hech narsa qilmaydi).
+    # Shundan keyin savdo va to'lovlar bu smenaga biriktirilmaydi (shift_totals._attachable),
+    # jamlar esa yopilgandan keyin hisoblanadi - parallel savdo Z-hisobotdan tushib qolmaydi
+    open_shift = (
+        select(Shift.id)
         .where(Shift.cashier_id == current_user.id, Shift.status == "open")
+        .limit(1)
+        .scalar_subquery()
     )
-    db_shift = result.scalars().first()
-    
-    if not db_shift:
+    shift_id = await db.scalar(
+        update(Shift)
+        .where(Shift.id == open_shift, Shift.status == "open")
+        .values(status="closed", closed_at=datetime.now(timezone.utc), closing_balance=shift_data.closing_balance)
+        .returning(Shift.id)
+        .execution_options(synchronize_session=False)
+    )
+    if not shift_id:
         raise HTTPException(status_code=404, detail="Ochiq smena topilmadi")
+    result = await db.execute(select(Shift).where(Shift.id == shift_id).execution_options(populate_existing=True))
+    db_shift = result.scalars().first()
 
-    db_shift.closing_balance = shift_data.closing_balance
-    db_shift.closed_at = datetime.now()
-    db_shift.status = "closed"
-    
-    await log_action(db, current_user.id, "SMENA_YOPILDI", f"Yakuniy balans: {shift_data.closing_balance:,.0f} so'm")
+    # Joriy jamlarni to'liq agregat bilan tekshirish (farq bo'lsa - agregat bo'yicha tuzatiladi)
+    discrepancies = await shift_totals.reconcile(db, db_shift)
+    if discrepancies:
+        print(f"⚠️ Smena #{db_shift.id} jamlari agregatdan farq qildi: {discrepancies}")
+        await log_action(db, current_user.id, "SMENA_TAFOVUT", f"Smena #{db_shift.id}: jamlar qayta hisoblandi ({', '.join(discrepancies)})")
+
+    report = shift_totals.z_report(db_shift, discrepancies)
     
+    await log_action(db, current_user.id, "SMENA_YOPILDI", f"Yakuniy balans: {shift_data.closing_balance:,.0f} so'm. Kutilgan naqd: {report['expected_cash']:,.0f} so'm")
+
+    # Adminlarga xabar - smena bilan bitta tranzaksiyada navbatga qo'yiladi, bot worker yuboradi
+    admin_result = await db.execute(select(Employee.telegram_id).where(Employee.role == "admin", Employee.telegram_id.isnot(None)))
+    msg = (
+        f"📊 <b>Smena Yakunlandi</b>\n"
+        f"👤 Kassir: {current_user.full_name or current_user.username}\n"
+        f"📅 Yopildi: {db_shift.closed_at.replace(tzinfo=timezone.utc).astimezone().strftime('%d.%m.%Y %H:%M')}\n"
+        f"🧾 Savdolar: {report['sales_count']} ta, {report['sales_total']:,.0f} so'm\n"
+        f"↩️ Qaytarishlar: {report['refunds_count']} ta, {report['refunds_total']:,.0f} so'm\n"
+        f"💵 Kutilgan naqd: {report['expected_cash']:,.0f} so'm\n"
+        f"💰 Yakuniy balans: {db_shift.closing_balance:,.0f} so'm (farq: {report['cash_difference']:+,.0f})"
+    )
+    for admin_chat_id in admin_result.scalars().all():
+        enqueue_message(db, admin_chat_id, msg)
+
     await db.commit()
     await db.refresh(db_shift)
     
     # Reload with cashier info
     result = await db.execute(select(Shift).where(Shift.id == db_shift.id).options(joinedload(Shift.cashier)))
-    shift_final = result.scalars().first()
-
-    # Send Notification to Admin
-    try:
-        from bot import bot
-        admin_result = await db.execute(select(Employee).where(Employee.role == "admin", Employee.telegram_id.isnot(None)))
-        admins = admin_result.scalars().all()
-        
-        if admins and shift_final:
-            msg = (
-                f"📊 <b>Smena Yakunlandi</b>\n"
-                f"👤 Kassir: {shift_final.cashier.full_name}\n"
-                f"📅 Yopildi: {shift_final.closed_at.strftime('%d.%m.%Y %H:%M')}\n"
-                f"💰 Yakuniy balans: {shift_final.closing_balance:,.0f} so'm"
-            )
-            for admin in admins:
-                await bot.send_message(admin.telegram_id, msg)
-
-    except Exception as e:
-        print(f"Shift notification error: {e}")
-
-    return shift_final
+    closed = result.scalars().first()
+    closed.z_report = report
+    return closed
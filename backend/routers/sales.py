@@ -1,18 +1,99 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
+from sqlalchemy import select, update, insert, func, case
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timezone
 
-from database import get_db, Product, Sale, SaleItem, Employee, Client, StoreSetting, StockMove
-from schemas import SaleCreate, SaleOut
+from database import get_db, get_read_db, Product, Sale, SaleItem, Employee, Client, StockMove, RefundItem
+from schemas import SaleCreate, SaleOut, SaleSyncRequest, SaleSyncResponse, SaleSyncResult, EmployeeOut, ClientOut, ProductOut, SaleItemOut
+from schemas import SaleSummaryOut, SaleLineOut, SaleDetailOut, RefundCreate
 from core import get_current_user
 from routers.audit import log_action
+from utils.cache import response_cache
+from utils.settings_provider import settings_provider
+from utils.idempotency import begin_idempotent, finish_idempotent
+from utils.fast_json import Projection, dumps, json_response
+from utils.events import event_bus, sale_event, refund_event
+from utils import shift_totals, client_ledger
 
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload, aliased
 
 router = APIRouter(prefix="/sales", tags=["sales"])
 
+# Savdolar ro'yxati uchun ustunlar (joinedload + pydantic o'rniga)
+Cashier = aliased(Employee)
+SALE_COLUMNS = Projection(Sale, SaleOut, nested=("cashier", "client", "items"))
+CASHIER_COLUMNS = Projection(Employee, EmployeeOut, entity=Cashier)
+CLIENT_COLUMNS = Projection(Client, ClientOut)
+SALE_ITEM_COLUMNS = Projection(SaleItem, SaleItemOut, nested=("product",))
+PRODUCT_COLUMNS = Projection(Product, ProductOut)
+SUMMARY_COLUMNS = Projection(Sale, SaleSummaryOut, nested=("cashier_name", "client_name", "item_count"))
+
+
+async def sales_summary_json(db: AsyncSession, page) -> bytes:
+    """Faqat savdo sarlavhasi, qatorlar soni, kassir va mijoz ismi - bitta so'rovda"""
+    page = page.subquery()
+    item_count = (
+        select(func.count(SaleItem.id)).where(SaleItem.sale_id == Sale.id).correlate(Sale).scalar_subquery()
+    )
+    result = await db.execute(
+        select(
+            *SUMMARY_COLUMNS.columns,
+            func.coalesce(Cashier.full_name, Cashier.username),
+            Client.name,
+            item_count
+        )
+        .join(page, page.c.id == Sale.id)
+        .outerjoin(Cashier, Sale.cashier_id == Cashier.id)
+        .outerjoin(Client, Sale.client_id == Client.id)
+        .order_by(Sale.created_at.desc(), Sale.id.desc())
+    )
+    extra = SUMMARY_COLUMNS.width
+    return dumps([
+        SUMMARY_COLUMNS.build(row, cashier_name=row[extra], client_name=row[extra + 1], item_count=row[extra + 2])
+        for row in result.all()
+    ])
+
+
+async def sales_json(db: AsyncSession, page) -> bytes:
+    """page - filtr va tartiblangan select(Sale.id). Savdolar, kassir, mijoz va qatorlar 2 ta so'rovda"""
+    page = page.subquery()
+    result = await db.execute(
+        select(*SALE_COLUMNS.columns, *CASHIER_COLUMNS.columns, *CLIENT_COLUMNS.columns)
+        .join(page, page.c.id == Sale.id)
+        .outerjoin(Cashier, Sale.cashier_id == Cashier.id)
+        .outerjoin(Client, Sale.client_id == Client.id)
+        .order_by(Sale.created_at.desc(), Sale.id.desc())
+    )
+    rows = result.all()
+    if not rows:
+        return b"[]"
+
+    sale_id = SALE_COLUMNS.id_index
+    items = {row[sale_id]: [] for row in rows}
+    item_rows = await db.execute(
+        select(SaleItem.sale_id, *SALE_ITEM_COLUMNS.columns, *PRODUCT_COLUMNS.columns)
+        .outerjoin(Product, SaleItem.product_id == Product.id)
+        .where(SaleItem.sale_id.in_(list(items)))
+        .order_by(SaleItem.id)
+    )
+    product_offset = 1 + SALE_ITEM_COLUMNS.width
+    for row in item_rows:
+        items[row[0]].append(SALE_ITEM_COLUMNS.build(row, 1, product=PRODUCT_COLUMNS.build_optional(row, product_offset)))
+
+    cashier_offset = SALE_COLUMNS.width
+    client_offset = cashier_offset + CASHIER_COLUMNS.width
+    return dumps([
+        SALE_COLUMNS.build(
+            row,
+            cashier=CASHIER_COLUMNS.build_optional(row, cashier_offset),
+            client=CLIENT_COLUMNS.build_optional(row, client_offset),
+            items=items[row[sale_id]]
+        )
+        for row in rows
+    ])
+
 def parse_date(date_val: Optional[str], default_time=datetime.min.time()):
     if not date_val:
         return None
@@ -28,31 +109,43 @@ def parse_date(date_val: Optional[str], default_time=datetime.min.time()):
     except ValueError:
         return None
 
-@router.post("/", response_model=SaleOut)
-async def create_sale(
+async def apply_sale(
+    db: AsyncSession,
     sale: SaleCreate,
-    current_user: Employee = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    cashier_id: int,
+    created_at: Optional[datetime] = None,
+    allow_negative_stock: bool = False,
+    shift_id: Optional[int] = None
 ):
-    # 1. Start a transaction implicit in async session
-    
+    """Savdoni joriy tranzaksiyaga yozadi (commit qilmaydi).
+
+    shift_id berilsa - savdo shu smenaga biriktiriladi va smena jamlari yangilanadi.
+
+    Qaytaradi: (db_sale, shortfalls). shortfalls - qoldiq yetmagan mahsulotlar
+    (faqat allow_negative_stock=True bo'lganda bo'sh bo'lmasligi mumkin).
+    """
+    # 1. Mahsulotlarni bitta so'rov bilan yuklash
+    product_ids = {item.product_id for item in sale.items}
+    result = await db.execute(select(Product).where(Product.id.in_(product_ids)))
+    products = {p.id: p for p in result.scalars().all()}
+
     # 2. Check stock availability
-    total_amount_check = 0
     sale_items_data = []
+    shortfalls = []
 
     for item in sale.items:
-        result = await db.execute(select(Product).where(Product.id == item.product_id))
-        product = result.scalars().first()
+        product = products.get(item.product_id)
         
         if not product:
             raise HTTPException(status_code=404, detail=f"Product {item.product_id} not found")
         
         if product.stock < item.quantity:
-            raise HTTPException(status_code=400, detail=f"Mahsulot yetarli emas: {product.name}. Mavjud: {product.stock}")
+            if not allow_negative_stock:
+                raise HTTPException(status_code=400, detail=f"Mahsulot yetarli emas: {product.name}. Mavjud: {product.stock}")
+            shortfalls.append({"product_id": product.id, "name": product.name, "stock": product.stock, "quantity": item.quantity})
         
         # Deduct stock
         product.stock -= item.quantity
-        total_amount_check += item.quantity * item.price
         
         # Prepare item data for DB
         sale_items_data.append(SaleItem(
@@ -65,14 +158,17 @@ async def create_sale(
     db_sale = Sale(
         total_amount=sale.total_amount, 
         payment_method=sale.payment_method,
-        cashier_id=current_user.id,
+        cashier_id=cashier_id,
         client_id=sale.client_id,
         status="completed",
         cash_amount=sale.cash_amount,
         card_amount=sale.card_amount,
         transfer_amount=sale.transfer_amount,
-        debt_amount=sale.debt_amount
+        debt_amount=sale.debt_amount,
+        shift_id=shift_id
     )
+    if created_at:
+        db_sale.created_at = created_at
     db.add(db_sale)
     await db.flush() # Get ID
 
@@ -87,7 +183,7 @@ async def create_sale(
             quantity=-sale_item.quantity,
             type="sale",
             reason=f"Sotuv (Chek ID: {db_sale.id})",
-            created_by=current_user.id
+            created_by=cashier_id
         )
         db.add(db_move)
 
@@ -96,15 +192,17 @@ async def create_sale(
         result = await db.execute(select(Client).where(Client.id == sale.client_id))
         client = result.scalars().first()
         if client:
-            # Handle Debt
+            # Handle Debt (balans faqat mijoz hisobi orqali o'zgaradi)
             if sale.debt_amount > 0:
-                client.balance -= sale.debt_amount
+                await client_ledger.post(
+                    db, client.id, -sale.debt_amount, "sale",
+                    sale_id=db_sale.id, created_by=cashier_id, created_at=db_sale.created_at
+                )
             
             # 5.1 Handle Bonuses
-            # Get bonus setting
-            settings_res = await db.execute(select(StoreSetting))
-            settings = settings_res.scalars().first()
-            bonus_percent = settings.bonus_percentage if settings else 1.0
+            # Get bonus setting (xotiradagi nusxadan)
+            settings = await settings_provider.get(db)
+            bonus_percent = settings.bonus_percentage
             
             # Calculate earned bonus (from the amount actually paid or total?) 
             # Usually from total non-debt amount or just total? Let's do from (total - debt)
@@ -120,19 +218,30 @@ async def create_sale(
                     raise HTTPException(status_code=400, detail="Bonus balansi yetarli emas")
                 client.bonus_balance -= sale.bonus_spent
                 db_sale.bonus_spent = sale.bonus_spent
+
+    await shift_totals.add_sale(db, shift_id, db_sale, at=created_at)
+    return db_sale, shortfalls
+
+@router.post("/", response_model=SaleOut)
+async def create_sale(
+    sale: SaleCreate,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: Employee = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # 1. Start a transaction implicit in async session
+    # Takroriy so'rov (tarmoq uzilishi) bo'lsa - avvalgi natijani qaytaramiz
+    replay, idem_record = await begin_idempotent(db, "sales", current_user.id, idempotency_key, request)
+    if replay is not None:
+        return replay
     
-    await log_action(db, current_user.id, "YANGI_SOTUV", f"Summa: {db_sale.total_amount:,.0f} so'm. Usul: {db_sale.payment_method}. Chek ID: {db_sale.id}")
-    
-    await db.commit()
+    shift_id = await shift_totals.open_shift_id(db, current_user.id)
+    db_sale, _ = await apply_sale(db, sale, current_user.id, shift_id=shift_id)
     
-    # 6. Safety Backup (Automatic)
-    try:
-        from utils.backup import create_backup
-        create_backup()
-    except:
-        pass
+    await log_action(db, current_user.id, "YANGI_SOTUV", f"Summa: {db_sale.total_amount:,.0f} so'm. Usul: {db_sale.payment_method}. Chek ID: {db_sale.id}")
     
-    # Reload with relationships for response_model
+    # Reload with relationships for response_model (commitdan oldin - javob kalit bilan birga saqlanadi)
     result = await db.execute(
         select(Sale)
         .where(Sale.id == db_sale.id)
@@ -143,18 +252,122 @@ async def create_sale(
         )
     )
     db_sale_full = result.unique().scalars().first()
+    finish_idempotent(idem_record, SaleOut.model_validate(db_sale_full).model_dump_json())
+
+    await db.commit()
+    if sale.client_id:
+        await response_cache.invalidate("crm/clients")
+    event_bus.publish("sale", sale_event(db_sale_full), db_sale_full.cashier_id, current_user.role)
+    
+    # 6. Safety Backup (Automatic)
+    try:
+        from utils.backup import create_backup
+        create_backup()
+    except:
+        pass
+    
     return db_sale_full
 
-@router.get("/", response_model=List[SaleOut])
-async def get_sales(
-    skip: int = 0, 
-    limit: int = 100,
-    employee_id: Optional[int] = None,
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
+@router.post("/sync", response_model=SaleSyncResponse)
+async def sync_offline_sales(
+    batch: SaleSyncRequest,
     current_user: Employee = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
+    """Offline kassada yig'ilgan savdolarni bitta tranzaksiyada qabul qilish.
+
+    Savdolar (created_at, client_uuid) tartibida qo'llanadi - qoldiq yetmaganda
+    qaysi savdo rad etilishi har doim bir xil bo'ladi. Avval qabul qilingan
+    UUID lar "duplicate" sifatida qaytariladi.
+    """
+    def sale_time(s):
+        return s.created_at if s.created_at.tzinfo else s.created_at.replace(tzinfo=timezone.utc)
+
+    ordered = sorted(batch.sales, key=lambda s: (sale_time(s), str(s.client_uuid)))
+    uuids = [str(s.client_uuid) for s in ordered]
+
+    existing_res = await db.execute(select(Sale.client_uuid, Sale.id).where(Sale.client_uuid.in_(uuids)))
+    applied_ids = dict(existing_res.all())
+
+    response = SaleSyncResponse(results=[])
+    allow_negative = batch.shortfall_policy == "allow_negative"
+    touched_clients = False
+
+    for offline in ordered:
+        key = str(offline.client_uuid)
+        if key in applied_ids:
+            response.duplicates += 1
+            response.results.append(SaleSyncResult(client_uuid=offline.client_uuid, status="duplicate", sale_id=applied_ids[key]))
+            continue
+
+        try:
+            # Har bir savdo alohida savepoint: rad etilgani qolganlariga ta'sir qilmaydi
+            async with db.begin_nested():
+                db_sale, shortfalls = await apply_sale(
+                    db, offline, current_user.id,
+                    created_at=sale_time(offline).astimezone(timezone.utc),
+                    allow_negative_stock=allow_negative,
+                    # Offline savdo o'z vaqtidagi smenaga tushadi (hozir ochiq smenaga emas)
+                    shift_id=await shift_totals.shift_id_at(db, current_user.id, sale_time(offline))
+                )
+                db_sale.client_uuid = key
+                # Unikal indeks buzilishi shu savepoint ichida chiqsin (yopilishida emas)
+                await db.flush()
+        except HTTPException as e:
+            response.rejected += 1
+            response.results.append(SaleSyncResult(client_uuid=offline.client_uuid, status="rejected", detail=str(e.detail)))
+            continue
+        except IntegrityError:
+            # Boshqa kassa shu UUID ni bir vaqtda yubordi va birinchi bo'lib commit qildi
+            existing_id = await db.scalar(select(Sale.id).where(Sale.client_uuid == key))
+            if existing_id is None:
+                response.rejected += 1
+                response.results.append(SaleSyncResult(client_uuid=offline.client_uuid, status="rejected", detail="Savdoni saqlab bo'lmadi (ma'lumotlar to'qnashuvi)"))
+                continue
+            applied_ids[key] = existing_id
+            response.duplicates += 1
+            response.results.append(SaleSyncResult(client_uuid=offline.client_uuid, status="duplicate", sale_id=existing_id))
+            continue
+
+        applied_ids[key] = db_sale.id
+        touched_clients = touched_clients or bool(offline.client_id)
+        response.applied += 1
+        detail = None
+        if shortfalls:
+            detail = "Qoldiq yetmadi: " + ", ".join(f"{s['name']} (mavjud: {s['stock']}, sotildi: {s['quantity']})" for s in shortfalls)
+        response.results.append(SaleSyncResult(
+            client_uuid=offline.client_uuid,
+            status="applied_with_shortfall" if shortfalls else "applied",
+            sale_id=db_sale.id,
+            detail=detail
+        ))
+
+    await log_action(db, current_user.id, "OFFLINE_SINXRON", f"Offline savdolar: {response.applied} qabul qilindi, {response.duplicates} takroriy, {response.rejected} rad etildi")
+    await db.commit()
+
+    if touched_clients:
+        await response_cache.invalidate("crm/clients")
+    if response.applied:
+        # Offline savdolar o'tgan vaqtga yoziladi - dashboard jamlarni qayta yuklaydi
+        event_bus.publish("resync", {"reason": "offline_sync", "applied": response.applied}, current_user.id, current_user.role)
+        try:
+            from utils.backup import create_backup
+            create_backup()
+        except:
+            pass
+
+    return response
+
+async def sales_page_query(
+    db: AsyncSession,
+    current_user: Employee,
+    skip: int,
+    limit: int,
+    employee_id: Optional[int],
+    start_date: Optional[str],
+    end_date: Optional[str]
+):
+    """Ruxsat va filtrlar qo'llangan select(Sale.id) sahifasi. Ko'rsatadigan narsa bo'lmasa - None"""
     # Enforce RBAC
     if current_user.role == "cashier":
         employee_id = current_user.id
@@ -162,14 +375,7 @@ async def get_sales(
     start_date = parse_date(start_date, datetime.min.time())
     end_date = parse_date(end_date, datetime.max.time())
     
-    query = (
-        select(Sale)
-        .options(
-            joinedload(Sale.items).joinedload(SaleItem.product),
-            joinedload(Sale.cashier),
-            joinedload(Sale.client)
-        )
-    )
+    query = select(Sale.id)
     if employee_id:
         query = query.where(Sale.cashier_id == employee_id)
         
@@ -181,7 +387,7 @@ async def get_sales(
              target_emp = await db.scalar(select(Employee).where(Employee.id == employee_id))
              if target_emp and target_emp.role == "admin":
                  # Return empty or error? Empty seems safer for list view
-                 return []
+                 return None
          else:
              # If listing all, exclude sales made by admins
              # We need to join with Employee table to filter by role
@@ -192,68 +398,254 @@ async def get_sales(
     if end_date:
         query = query.where(Sale.created_at <= end_date)
         
-    result = await db.execute(query.offset(skip).limit(limit).order_by(Sale.created_at.desc()))
-    return result.unique().scalars().all()
+    return query.order_by(Sale.created_at.desc(), Sale.id.desc()).offset(skip).limit(limit)
 
-@router.post("/{sale_id}/refund", response_model=SaleOut)
-async def refund_sale(
-    sale_id: int,
+@router.get("/", response_model=List[SaleOut])
+async def get_sales(
+    skip: int = 0, 
+    limit: int = 100,
+    employee_id: Optional[int] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
     current_user: Employee = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    # Security: Only admin and manager can refund
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Faqat administrator yoki menejer savdoni qaytara oladi")
+    page = await sales_page_query(db, current_user, skip, limit, employee_id, start_date, end_date)
+    if page is None:
+        return json_response(b"[]")
+    return json_response(await sales_json(db, page))
+
+@router.get("/summary", response_model=List[SaleSummaryOut])
+async def get_sales_summary(
+    skip: int = 0,
+    limit: int = 100,
+    employee_id: Optional[int] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    current_user: Employee = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Savdolar tarixi ro'yxati: qatorlarsiz. Qatorlar - GET /sales/{sale_id}"""
+    page = await sales_page_query(db, current_user, skip, limit, employee_id, start_date, end_date)
+    if page is None:
+        return json_response(b"[]")
+    return json_response(await sales_summary_json(db, page))
 
-    # 1. Fetch the sale with items
+@router.get("/{sale_id}", response_model=SaleDetailOut)
+async def get_sale_detail(
+    sale_id: int,
+    current_user: Employee = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
     result = await db.execute(
         select(Sale)
         .where(Sale.id == sale_id)
         .options(
-            joinedload(Sale.items).joinedload(SaleItem.product),
+            selectinload(Sale.items).selectinload(SaleItem.product),
+            joinedload(Sale.cashier),
             joinedload(Sale.client)
         )
     )
-    db_sale = result.unique().scalars().first()
-    
-    if not db_sale:
+    sale = result.scalars().first()
+    if not sale:
         raise HTTPException(status_code=404, detail="Sale not found")
-    
-    if db_sale.status == "refunded":
-        raise HTTPException(status_code=400, detail="Sale already refunded")
 
-    # 2. Restore stock for each item and Log
-    for item in db_sale.items:
-        if item.product:
-            item.product.stock += item.quantity
-            
-            # Log Stock Movement (Positive for refund)
-            db_move = StockMove(
+    # Kassir faqat o'z savdolarini, menejer esa admin savdolaridan tashqarisini ko'radi
+    if current_user.role == "cashier" and sale.cashier_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
+    if current_user.role == "manager" and sale.cashier and sale.cashier.role == "admin":
+        raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
+
+    header = {name: getattr(sale, name) for name in SUMMARY_COLUMNS.names}
+    return SaleDetailOut(
+        **header,
+        cashier_name=(sale.cashier.full_name or sale.cashier.username) if sale.cashier else None,
+        client_name=sale.client.name if sale.client else None,
+        item_count=len(sale.items),
+        items=[
+            SaleLineOut(
+                id=item.id,
                 product_id=item.product_id,
+                product_name=item.product.name if item.product else None,
+                barcode=item.product.barcode if item.product else None,
+                unit=item.product.unit if item.product else None,
                 quantity=item.quantity,
-                type="refund",
-                reason=f"Vozvrat (Chek ID: {db_sale.id})",
-                created_by=current_user.id
+                price=item.price,
+                refunded_quantity=item.refunded_quantity or 0
             )
-            db.add(db_move)
-    
-    # 3. Handle Client Balance and Bonuses (Deduct earned bonuses)
-    if db_sale.client:
-        if db_sale.debt_amount > 0:
-            db_sale.client.balance += db_sale.debt_amount 
-        
-        # Deduct earned bonus
-        if db_sale.bonus_earned > 0:
-            db_sale.client.bonus_balance -= db_sale.bonus_earned
+            for item in sorted(sale.items, key=lambda i: i.id)
+        ]
+    )
 
-    # 4. Update Sale Status
-    db_sale.status = "refunded"
-    
-    await log_action(db, current_user.id, "VOZVRAT", f"Savdo qaytarildi (Vozvrat). Chek ID: {sale_id}. Summa: {db_sale.total_amount:,.0f} so'm")
-    
-    await db.commit()
-    
-    # Reload for response
+def _split(total: float, weights: List[float]) -> List[float]:
+    """Summani og'irliklarga proporsional bo'lish (yig'indisi aynan total bo'ladi)"""
+    weight_sum = sum(weights)
+    if not weights:
+        return []
+    if weight_sum <= 0:
+        weights, weight_sum = [1.0] * len(weights), float(len(weights))
+    parts = [total * w / weight_sum for w in weights[:-1]]
+    return parts + [total - sum(parts)]
+
+def _refund_portion(original: dict, prev: dict, ratio: float, final: bool) -> dict:
+    """Shu qaytarishga tushadigan summalar: asl summalarning ratio ulushi, oxirgi qaytarishda esa
+    avvalgilaridan qolgan hamma narsa - barcha qaytarishlar yig'indisi aynan asl summaga teng bo'ladi"""
+    return {field: (original[field] - prev[field]) if final else original[field] * ratio for field in original}
+
+@router.post("/{sale_id}/refund", response_model=SaleOut)
+async def refund_sale(
+    sale_id: int,
+    request: Request,
+    refund: Optional[RefundCreate] = None,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: Employee = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """To'liq yoki qisman qaytarish. Body bo'lmasa - chekning qolgan barcha qatorlari qaytariladi.
+
+    Pul savdoning to'lov turlariga (naqd, karta, o'tkazma, qarz) va bonusga proporsional taqsimlanadi,
+    oxirgi qaytarishda esa qolgan summalar aynan qaytariladi. So'rovlar soni qatorlar soniga bog'liq emas.
+    """
+    # Security: Only admin and manager can refund
+    if current_user.role not in ["admin", "manager"]:
+        raise HTTPException(status_code=403, detail="Faqat administrator yoki menejer savdoni qaytara oladi")
+
+    replay, idem_record = await begin_idempotent(db, "sales_refund", current_user.id, idempotency_key, request)
+    if replay is not None:
+        return replay
+
+    # 1. Savdo (qulf bilan - parallel qisman qaytarishlar ketma-ket bajariladi) va uning qatorlari
+    db_sale = (await db.execute(select(Sale).where(Sale.id == sale_id).with_for_update())).scalars().first()
+    if not db_sale:
+        raise HTTPException(status_code=404, detail="Sale not found")
+    if db_sale.status == "refunded":
+        raise HTTPException(status_code=400, detail="Sale already refunded")
+
+    lines = {
+        row.id: row for row in (await db.execute(
+            select(SaleItem.id, SaleItem.product_id, SaleItem.quantity, SaleItem.price,
+                   func.coalesce(SaleItem.refunded_quantity, 0).label("refunded"))
+            .where(SaleItem.sale_id == sale_id)
+        )).all()
+    }
+
+    # 2. Qaytariladigan miqdorlar
+    requested = {}
+    if refund is not None and not refund.items:
+        # Bo'sh tanlov (klient xatosi) to'liq qaytarishga aylanib ketmasin - faqat body yo'q bo'lsa hammasi qaytadi
+        raise HTTPException(status_code=400, detail="Qaytariladigan qatorlar tanlanmagan")
+    if refund is None:
+        requested = {line_id: line.quantity - line.refunded for line_id, line in lines.items() if line.quantity - line.refunded > 1e-9}
+    else:
+        for item in refund.items:
+            if item.sale_item_id not in lines:
+                raise HTTPException(status_code=400, detail=f"Qator bu savdoga tegishli emas: {item.sale_item_id}")
+            requested[item.sale_item_id] = requested.get(item.sale_item_id, 0) + item.quantity
+        for line_id, qty in requested.items():
+            line = lines[line_id]
+            if qty > line.quantity - line.refunded + 1e-9:
+                raise HTTPException(status_code=400, detail=f"Qaytariladigan miqdor qolganidan ko'p (qator {line_id}, qolgan: {line.quantity - line.refunded:g})")
+    if not requested:
+        raise HTTPException(status_code=400, detail="Qaytariladigan qator yo'q")
+
+    line_ids = list(requested)
+    values = [requested[i] * (lines[i].price or 0) for i in line_ids]
+    total_value = sum((line.quantity or 0) * (line.price or 0) for line in lines.values())
+    final = all(line.quantity - line.refunded - requested.get(line_id, 0) <= 1e-9 for line_id, line in lines.items())
+
+    # 3. Pul: proporsional ulush yoki (oxirgi qaytarishda) qolgan hamma narsa
+    original = {
+        "amount": db_sale.total_amount or 0,
+        "cash_amount": db_sale.cash_amount or 0,
+        "card_amount": db_sale.card_amount or 0,
+        "transfer_amount": db_sale.transfer_amount or 0,
+        "debt_amount": db_sale.debt_amount or 0,
+        "bonus_amount": db_sale.bonus_earned or 0,
+    }
+    prev = dict(zip(original, (await db.execute(
+        select(*[func.coalesce(func.sum(getattr(RefundItem, field)), 0) for field in original])
+        .where(RefundItem.sale_id == sale_id)
+    )).one()))
+    ratio = sum(values) / total_value if total_value > 0 else 0
+    portion = _refund_portion(original, prev, ratio, final)
+    shares = {field: _split(portion[field], values) for field in original}
+
+    # Smena: qaytargan xodimning ochiq smenasi (savdo smenasi yopilgan bo'lishi mumkin - Z-hisobot o'zgarmasin)
+    refund_shift_id = await shift_totals.open_shift_id(db, current_user.id)
+    new_refund = refund_shift_id is not None and not await db.scalar(
+        select(RefundItem.id).where(RefundItem.sale_id == sale_id, RefundItem.shift_id == refund_shift_id).limit(1)
+    )
+    refund_shift_id = await shift_totals.add_refund(
+        db, refund_shift_id,
+        amount=portion["amount"],
+        cash=portion["cash_amount"],
+        card=portion["card_amount"] + portion["transfer_amount"],
+        debt=portion["debt_amount"],
+        new_refund=new_refund
+    )
+
+    now = datetime.now(timezone.utc)
+    await db.execute(insert(RefundItem), [{
+        "sale_id": sale_id,
+        "sale_item_id": line_id,
+        "product_id": lines[line_id].product_id,
+        "quantity": requested[line_id],
+        **{field: shares[field][n] for field in original},
+        "created_by": current_user.id,
+        "shift_id": refund_shift_id,
+        "created_at": now,
+    } for n, line_id in enumerate(line_ids)])
+
+    # 4. Qoldiq: bitta UPDATE ... CASE (bir mahsulot bir necha qatorda bo'lsa - yig'iladi) va bitta StockMove insert
+    per_product = {}
+    for line_id in line_ids:
+        product_id = lines[line_id].product_id
+        per_product[product_id] = per_product.get(product_id, 0) + requested[line_id]
+    await db.execute(
+        update(Product)
+        .where(Product.id.in_(list(per_product)))
+        .values(stock=Product.stock + case(per_product, value=Product.id, else_=0))
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        update(SaleItem)
+        .where(SaleItem.id.in_(line_ids))
+        .values(refunded_quantity=func.coalesce(SaleItem.refunded_quantity, 0) + case(requested, value=SaleItem.id, else_=0))
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(insert(StockMove), [{
+        "product_id": product_id,
+        "quantity": qty,
+        "type": "refund",
+        "reason": f"Vozvrat (Chek ID: {sale_id})",
+        "created_by": current_user.id,
+        "created_at": now,
+    } for product_id, qty in per_product.items()])
+
+    # 5. Mijoz: qarz kamayadi (hisob yozuvi bilan), shu savdodan olingan bonus qaytarib olinadi
+    if db_sale.client_id and portion["debt_amount"]:
+        await client_ledger.post(
+            db, db_sale.client_id, portion["debt_amount"], "refund",
+            sale_id=sale_id, created_by=current_user.id, created_at=now
+        )
+    if db_sale.client_id and portion["bonus_amount"]:
+        await db.execute(
+            update(Client)
+            .where(Client.id == db_sale.client_id)
+            .values(bonus_balance=Client.bonus_balance - portion["bonus_amount"])
+            .execution_options(synchronize_session=False)
+        )
+
+    # 6. Savdo jamlari
+    first_refund = not (db_sale.refunded_amount or 0)
+    db_sale.refunded_amount = (db_sale.refunded_amount or 0) + portion["amount"]
+    if final:
+        db_sale.status = "refunded"
+
+    kind = "Savdo qaytarildi (Vozvrat)" if final and first_refund else "Qisman qaytarish (Vozvrat)"
+    await log_action(db, current_user.id, "VOZVRAT", f"{kind}. Chek ID: {sale_id}. Qatorlar: {len(line_ids)}. Summa: {portion['amount']:,.0f} so'm")
+
+    # Javob commitdan oldin yig'iladi - idempotency kaliti bilan birga saqlanadi
     result = await db.execute(
         select(Sale)
         .where(Sale.id == sale_id)
@@ -262,5 +654,15 @@ async def refund_sale(
             joinedload(Sale.cashier),
             joinedload(Sale.client)
         )
+        .execution_options(populate_existing=True)
     )
-    return result.unique().scalars().first()
+    refunded = result.unique().scalars().first()
+    cost = sum(requested[line_id] * (item.product.buy_price or 0) for item in refunded.items for line_id in [item.id] if line_id in requested and item.product)
+    finish_idempotent(idem_record, SaleOut.model_validate(refunded).model_dump_json())
+
+    await db.commit()
+    if db_sale.client_id:
+        await response_cache.invalidate("crm/clients")
+    # Savdo ko'rsatkichlari savdo kassiriniki, smena deltasi esa qaytargan xodimning smenasiga
+    event_bus.publish("refund", refund_event(refunded, portion, cost, refund_shift_id), refunded.cashier_id, refunded.cashier.role if refunded.cashier else None)
+    return refunded
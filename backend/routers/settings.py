@@ -4,15 +4,18 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from typing import List
 
-from database import get_db, StoreSetting, Employee
+from database import get_db, StoreSetting, Employee, engine, pool_metrics, read_engine, read_pool_metrics
 from schemas import StoreSettingBase, StoreSettingOut
-from core import get_current_user
-
 from core import get_current_user
 from routers.audit import log_action
+from utils.cache import response_cache
+from utils.settings_provider import settings_provider
+from pydantic import TypeAdapter
 
 router = APIRouter(prefix="/settings", tags=["settings"])
 
+SETTINGS_ADAPTER = TypeAdapter(StoreSettingOut)
+
 @router.get("", response_model=StoreSettingOut)
 async def get_settings(
     current_user: Employee = Depends(get_current_user),
@@ -21,6 +24,10 @@ async def get_settings(
     # Settingsni barcha xodimlar o'qiy olishi kerak (masalan, low_stock_threshold uchun)
     # Ruxsat tekshiruvi olib tashlandi, chunki get_current_user allaqachon loginni tekshiradi.
     """Do'kon sozlamalarini olish. Agar bo'sh bo'lsa, default yaratadi."""
+    cached = await response_cache.get("settings", current_user.role)
+    if cached is not None:
+        return cached
+
     result = await db.execute(select(StoreSetting))
     settings = result.scalars().first()
     
@@ -30,7 +37,7 @@ async def get_settings(
         await db.commit()
         await db.refresh(settings)
         
-    return settings
+    return await response_cache.store("settings", current_user.role, SETTINGS_ADAPTER, settings)
 
 @router.put("", response_model=StoreSettingOut)
 async def update_settings(
@@ -51,11 +58,14 @@ async def update_settings(
     
     for key, value in data.model_dump().items():
         setattr(settings, key, value)
+    settings.version = (settings.version or 0) + 1
         
     await log_action(db, current_user.id, "SOZLAMALAR_OZGARDI", f"Do'kon sozlamalari yangilandi: {settings.name}")
         
     await db.commit()
     await db.refresh(settings)
+    settings_provider.set(settings)
+    await response_cache.invalidate("settings")
     return settings
 
 @router.post("/backup")
@@ -72,3 +82,26 @@ async def manual_backup(
         return {"status": "success", "message": "Zahira nusxasi yaratildi", "filename": os.path.basename(backup_path)}
     else:
         raise HTTPException(status_code=500, detail="Zahira olishda xatolik yuz berdi")
+
+
+@router.get("/cache-stats")
+async def get_cache_stats(
+    current_user: Employee = Depends(get_current_user)
+):
+    """Javoblar keshi statistikasi (Faqat Admin uchun)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
+    return response_cache.stats()
+
+
+@router.get("/db-stats")
+async def get_db_stats(
+    current_user: Employee = Depends(get_current_user)
+):
+    """Connection pool va sessiyalar statistikasi (Faqat Admin uchun)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
+    stats = pool_metrics.snapshot(engine.pool)
+    if read_engine is not engine:
+        stats["replica"] = read_pool_metrics.snapshot(read_engine.pool)
+    return stats
@@ -1,17 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query, BackgroundTasks
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, desc
-from sqlalchemy.orm import joinedload
+from sqlalchemy import select, insert, func, case, literal, null, tuple_, union_all, String
 from typing import List, Optional
-import os
-import uuid
-from datetime import datetime
+import json
+import base64
+from datetime import datetime, timedelta, timezone
 
-from database import get_db, Supplier, SupplyReceipt, SupplierPayment, Employee
+from database import get_db, get_read_db, Supplier, SupplyReceipt, SupplierPayment, SupplierLedger, Employee
 from core import get_current_user
 from pydantic import BaseModel
 
 from routers.audit import log_action
+from utils.cache import response_cache
+from utils.fast_json import dumps, json_response
+from utils import supplier_ledger
+from utils.uploads import save_invoice, existing_variants, build_invoice_variants
+from pydantic import TypeAdapter
 
 router = APIRouter(prefix="/suppliers", tags=["suppliers"])
 
@@ -54,6 +58,39 @@ class PaymentOut(BaseModel):
     class Config:
         from_attributes = True
 
+class HistoryItemOut(BaseModel):
+    type: str # receipt, payment
+    id: int
+    amount: float
+    date: datetime
+    image: Optional[str] = None
+    thumbnail: Optional[str] = None # Kichik rasm (hali tayyor bo'lmasa - None, image ishlatiladi)
+    preview: Optional[str] = None # Ko'rish uchun WebP
+    method: Optional[str] = None
+    note: Optional[str] = None
+    balance_after: Optional[float] = None # Shu amaldan keyingi balans (firma hisobidan)
+
+class SupplierAgingOut(BaseModel):
+    supplier_id: int
+    name: str
+    balance: float
+    days_0_30: float
+    days_31_60: float
+    days_60_plus: float
+    oldest_unpaid_at: Optional[datetime] = None
+
+class SupplierReconcileOut(BaseModel):
+    supplier_id: int
+    name: str
+    balance: float
+    ledger_balance: float
+    receipts_total: float
+    payments_total: float
+    difference: float
+
+SUPPLIERS_ADAPTER = TypeAdapter(List[SupplierOut])
+RECONCILE_TOLERANCE = 0.01
+
 # --- Endpoints ---
 
 @router.get("/", response_model=List[SupplierOut])
@@ -63,8 +100,11 @@ async def get_suppliers(
 ):
     if current_user.role not in ["admin", "manager", "warehouse"]:
         raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
+    cached = await response_cache.get("suppliers", current_user.role)
+    if cached is not None:
+        return cached
     result = await db.execute(select(Supplier).order_by(Supplier.name))
-    return result.scalars().all()
+    return await response_cache.store("suppliers", current_user.role, SUPPLIERS_ADAPTER, result.scalars().all())
 
 @router.post("/", response_model=SupplierOut)
 async def create_supplier(
@@ -81,11 +121,13 @@ async def create_supplier(
     
     await log_action(db, current_user.id, "YANGI_FIRMA", f"Firma qo'shildi: {db_supplier.name} (ID: {db_supplier.id})")
     await db.commit() # Commit again to save log
+    await response_cache.invalidate("suppliers")
     
     return db_supplier
 
 @router.post("/receipts")
 async def add_receipt(
+    background_tasks: BackgroundTasks,
     supplier_id: int = Form(...),
     total_amount: float = Form(...),
     note: Optional[str] = Form(None),
@@ -101,36 +143,34 @@ async def add_receipt(
     if not supplier:
         raise HTTPException(status_code=404, detail="Firma topilmadi")
 
-    image_path = None
-    if image:
-        # Save image
-        ext = os.path.splitext(image.filename)[1]
-        filename = f"{uuid.uuid4()}{ext}"
-        save_dir = "uploads/invoices"
-        os.makedirs(save_dir, exist_ok=True)
-        image_path = os.path.join(save_dir, filename)
-        
-        with open(image_path, "wb") as f:
-            f.write(await image.read())
-        
-        # Use URL path for DB
-        image_path = f"/uploads/invoices/{filename}"
+    image_path = disk_path = variants = None
+    if image and image.filename:
+        # Bo'laklab saqlash, bir xil fayl (sha256) qayta yozilmaydi
+        image_path, disk_path, is_new = await save_invoice(image)
+        variants = None if is_new else existing_variants(disk_path)
 
     # Create receipt
     receipt = SupplyReceipt(
         supplier_id=supplier_id,
         total_amount=total_amount,
         invoice_image=image_path,
+        invoice_thumbnail=variants[0] if variants else None,
+        invoice_preview=variants[1] if variants else None,
         note=note
     )
     db.add(receipt)
+    await db.flush()
     
-    # Update supplier balance (Increase debt)
-    supplier.balance += total_amount
+    # Update supplier balance (Increase debt) - firma hisobiga yoziladi
+    await supplier_ledger.post(db, supplier_id, total_amount, "receipt", receipt_id=receipt.id, created_by=current_user.id)
     
     await log_action(db, current_user.id, "FIRMA_KIRIM", f"Firma: {supplier.name}. Summa: {total_amount} so'm. Izoh: {note or '-'}")
     
     await db.commit()
+    await response_cache.invalidate("suppliers")
+    if disk_path and not variants:
+        # Kichik rasm va WebP javobdan keyin yaratiladi
+        background_tasks.add_task(build_invoice_variants, receipt.id, disk_path)
     return {"message": "Kirim muvaffaqiyatli saqlandi", "new_balance": supplier.balance}
 
 @router.post("/payments")
@@ -156,55 +196,209 @@ async def add_payment(
         note=note
     )
     db.add(payment)
+    await db.flush()
     
-    # Update supplier balance (Decrease debt)
-    supplier.balance -= amount
+    # Update supplier balance (Decrease debt) - firma hisobiga yoziladi
+    await supplier_ledger.post(db, supplier_id, -amount, "payment", payment_id=payment.id, created_by=current_user.id)
     
     await log_action(db, current_user.id, "FIRMA_TOLOV", f"Firma: {supplier.name}. Summa: {amount} so'm. Usul: {payment_method}. Izoh: {note or '-'}")
     
     await db.commit()
+    await response_cache.invalidate("suppliers")
     return {"message": "To'lov muvaffaqiyatli saqlandi", "new_balance": supplier.balance}
 
-@router.get("/{supplier_id}/history")
-async def get_supplier_history(
-    supplier_id: int, 
+def _encode_cursor(row) -> str:
+    return base64.urlsafe_b64encode(dumps([row["date"], row["type"], row["id"]])).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        date, kind, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(date.replace("Z", "+00:00")).replace(tzinfo=None), str(kind), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Noto'g'ri cursor")
+
+
+def _history_branch(model, kind: str, amount, images, method, ledger_key, supplier_id: int, before, limit):
+    """UNION ALL ning bitta tarmog'i: (supplier_id, date, id) indeksi bo'yicha eng yangilari, balans firma hisobidan"""
+    kind_col = literal(kind, String)
+    stmt = (
+        select(
+            kind_col.label("type"), model.id, amount.label("amount"), model.date,
+            *(col.label(name) for col, name in zip(images, ("image", "thumbnail", "preview"))),
+            method.label("method"), model.note,
+            SupplierLedger.balance_after
+        )
+        .outerjoin(SupplierLedger, ledger_key == model.id)
+        .where(model.supplier_id == supplier_id)
+    )
+    if before is not None:
+        stmt = stmt.where(tuple_(model.date, kind_col, model.id) < tuple_(*before))
+    stmt = stmt.order_by(model.date.desc(), model.id.desc())
+    if limit:
+        stmt = stmt.limit(limit)
+    return stmt.subquery()
+
+
+@router.get("/aging", response_model=List[SupplierAgingOut])
+async def get_supplier_aging(
+    current_user: Employee = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Firmalarga qarzimiz yoshi bo'yicha (0-30 / 31-60 / 60+ kun), bitta so'rovda.
+
+    To'lovlar eng eski kirimlarni yopadi (FIFO), ya'ni joriy balans eng yangi kirimlardan iborat:
+    window funksiya har bir kirimdan yangiroq kirimlar yig'indisini beradi, shundan ochiq qism topiladi.
+    Kirimlar bilan tushuntirilmagan qoldiq (boshlang'ich balans) 60+ ga kiradi.
+    """
+    if current_user.role not in ["admin", "manager"]:
+        raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
+
+    newer = (
+        func.sum(SupplyReceipt.total_amount).over(
+            partition_by=SupplyReceipt.supplier_id,
+            order_by=(SupplyReceipt.date.desc(), SupplyReceipt.id.desc())
+        ) - SupplyReceipt.total_amount
+    )
+    receipts = select(
+        SupplyReceipt.supplier_id, SupplyReceipt.date, SupplyReceipt.total_amount.label("amount"), newer.label("newer")
+    ).subquery()
+
+    remaining = Supplier.balance - receipts.c.newer
+    is_open = receipts.c.newer < Supplier.balance
+    open_amount = case((is_open & (remaining < receipts.c.amount), remaining), (is_open, receipts.c.amount), else_=0)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    day_30, day_60 = now - timedelta(days=30), now - timedelta(days=60)
+    result = await db.execute(
+        select(
+            Supplier.id.label("supplier_id"), Supplier.name, Supplier.balance,
+            func.coalesce(func.sum(case((receipts.c.date >= day_30, open_amount), else_=0)), 0).label("days_0_30"),
+            func.coalesce(func.sum(case(((receipts.c.date < day_30) & (receipts.c.date >= day_60), open_amount), else_=0)), 0).label("days_31_60"),
+            func.coalesce(func.sum(case((receipts.c.date < day_60, open_amount), else_=0)), 0).label("days_60_plus"),
+            func.min(case((is_open, receipts.c.date))).label("oldest_unpaid_at"),
+        )
+        .outerjoin(receipts, receipts.c.supplier_id == Supplier.id)
+        .where(Supplier.balance > 0)
+        .group_by(Supplier.id, Supplier.name, Supplier.balance)
+        .order_by(Supplier.balance.desc())
+    )
+    rows = []
+    for row in result.all():
+        row = dict(row._mapping)
+        row["days_60_plus"] += row["balance"] - row["days_0_30"] - row["days_31_60"] - row["days_60_plus"]
+        rows.append(row)
+    return json_response(rows)
+
+
+def _reconcile_select():
+    """Supplier.balance va firma hisobi yig'indisi orasidagi farqi bor firmalar"""
+    ledger_balance = (
+        select(func.coalesce(func.sum(SupplierLedger.amount), 0))
+        .where(SupplierLedger.supplier_id == Supplier.id).correlate(Supplier).scalar_subquery()
+    )
+    receipts_total = (
+        select(func.coalesce(func.sum(SupplyReceipt.total_amount), 0))
+        .where(SupplyReceipt.supplier_id == Supplier.id).correlate(Supplier).scalar_subquery()
+    )
+    payments_total = (
+        select(func.coalesce(func.sum(SupplierPayment.amount), 0))
+        .where(SupplierPayment.supplier_id == Supplier.id).correlate(Supplier).scalar_subquery()
+    )
+    balance = func.coalesce(Supplier.balance, 0)
+    difference = balance - ledger_balance
+    return (
+        select(
+            Supplier.id.label("supplier_id"), Supplier.name, balance.label("balance"),
+            ledger_balance.label("ledger_balance"), receipts_total.label("receipts_total"),
+            payments_total.label("payments_total"), difference.label("difference")
+        )
+        .where(func.abs(difference) > RECONCILE_TOLERANCE)
+        .order_by(Supplier.id)
+    )
+
+
+@router.get("/reconcile", response_model=List[SupplierReconcileOut])
+async def get_supplier_reconcile(
+    current_user: Employee = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Supplier.balance ni firma hisobi bilan solishtirish (faqat o'qish). Faqat farqi bor firmalar qaytariladi"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Faqat admin")
+    rows = [dict(row._mapping) for row in (await db.execute(_reconcile_select())).all()]
+    return json_response(rows)
+
+
+@router.post("/reconcile", response_model=List[SupplierReconcileOut])
+async def reconcile_suppliers(
     current_user: Employee = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
+    """Farqlarni 'adjustment' yozuvi bilan hisobga kiritish (balans o'zgarmaydi - hisob unga tenglashtiriladi).
+
+    Idempotent: farq bitta INSERT ... SELECT ichida qayta hisoblanadi, takroriy so'rov hech narsa yozmaydi.
+    Tenglashtirilgan firmalar qaytariladi.
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Faqat admin")
+
+    # PostgreSQL: parallel so'rov birinchisi commit qilguncha kutadi va keyin farqni ko'rmaydi
+    await db.execute(select(Supplier.id).with_for_update())
+    rows = [dict(row._mapping) for row in (await db.execute(_reconcile_select())).all()]
+    if not rows:
+        return json_response([])
+
+    diff = _reconcile_select().subquery()
+    fixed = set((await db.execute(
+        insert(SupplierLedger).from_select(
+            ["supplier_id", "entry_type", "amount", "balance_after", "created_by", "created_at"],
+            select(
+                diff.c.supplier_id, literal("adjustment", String), diff.c.difference, diff.c.balance,
+                literal(current_user.id), literal(datetime.now(timezone.utc), SupplierLedger.created_at.type)
+            )
+        ).returning(SupplierLedger.supplier_id)
+    )).scalars().all())
+    rows = [row for row in rows if row["supplier_id"] in fixed]
+    if rows:
+        await log_action(db, current_user.id, "FIRMA_TEKSHIRUV", f"Firma hisoblari tenglashtirildi: {len(rows)} ta firma")
+    await db.commit()
+    return json_response(rows)
+
+
+@router.get("/{supplier_id}/history", response_model=List[HistoryItemOut])
+async def get_supplier_history(
+    supplier_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Berilmasa - butun tarix"),
+    cursor: Optional[str] = Query(None, description="Oldingi javobning X-Next-Cursor headeri"),
+    current_user: Employee = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Kirim va to'lovlar tarixi (yangilaridan eskisiga) - SQL da UNION ALL, keyset sahifalash.
+
+    Har bir tarmoq o'z (supplier_id, date, id) indeksidan ko'pi bilan limit+1 qator o'qiydi.
+    """
     if current_user.role not in ["admin", "manager", "warehouse"]:
         raise HTTPException(status_code=403, detail="Ruxsat berilmagan")
-    # Get receipts
-    receipts_res = await db.execute(
-        select(SupplyReceipt).where(SupplyReceipt.supplier_id == supplier_id).order_by(desc(SupplyReceipt.date))
-    )
-    receipts = receipts_res.scalars().all()
 
-    # Get payments
-    payments_res = await db.execute(
-        select(SupplierPayment).where(SupplierPayment.supplier_id == supplier_id).order_by(desc(SupplierPayment.date))
+    before = _decode_cursor(cursor) if cursor else None
+    fetch = limit + 1 if limit else None
+    receipts = _history_branch(
+        SupplyReceipt, "receipt", SupplyReceipt.total_amount,
+        (SupplyReceipt.invoice_image, SupplyReceipt.invoice_thumbnail, SupplyReceipt.invoice_preview), null(),
+        SupplierLedger.receipt_id, supplier_id, before, fetch
     )
-    payments = payments_res.scalars().all()
-
-    # Merge and sort
-    history = []
-    for r in receipts:
-        history.append({
-            "type": "receipt",
-            "id": r.id,
-            "amount": r.total_amount,
-            "date": r.date,
-            "image": r.invoice_image,
-            "note": r.note
-        })
-    for p in payments:
-        history.append({
-            "type": "payment",
-            "id": p.id,
-            "amount": p.amount,
-            "date": p.date,
-            "method": p.payment_method,
-            "note": p.note
-        })
-    
-    history.sort(key=lambda x: x["date"], reverse=True)
-    return history
+    payments = _history_branch(
+        SupplierPayment, "payment", SupplierPayment.amount, (null(), null(), null()), SupplierPayment.payment_method,
+        SupplierLedger.payment_id, supplier_id, before, fetch
+    )
+    history = union_all(select(receipts), select(payments)).subquery()
+    stmt = select(history).order_by(history.c.date.desc(), history.c.type.desc(), history.c.id.desc())
+    if fetch:
+        stmt = stmt.limit(fetch)
+    rows = [dict(row._mapping) for row in (await db.execute(stmt)).all()]
+
+    headers = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        headers = {"X-Next-Cursor": _encode_cursor(rows[-1])}
+    return json_response(rows, headers=headers)
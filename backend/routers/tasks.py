@@ -7,6 +7,7 @@ from database import get_db, Task, Employee
 from schemas import TaskCreate, TaskOut, TaskUpdate
 from core import get_current_user
 from routers.audit import log_action
+from utils.outbox import enqueue_message
 
 router = APIRouter(prefix="/tasks", tags=["tasks"])
 
@@ -30,30 +31,24 @@ async def create_task(
     db.add(new_task)
     
     await log_action(db, current_user.id, "YANGI_VAZIFA", f"Vazifa: {new_task.title}. Assigned to ID: {new_task.assigned_to}")
-    
+
+    # Mas'ul xodimni Telegram orqali xabardor qilish (vazifa bilan bitta commitda navbatga qo'yiladi)
+    result = await db.execute(select(Employee.telegram_id).where(Employee.id == task.assigned_to))
+    assigned_chat_id = result.scalars().first()
+    if assigned_chat_id:
+        msg = (
+            f"📝 <b>Yangi Vazifa!</b>\n\n"
+            f"📌 <b>Nomi:</b> {new_task.title}\n"
+            f"📄 <b>Izoh:</b> {new_task.description or '-'}\n"
+            f"👤 <b>Kimdan:</b> {current_user.full_name or current_user.username}\n"
+            f"📅 <b>Muddat:</b> {new_task.due_date.strftime('%d.%m.%Y') if new_task.due_date else '-'}\n\n"
+            f"<i>Vazifani bajarish uchun dasturga kiring.</i>"
+        )
+        enqueue_message(db, assigned_chat_id, msg)
+
     await db.commit()
     await db.refresh(new_task)
 
-    # Telegram orqali xaridorni yoki mas'ulni xabardor qilish
-    try:
-        from bot import bot
-        # Mas'ul xodim ma'lumotlarini olish
-        result = await db.execute(select(Employee).where(Employee.id == task.assigned_to))
-        assigned_emp = result.scalars().first()
-        
-        if assigned_emp and assigned_emp.telegram_id:
-            msg = (
-                f"📝 <b>Yangi Vazifa!</b>\n\n"
-                f"📌 <b>Nomi:</b> {new_task.title}\n"
-                f"📄 <b>Izoh:</b> {new_task.description or '-'}\n"
-                f"👤 <b>Kimdan:</b> {current_user.full_name or current_user.username}\n"
-                f"📅 <b>Muddat:</b> {new_task.due_date.strftime('%d.%m.%Y') if new_task.due_date else '-'}\n\n"
-                f"<i>Vazifani bajarish uchun dasturga kiring.</i>"
-            )
-            await bot.send_message(assigned_emp.telegram_id, msg, parse_mode="HTML")
-    except Exception as e:
-        print(f"Telegram notification error: {e}")
-
     return new_task
 
 @router.get("/", response_model=List[TaskOut])
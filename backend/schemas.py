@@ -1,6 +1,7 @@
 from pydantic import BaseModel, ConfigDict, Field
-from typing import Optional, List, Annotated
+from typing import Optional, List, Annotated, Literal, Dict
 from datetime import datetime
+from uuid import UUID
 import re
 
 # Lenient Regex for phone numbers to support any legacy data
@@ -71,6 +72,7 @@ class ProductBase(BaseModel):
     unit: str = "dona"
     category_id: Optional[int] = None
     is_favorite: bool = False
+    supplier_id: Optional[int] = None
 
 class ProductCreate(ProductBase):
     pass
@@ -92,6 +94,22 @@ class StockMoveOut(StockMoveBase):
     product: Optional[ProductOut] = None
     model_config = ConfigDict(from_attributes=True)
 
+class ReorderSuggestionOut(BaseModel):
+    product_id: int
+    product_name: str
+    unit: str
+    stock: float
+    daily_velocity: float
+    days_of_cover: Optional[float] = None
+    reorder_quantity: float
+    computed_at: datetime
+
+class SupplierReorderOut(BaseModel):
+    supplier_id: Optional[int] = None
+    supplier_name: Optional[str] = None
+    total_quantity: float
+    items: List[ReorderSuggestionOut]
+
 class SupplyBase(BaseModel):
     product_id: int
     quantity: float
@@ -128,6 +146,45 @@ class ClientOut(ClientBase):
     created_at: datetime
     model_config = ConfigDict(from_attributes=True)
 
+class ClientBriefOut(BaseModel):
+    id: int
+    name: str
+    phone: Optional[str] = None
+
+class ClientLedgerOut(BaseModel):
+    id: int
+    client_id: int
+    entry_type: str
+    amount: float
+    balance_after: float
+    open_amount: float = 0
+    sale_id: Optional[int] = None
+    payment_id: Optional[int] = None
+    created_by: Optional[int] = None
+    created_at: datetime
+    model_config = ConfigDict(from_attributes=True)
+
+class DebtAgingOut(BaseModel):
+    client_id: int
+    name: str
+    phone: Optional[str] = None
+    balance: float
+    debt_due_date: Optional[datetime] = None
+    total_debt: float
+    days_0_30: float
+    days_31_60: float
+    days_60_plus: float
+    oldest_debt_at: Optional[datetime] = None
+    updated_at: datetime
+
+class DebtReportOut(BaseModel):
+    client_count: int
+    total_debt: float
+    days_0_30: float
+    days_31_60: float
+    days_60_plus: float
+    clients: List[DebtAgingOut]
+
 # --- POS SCHEMAS ---
 class SaleItemBase(BaseModel):
     product_id: int
@@ -136,6 +193,7 @@ class SaleItemBase(BaseModel):
 
 class SaleItemOut(SaleItemBase):
     id: int
+    refunded_quantity: float = 0
     product: Optional[ProductOut] = None
     model_config = ConfigDict(from_attributes=True)
 
@@ -168,9 +226,78 @@ class SaleOut(BaseModel):
     debt_amount: float = 0
     bonus_earned: float = 0
     bonus_spent: float = 0
+    refunded_amount: float = 0
     items: List[SaleItemOut] = []
     model_config = ConfigDict(from_attributes=True)
 
+# Savdolar tarixi uchun yengil ko'rinish (mahsulot va xodim obyektlarisiz)
+class SaleSummaryOut(BaseModel):
+    id: int
+    created_at: datetime
+    total_amount: float
+    payment_method: str
+    cashier_id: int
+    cashier_name: Optional[str] = None
+    client_id: Optional[int] = None
+    client_name: Optional[str] = None
+    status: str
+    cash_amount: float = 0
+    card_amount: float = 0
+    transfer_amount: float = 0
+    debt_amount: float = 0
+    bonus_earned: float = 0
+    bonus_spent: float = 0
+    refunded_amount: float = 0
+    item_count: int = 0
+
+class SaleLineOut(BaseModel):
+    id: int
+    product_id: int
+    product_name: Optional[str] = None
+    barcode: Optional[str] = None
+    unit: Optional[str] = None
+    quantity: float
+    price: float
+    refunded_quantity: float = 0
+
+class SaleDetailOut(SaleSummaryOut):
+    items: List[SaleLineOut] = []
+
+class RefundItemCreate(BaseModel):
+    sale_item_id: int
+    quantity: float = Field(..., gt=0)
+
+class RefundCreate(BaseModel):
+    items: Optional[List[RefundItemCreate]] = None # Bo'sh bo'lsa - 400. To'liq qaytarish uchun body umuman yuborilmaydi
+
+class OfflineSaleCreate(SaleCreate):
+    client_uuid: UUID # Kassa (terminal) tomonidan yaratilgan
+    created_at: datetime # Savdo offline amalga oshirilgan vaqt
+
+class SaleSyncRequest(BaseModel):
+    sales: List[OfflineSaleCreate] = Field(..., max_length=500)
+    # Qoldiq yetmasa: reject - savdoni rad etish, allow_negative - qabul qilib, qoldiqni minusga tushirish
+    shortfall_policy: Literal["reject", "allow_negative"] = "allow_negative"
+
+class SaleSyncResult(BaseModel):
+    client_uuid: UUID
+    status: str # applied, applied_with_shortfall, duplicate, rejected
+    sale_id: Optional[int] = None
+    detail: Optional[str] = None
+
+class SaleSyncResponse(BaseModel):
+    applied: int = 0
+    duplicates: int = 0
+    rejected: int = 0
+    results: List[SaleSyncResult]
+
+class AttendanceLiveOut(BaseModel):
+    employee_id: int
+    username: str
+    full_name: Optional[str] = None
+    role: str
+    since: datetime # Ishga kelgan vaqti
+
 class ShiftOpen(BaseModel):
     opening_balance: float
     note: Optional[str] = None
@@ -192,8 +319,36 @@ class ShiftOut(BaseModel):
     total_cash: Optional[float] = 0
     total_card: Optional[float] = 0
     total_debt: Optional[float] = 0
+    sales_count: Optional[int] = 0
+    sales_total: Optional[float] = 0
+    refunds_count: Optional[int] = 0
+    refunds_total: Optional[float] = 0
+    debt_collected: Optional[float] = 0
+    debt_collected_cash: Optional[float] = 0
     model_config = ConfigDict(from_attributes=True)
 
+class ZReportOut(BaseModel):
+    shift_id: int
+    opening_balance: float
+    sales_count: int
+    sales_total: float
+    total_cash: float
+    total_card: float
+    total_debt: float
+    net_sales: float
+    refunds_count: int
+    refunds_total: float
+    debt_collected: float
+    debt_collected_cash: float
+    expected_cash: float # opening_balance + total_cash + debt_collected_cash
+    closing_balance: Optional[float] = None
+    cash_difference: Optional[float] = None # closing_balance - expected_cash
+    reconciled: bool # Joriy jamlar to'liq agregat bilan mos keldimi
+    discrepancies: Dict[str, Dict[str, float]] = {}
+
+class ShiftCloseOut(ShiftOut):
+    z_report: ZReportOut
+
 # --- FINANCE SCHEMAS ---
 class ExpenseBase(BaseModel):
     reason: str
@@ -210,6 +365,11 @@ class ExpenseOut(ExpenseBase):
     creator: Optional[EmployeeOut] = None
     model_config = ConfigDict(from_attributes=True)
 
+class ExpenseCategoryOut(BaseModel):
+    id: int
+    name: str
+    model_config = ConfigDict(from_attributes=True)
+
 class PaymentCreate(BaseModel):
     amount: float
     payment_method: str = "cash"
@@ -1,10 +1,14 @@
 import asyncio
 import os
-from sqlalchemy import text
-from database import engine, Base
+from datetime import timezone
+from sqlalchemy import text, select, update, or_, bindparam
+from database import engine, Base, Shift, phone_key, name_key
+from utils.client_ledger import replay, rebuild_debt_aging
+from utils import supplier_ledger
 
 async def update_db():
     print("Database yangilanmoqda...")
+    is_postgres = engine.dialect.name == "postgresql"
     async with engine.begin() as conn:
         # 1. Create new tables (StockMove, etc.)
         await conn.run_sync(Base.metadata.create_all)
@@ -17,12 +21,37 @@ async def update_db():
             ("sales", "bonus_earned", "FLOAT DEFAULT 0"),
             ("sales", "bonus_spent", "FLOAT DEFAULT 0"),
             ("store_settings", "bonus_percentage", "FLOAT DEFAULT 1.0"),
-            ("store_settings", "debt_reminder_days", "INTEGER DEFAULT 3")
+            ("store_settings", "debt_reminder_days", "INTEGER DEFAULT 3"),
+            ("products", "supplier_id", "INTEGER REFERENCES suppliers(id)"),
+            ("store_settings", "version", "INTEGER DEFAULT 1"),
+            ("sales", "client_uuid", "VARCHAR(36)"),
+            ("employees", "phone_key", "VARCHAR(9)"),
+            ("clients", "phone_key", "VARCHAR(9)"),
+            ("sales", "shift_id", "INTEGER REFERENCES shifts(id)"),
+            ("shifts", "sales_count", "INTEGER DEFAULT 0"),
+            ("shifts", "sales_total", "FLOAT DEFAULT 0"),
+            ("shifts", "total_cash", "FLOAT DEFAULT 0"),
+            ("shifts", "total_card", "FLOAT DEFAULT 0"),
+            ("shifts", "total_debt", "FLOAT DEFAULT 0"),
+            ("shifts", "refunds_count", "INTEGER DEFAULT 0"),
+            ("shifts", "refunds_total", "FLOAT DEFAULT 0"),
+            ("shifts", "debt_collected", "FLOAT DEFAULT 0"),
+            ("shifts", "debt_collected_cash", "FLOAT DEFAULT 0"),
+            ("sales", "refunded_amount", "FLOAT DEFAULT 0"),
+            ("sale_items", "refunded_quantity", "FLOAT DEFAULT 0"),
+            ("idempotency_keys", "request_hash", "VARCHAR(64)"),
+            ("shifts", "utc_times", "BOOLEAN DEFAULT FALSE"),
+            ("clients", "name_key", 'VARCHAR COLLATE "C"' if is_postgres else "VARCHAR"),
+            ("supply_receipts", "invoice_thumbnail", "VARCHAR"),
+            ("supply_receipts", "invoice_preview", "VARCHAR"),
+            ("refund_items", "shift_id", "INTEGER REFERENCES shifts(id)")
         ]
         
+        added = set()
         for table, col, col_type in new_columns:
             try:
                 await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {col} {col_type}"))
+                added.add((table, col))
                 print(f"Qo'shildi: {table}.{col}")
             except Exception as e:
                 # Column might already exist
@@ -30,6 +59,225 @@ async def update_db():
                     print(f"Mavjud: {table}.{col}")
                 else:
                     print(f"Xato ({table}.{col}): {e}")
+
+        # 3. Indexes for existing tables (create_all faqat yangi jadvallar uchun index yaratadi)
+        new_indexes = [
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_sales_client_uuid ON sales (client_uuid)",
+            "CREATE INDEX IF NOT EXISTS ix_attendance_employee_created ON attendance (employee_id, created_at)",
+            "CREATE INDEX IF NOT EXISTS ix_employees_phone_key ON employees (phone_key)",
+            "CREATE INDEX IF NOT EXISTS ix_clients_phone_key ON clients (phone_key)",
+            "CREATE INDEX IF NOT EXISTS ix_sales_shift_id ON sales (shift_id)",
+            "CREATE INDEX IF NOT EXISTS ix_payments_shift_id ON payments (shift_id)",
+            "CREATE INDEX IF NOT EXISTS ix_refund_items_shift_id ON refund_items (shift_id)",
+            "CREATE INDEX IF NOT EXISTS ix_sale_items_sale_id ON sale_items (sale_id)",
+            "CREATE INDEX IF NOT EXISTS ix_clients_name_key_id ON clients (name_key, id)",
+            "CREATE INDEX IF NOT EXISTS ix_clients_balance_id ON clients (balance, id)",
+            "CREATE INDEX IF NOT EXISTS ix_clients_debt_due_date_id ON clients (debt_due_date, id)",
+            "CREATE INDEX IF NOT EXISTS ix_supply_receipts_supplier_date ON supply_receipts (supplier_id, date, id)",
+            "CREATE INDEX IF NOT EXISTS ix_supplier_payments_supplier_date ON supplier_payments (supplier_id, date, id)"
+        ]
+
+        # name_key prefiks qidiruvi baytlar bo'yicha collation talab qiladi (en_US.UTF-8 da g'/o' apostrofi e'tiborsiz qoladi).
+        # Avval COLLATE siz qo'shilgan ustun o'zgartiriladi - indeks ham shu bilan qayta quriladi
+        if is_postgres:
+            collation = await conn.scalar(text("""
+                SELECT collation_name FROM information_schema.columns
+                WHERE table_name = 'clients' AND column_name = 'name_key'
+            """))
+            if collation != "C":
+                await conn.execute(text('ALTER TABLE clients ALTER COLUMN name_key TYPE VARCHAR COLLATE "C"'))
+                print('clients.name_key: COLLATE "C"')
+
+        for stmt in new_indexes:
+            try:
+                await conn.execute(text(stmt))
+            except Exception as e:
+                print(f"Index xatosi: {e}")
+
+        # 4. Mavjud yozuvlar uchun phone_key va name_key ni to'ldirish
+        for table in ("employees", "clients"):
+            rows = (await conn.execute(text(f"SELECT id, phone FROM {table} WHERE phone IS NOT NULL AND phone_key IS NULL"))).all()
+            params = [{"id": row_id, "key": phone_key(phone)} for row_id, phone in rows if phone_key(phone)]
+            if params:
+                await conn.execute(text(f"UPDATE {table} SET phone_key = :key WHERE id = :id"), params)
+                print(f"phone_key to'ldirildi: {table} ({len(params)} ta)")
+        rows = (await conn.execute(text("SELECT id, name FROM clients WHERE name IS NOT NULL AND name_key IS NULL"))).all()
+        params = [{"id": row_id, "key": name_key(name)} for row_id, name in rows]
+        if params:
+            await conn.execute(text("UPDATE clients SET name_key = :key WHERE id = :id"), params)
+            print(f"name_key to'ldirildi: clients ({len(params)} ta)")
+
+        # 5. Eski smenalar opened_at/closed_at ni server mahalliy vaqtida (datetime.now()) yozgan, savdolar esa UTC da.
+        #    Bir marta UTC ga o'giriladi (utc_times belgisi bo'yicha - qayta ishga tushirish ikki marta o'girmaydi)
+        legacy_shifts = (await conn.execute(
+            select(Shift.id, Shift.opened_at, Shift.closed_at).where(or_(Shift.utc_times.is_(None), Shift.utc_times.is_(False)))
+        )).all()
+        if legacy_shifts:
+            to_utc = lambda value: value.astimezone(timezone.utc).replace(tzinfo=None) if value else None  # naive - mahalliy vaqt
+            await conn.execute(
+                update(Shift).where(Shift.id == bindparam("shift_id"))
+                .values(opened_at=bindparam("utc_opened"), closed_at=bindparam("utc_closed"), utc_times=True),
+                [{"shift_id": row.id, "utc_opened": to_utc(row.opened_at), "utc_closed": to_utc(row.closed_at)} for row in legacy_shifts]
+            )
+            print(f"Smena vaqtlari UTC ga o'girildi: {len(legacy_shifts)} ta")
+
+        #    Eski savdolarni smenalarga biriktirish (avval /pos/shifts/active qanday hisoblagan bo'lsa, shunday:
+        #    kassir + smena ochilgandan keyingi vaqt). /sales/sync ham shu qoidani ishlatadi - shift_totals.shift_id_at.
+        #    Farqi: oynaga tushmagan offline savdoni sync o'sha paytda ochiq smenaga biriktiradi, backfill esa
+        #    qaysi smena ochiq bo'lganini bilmaydi - bunday savdo smenasiz qoladi. Faqat shift_id IS NULL yangilanadi,
+        #    shuning uchun qayta ishga tushirish sync biriktirganlarini o'zgartirmaydi.
+        res = await conn.execute(text("""
+            UPDATE sales SET shift_id = (
+                SELECT s.id FROM shifts s
+                WHERE s.cashier_id = sales.cashier_id
+                  AND sales.created_at >= s.opened_at
+                  AND (s.closed_at IS NULL OR sales.created_at <= s.closed_at)
+                ORDER BY s.opened_at DESC LIMIT 1
+            )
+            WHERE shift_id IS NULL
+        """))
+        print(f"Savdolar smenalarga biriktirildi: {res.rowcount} ta")
+
+        # 6. Qaytarishlar smenasi: ustun endi qo'shilgan bo'lsa, mavjud qaytarishlar avvalgidek savdo smenasida qoladi
+        #    (ularning jamlari shu smenadan ayrilgan). Faqat bir marta - keyingi smenasiz qaytarishlarga tegmaymiz
+        if ("refund_items", "shift_id") in added:
+            res = await conn.execute(text("""
+                UPDATE refund_items SET shift_id = (SELECT shift_id FROM sales WHERE sales.id = refund_items.sale_id)
+                WHERE shift_id IS NULL
+            """))
+            print(f"Qaytarishlar smenalarga biriktirildi: {res.rowcount} ta")
+
+        #    Eski (to'liq) qaytarishlarni refund_items ga ko'chirish - sof jamlar endi shu jadvaldan ayriladi
+        legacy = (await conn.execute(text("""
+            SELECT s.id, s.total_amount, s.cash_amount, s.card_amount, s.transfer_amount, s.debt_amount, s.bonus_earned,
+                   s.cashier_id, s.created_at, s.shift_id
+            FROM sales s
+            WHERE s.status = 'refunded' AND NOT EXISTS (SELECT 1 FROM refund_items r WHERE r.sale_id = s.id)
+        """))).all()
+        if legacy:
+            sale_ids = [row.id for row in legacy]
+            lines = {}
+            for line in (await conn.execute(
+                text("SELECT id, sale_id, product_id, quantity, price FROM sale_items WHERE sale_id IN (%s)" % ",".join(map(str, sale_ids)))
+            )).all():
+                lines.setdefault(line.sale_id, []).append(line)
+            fields = ("total_amount", "cash_amount", "card_amount", "transfer_amount", "debt_amount", "bonus_earned")
+            params = []
+            for sale in legacy:
+                sale_lines = lines.get(sale.id, [])
+                value = sum((l.quantity or 0) * (l.price or 0) for l in sale_lines)
+                for l in sale_lines:
+                    share = ((l.quantity or 0) * (l.price or 0) / value) if value else 1 / len(sale_lines)
+                    amounts = [(getattr(sale, f) or 0) * share for f in fields]
+                    params.append({
+                        "sale_id": sale.id, "sale_item_id": l.id, "product_id": l.product_id, "quantity": l.quantity,
+                        "amount": amounts[0], "cash": amounts[1], "card": amounts[2], "transfer": amounts[3],
+                        "debt": amounts[4], "bonus": amounts[5], "created_by": sale.cashier_id, "shift_id": sale.shift_id,
+                        "created_at": sale.created_at,
+                    })
+            if params:
+                await conn.execute(text("""
+                    INSERT INTO refund_items (sale_id, sale_item_id, product_id, quantity, amount, cash_amount, card_amount,
+                                              transfer_amount, debt_amount, bonus_amount, created_by, shift_id, created_at)
+                    VALUES (:sale_id, :sale_item_id, :product_id, :quantity, :amount, :cash, :card, :transfer, :debt, :bonus,
+                            :created_by, :shift_id, :created_at)
+                """), params)
+            print(f"Eski qaytarishlar refund_items ga ko'chirildi: {len(legacy)} ta savdo")
+        await conn.execute(text("UPDATE sales SET refunded_amount = total_amount WHERE status = 'refunded' AND COALESCE(refunded_amount, 0) = 0"))
+        await conn.execute(text("""
+            UPDATE sale_items SET refunded_quantity = quantity
+            WHERE COALESCE(refunded_quantity, 0) = 0 AND sale_id IN (SELECT id FROM sales WHERE status = 'refunded')
+        """))
+
+        # 7. Smena jamlarini hisoblash (faqat hali jamlari bo'lmagan smenalar - ishlab turganlariga tegmaymiz)
+        res = await conn.execute(text("""
+            UPDATE shifts SET
+                sales_count = (SELECT COUNT(*) FROM sales WHERE sales.shift_id = shifts.id),
+                sales_total = (SELECT COALESCE(SUM(total_amount), 0) FROM sales WHERE sales.shift_id = shifts.id),
+                total_cash = (SELECT COALESCE(SUM(cash_amount), 0) FROM sales WHERE sales.shift_id = shifts.id)
+                    - (SELECT COALESCE(SUM(r.cash_amount), 0) FROM refund_items r WHERE r.shift_id = shifts.id),
+                total_card = (SELECT COALESCE(SUM(card_amount + transfer_amount), 0) FROM sales WHERE sales.shift_id = shifts.id)
+                    - (SELECT COALESCE(SUM(r.card_amount + r.transfer_amount), 0) FROM refund_items r WHERE r.shift_id = shifts.id),
+                total_debt = (SELECT COALESCE(SUM(debt_amount), 0) FROM sales WHERE sales.shift_id = shifts.id)
+                    - (SELECT COALESCE(SUM(r.debt_amount), 0) FROM refund_items r WHERE r.shift_id = shifts.id),
+                refunds_count = (SELECT COUNT(DISTINCT r.sale_id) FROM refund_items r WHERE r.shift_id = shifts.id),
+                refunds_total = (SELECT COALESCE(SUM(r.amount), 0) FROM refund_items r WHERE r.shift_id = shifts.id),
+                debt_collected = (SELECT COALESCE(SUM(amount), 0) FROM payments WHERE payments.shift_id = shifts.id),
+                debt_collected_cash = (SELECT COALESCE(SUM(amount), 0) FROM payments WHERE payments.shift_id = shifts.id AND payment_method = 'cash')
+            WHERE sales_count IS NULL OR sales_count = 0
+        """))
+        print(f"Smena jamlari hisoblandi: {res.rowcount} ta")
+
+        # 8. Mijoz hisobi: hali yozuvi yo'q mijozlar uchun savdo qarzlari, qaytarishlar va to'lovlardan tiklanadi.
+        #    Tarixdan oldingi farq (qo'lda kiritilgan balans) "opening" yozuvi bo'ladi - oxirgi balance_after = Client.balance
+        clients = (await conn.execute(text("""
+            SELECT id, COALESCE(balance, 0) AS balance, created_at FROM clients c
+            WHERE NOT EXISTS (SELECT 1 FROM client_ledger l WHERE l.client_id = c.id)
+        """))).all()
+        if clients:
+            history = {}
+            for row in (await conn.execute(text("""
+                SELECT client_id, created_at, 'sale' AS entry_type, -debt_amount AS amount, id AS sale_id, NULL AS payment_id, cashier_id AS created_by
+                FROM sales WHERE client_id IS NOT NULL AND debt_amount > 0
+                UNION ALL
+                SELECT s.client_id, MIN(r.created_at), 'refund', SUM(r.debt_amount), r.sale_id, NULL, MIN(r.created_by)
+                FROM refund_items r JOIN sales s ON s.id = r.sale_id
+                WHERE s.client_id IS NOT NULL AND r.debt_amount > 0
+                GROUP BY s.client_id, r.sale_id, r.created_at
+                UNION ALL
+                SELECT client_id, created_at, 'payment', amount, NULL, id, created_by
+                FROM payments WHERE client_id IS NOT NULL
+            """))).all():
+                history.setdefault(row.client_id, []).append(dict(row._mapping))
+            params = []
+            for client in clients:
+                entries = sorted(history.get(client.id, []), key=lambda e: str(e["created_at"]))
+                opening = client.balance - sum(e["amount"] for e in entries)
+                if abs(opening) > 0.01:
+                    opened_at = min([client.created_at] + [e["created_at"] for e in entries[:1]], key=str)
+                    entries.insert(0, {"client_id": client.id, "created_at": opened_at, "entry_type": "opening",
+                                       "amount": opening, "sale_id": None, "payment_id": None, "created_by": None})
+                params.extend(replay(entries))
+            if params:
+                await conn.execute(text("""
+                    INSERT INTO client_ledger (client_id, entry_type, amount, balance_after, open_amount, sale_id, payment_id, created_by, created_at)
+                    VALUES (:client_id, :entry_type, :amount, :balance_after, :open_amount, :sale_id, :payment_id, :created_by, :created_at)
+                """), params)
+            print(f"Mijoz hisobi tiklandi: {len(clients)} ta mijoz, {len(params)} ta yozuv")
+
+        # 9. Qarz yoshi jadvali (har kecha ham qayta hisoblanadi)
+        print(f"Qarz yoshi jadvali: {await rebuild_debt_aging(conn)} ta qarzdor")
+
+        # 10. Firma hisobi: hali yozuvi yo'q firmalar uchun kirim va to'lovlardan tiklanadi (farq - "opening")
+        suppliers = (await conn.execute(text("""
+            SELECT id, COALESCE(balance, 0) AS balance, created_at FROM suppliers s
+            WHERE NOT EXISTS (SELECT 1 FROM supplier_ledger l WHERE l.supplier_id = s.id)
+        """))).all()
+        if suppliers:
+            history = {}
+            for row in (await conn.execute(text("""
+                SELECT supplier_id, date AS created_at, 'receipt' AS entry_type, total_amount AS amount, id AS receipt_id, NULL AS payment_id
+                FROM supply_receipts WHERE supplier_id IS NOT NULL
+                UNION ALL
+                SELECT supplier_id, date, 'payment', -amount, NULL, id
+                FROM supplier_payments WHERE supplier_id IS NOT NULL
+            """))).all():
+                history.setdefault(row.supplier_id, []).append(dict(row._mapping))
+            params = []
+            for supplier in suppliers:
+                entries = sorted(history.get(supplier.id, []), key=lambda e: str(e["created_at"]))
+                opening = supplier.balance - sum(e["amount"] for e in entries)
+                if abs(opening) > 0.01:
+                    opened_at = min([supplier.created_at] + [e["created_at"] for e in entries[:1]], key=str)
+                    entries.insert(0, {"supplier_id": supplier.id, "created_at": opened_at, "entry_type": "opening",
+                                       "amount": opening, "receipt_id": None, "payment_id": None})
+                params.extend(supplier_ledger.replay(entries))
+            if params:
+                await conn.execute(text("""
+                    INSERT INTO supplier_ledger (supplier_id, entry_type, amount, balance_after, receipt_id, payment_id, created_at)
+                    VALUES (:supplier_id, :entry_type, :amount, :balance_after, :receipt_id, :payment_id, :created_at)
+                """), params)
+            print(f"Firma hisobi tiklandi: {len(suppliers)} ta firma, {len(params)} ta yozuv")
                     
     print("Baza muvaffaqiyatli yangilandi.")
 
@@ -0,0 +1,50 @@
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Attendance, Employee
+
+
+def last_status_subquery():
+    """Xodimning oxirgi davomat holati ("in"/"out"), (employee_id, created_at) indeksidan foydalanadi"""
+    return (
+        select(Attendance.status)
+        .where(Attendance.employee_id == Employee.id)
+        .order_by(Attendance.created_at.desc(), Attendance.id.desc())
+        .limit(1)
+        .correlate(Employee)
+        .scalar_subquery()
+    )
+
+
+async def get_employee_with_status(db: AsyncSession, telegram_id: int):
+    """Xodim va uning oxirgi holatini bitta so'rovda qaytaradi: (employee, status) yoki (None, None)"""
+    res = await db.execute(
+        select(Employee, last_status_subquery().label("last_status"))
+        .where(Employee.telegram_id == telegram_id)
+        .limit(1)
+    )
+    row = res.first()
+    if row is None:
+        return None, None
+    return row[0], row[1]
+
+
+async def get_working_now(db: AsyncSession):
+    """Hozirda ishda bo'lgan xodimlar: [(employee, since), ...] - bitta window so'rov"""
+    ranked = select(
+        Attendance.employee_id,
+        Attendance.status,
+        Attendance.created_at,
+        func.row_number().over(
+            partition_by=Attendance.employee_id,
+            order_by=(Attendance.created_at.desc(), Attendance.id.desc())
+        ).label("rn")
+    ).subquery()
+
+    res = await db.execute(
+        select(Employee, ranked.c.created_at)
+        .join(ranked, ranked.c.employee_id == Employee.id)
+        .where(ranked.c.rn == 1, ranked.c.status == "in")
+        .order_by(ranked.c.created_at)
+    )
+    return res.all()
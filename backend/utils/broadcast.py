@@ -0,0 +1,209 @@
+import os
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import select, update, insert, exists, func
+
+from database import SessionLocal, Client, Broadcast, BroadcastDelivery
+from utils.telegram import telegram_sender
+
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))  # Parallel yuboruvchilar soni
+BROADCAST_CHUNK = 1000  # Mijozlar bazadan shu miqdorda o'qiladi
+DELIVERY_FLUSH_SIZE = 100  # Yetkazish jurnali shu miqdorda yoziladi
+PROGRESS_INTERVAL = 5  # Progress xabari necha soniyada yangilanadi
+
+# Ishlayotgan broadcast vazifalari (GC yig'ib olmasligi uchun)
+_running_tasks = {}
+
+
+def progress_text(b: Broadcast, done: bool = False) -> str:
+    processed = b.sent + b.failed + b.blocked
+    head = "✅ <b>Xabar yuborish tugadi</b>" if done else "⏳ <b>Xabar yuborilmoqda...</b>"
+    return (
+        f"{head}\n\n"
+        f"📊 Jarayon: {processed} / {b.total}\n"
+        f"✅ Yuborildi: {b.sent}\n"
+        f"🚫 Bloklagan: {b.blocked}\n"
+        f"❌ Xatolik: {b.failed}"
+    )
+
+
+def _send_fn(bot, b: Broadcast, chat_id: int):
+    if b.content_type == "photo":
+        return lambda: bot.send_photo(chat_id, b.file_id, caption=b.text)
+    if b.content_type == "video":
+        return lambda: bot.send_video(chat_id, b.file_id, caption=b.text)
+    return lambda: bot.send_message(chat_id, b.text)
+
+
+async def _recipients(broadcast_id: int):
+    """Hali yuborilmagan mijozlarni bo'laklab qaytaradi (keyset pagination)"""
+    last_id = 0
+    while True:
+        async with SessionLocal() as db:
+            already = exists().where(
+                BroadcastDelivery.broadcast_id == broadcast_id,
+                BroadcastDelivery.chat_id == Client.telegram_id
+            )
+            res = await db.execute(
+                select(Client.id, Client.telegram_id)
+                .where(Client.telegram_id.isnot(None), Client.id > last_id, ~already)
+                .order_by(Client.id)
+                .limit(BROADCAST_CHUNK)
+            )
+            rows = res.all()
+        if not rows:
+            return
+        for _, chat_id in rows:
+            yield chat_id
+        last_id = rows[-1][0]
+
+
+async def _flush(broadcast_id: int, results: list):
+    if not results:
+        return
+    batch = results[:]
+    results.clear()
+    counts = {"sent": 0, "failed": 0, "blocked": 0}
+    for r in batch:
+        counts[r["status"]] += 1
+    async with SessionLocal() as db:
+        await db.execute(insert(BroadcastDelivery), batch)
+        await db.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id)
+            .values(
+                sent=Broadcast.sent + counts["sent"],
+                failed=Broadcast.failed + counts["failed"],
+                blocked=Broadcast.blocked + counts["blocked"]
+            )
+        )
+        await db.commit()
+
+
+async def _edit_progress(bot, broadcast_id: int, done: bool = False):
+    async with SessionLocal() as db:
+        b = await db.get(Broadcast, broadcast_id)
+    if not b or not b.progress_message_id:
+        return
+    try:
+        await bot.edit_message_text(progress_text(b, done), chat_id=b.admin_chat_id, message_id=b.progress_message_id)
+    except Exception:
+        # "message is not modified" va shunga o'xshash xatolar muhim emas
+        pass
+
+
+async def run_broadcast(bot, broadcast_id: int):
+    """Broadcastni boshidan yoki to'xtagan joyidan davom ettiradi"""
+    async with SessionLocal() as db:
+        b = await db.get(Broadcast, broadcast_id)
+        if not b or b.status == "done":
+            return
+        b.status = "running"
+        await db.commit()
+
+    queue = asyncio.Queue(maxsize=BROADCAST_CONCURRENCY * 4)
+    results = []
+    flush_lock = asyncio.Lock()
+
+    async def flush():
+        async with flush_lock:
+            await _flush(broadcast_id, results)
+
+    async def worker():
+        while True:
+            chat_id = await queue.get()
+            try:
+                if chat_id is None:
+                    return
+                try:
+                    status, error = await telegram_sender.send(chat_id, _send_fn(bot, b, chat_id))
+                except Exception as e:
+                    status, error = "failed", str(e)[:255]
+                results.append({
+                    "broadcast_id": broadcast_id,
+                    "chat_id": chat_id,
+                    "status": status,
+                    "error": error,
+                    "created_at": datetime.now(timezone.utc)
+                })
+                if len(results) >= DELIVERY_FLUSH_SIZE:
+                    await flush()
+            finally:
+                queue.task_done()
+
+    async def progress_loop():
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            await flush()
+            await _edit_progress(bot, broadcast_id)
+
+    workers = [asyncio.create_task(worker()) for _ in range(BROADCAST_CONCURRENCY)]
+    progress = asyncio.create_task(progress_loop())
+    started = time.monotonic()
+    try:
+        async for chat_id in _recipients(broadcast_id):
+            await queue.put(chat_id)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        progress.cancel()
+        for w in workers:
+            w.cancel()
+        await flush()
+
+    async with SessionLocal() as db:
+        b = await db.get(Broadcast, broadcast_id)
+        b.status = "done"
+        b.finished_at = datetime.now(timezone.utc)
+        await db.commit()
+
+    await _edit_progress(bot, broadcast_id, done=True)
+    print(f"📢 Broadcast #{broadcast_id} tugadi: {b.sent} yuborildi, {b.failed} xatolik ({time.monotonic() - started:.0f}s)")
+    return b
+
+
+def start_broadcast(bot, broadcast_id: int) -> asyncio.Task:
+    """Broadcastni fonda ishga tushiradi (admin handleri kutib turmaydi)"""
+    def on_done(t: asyncio.Task):
+        _running_tasks.pop(broadcast_id, None)
+        if not t.cancelled() and t.exception():
+            print(f"❌ Broadcast #{broadcast_id} xatolik bilan to'xtadi: {t.exception()}")
+
+    task = asyncio.create_task(run_broadcast(bot, broadcast_id))
+    _running_tasks[broadcast_id] = task
+    task.add_done_callback(on_done)
+    return task
+
+
+async def create_broadcast(admin_chat_id: int, progress_message_id: int, content_type: str, text: str = None, file_id: str = None) -> int:
+    async with SessionLocal() as db:
+        total = await db.scalar(select(func.count(Client.id)).where(Client.telegram_id.isnot(None)))
+        b = Broadcast(
+            admin_chat_id=admin_chat_id,
+            progress_message_id=progress_message_id,
+            content_type=content_type,
+            text=text,
+            file_id=file_id,
+            total=total or 0,
+            status="pending"
+        )
+        db.add(b)
+        await db.commit()
+        return b.id
+
+
+async def resume_broadcasts(bot):
+    """Server qayta ishga tushganda tugallanmagan broadcastlarni davom ettirish"""
+    try:
+        async with SessionLocal() as db:
+            res = await db.execute(select(Broadcast.id).where(Broadcast.status.in_(["pending", "running"])))
+            ids = res.scalars().all()
+        for broadcast_id in ids:
+            if broadcast_id not in _running_tasks:
+                print(f"📢 Broadcast #{broadcast_id} davom ettirilmoqda...")
+                start_broadcast(bot, broadcast_id)
+    except Exception as e:
+        print(f"❌ Broadcastlarni tiklashda xatolik: {e}")
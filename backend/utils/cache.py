@@ -0,0 +1,154 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Optional
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+logger = logging.getLogger(__name__)
+
+# Kesh sozlamalari
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))  # soniya
+# Bir nechta worker uchun umumiy kesh (masalan: redis://localhost:6379/0). Bo'sh bo'lsa - jarayon ichidagi LRU
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL")
+
+
+class MemoryLRUBackend:
+    """Jarayon ichidagi LRU kesh (default)"""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple[bytes, float]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    async def delete_prefix(self, prefix: str) -> None:
+        for key in [k for k in self._data if k.startswith(prefix)]:
+            self._data.pop(key, None)
+
+    def size(self) -> int:
+        return len(self._data)
+
+
+class RedisBackend:
+    """Bir nechta uvicorn worker uchun umumiy kesh (redis kutubxonasi kerak)"""
+
+    KEY_PREFIX = "kassa:cache:"
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis  # ixtiyoriy bog'liqlik
+        self._redis = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._redis.get(self.KEY_PREFIX + key)
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        await self._redis.set(self.KEY_PREFIX + key, value, ex=ttl)
+
+    async def delete_prefix(self, prefix: str) -> None:
+        keys = [k async for k in self._redis.scan_iter(match=self.KEY_PREFIX + prefix + "*")]
+        if keys:
+            await self._redis.delete(*keys)
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class ResponseCache:
+    """Kam o'zgaradigan GET javoblarini tayyor JSON bayt ko'rinishida saqlaydi.
+
+    Kalit: route + rol (+ so'rov parametrlari). Yozuvchi endpointlar commitdan keyin
+    invalidate() chaqiradi.
+    """
+
+    def __init__(self, backend, ttl: int = RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    @staticmethod
+    def _key(route: str, role: str, params: str = "") -> str:
+        return f"{route}|{role}|{params}"
+
+    async def get(self, route: str, role: str, params: str = "") -> Optional[Response]:
+        try:
+            body = await self.backend.get(self._key(route, role, params))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Cache read error ({route}): {e}")
+            body = None
+
+        if body is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return Response(content=body, media_type="application/json", headers={"X-Cache": "HIT"})
+
+    async def store(self, route: str, role: str, adapter: TypeAdapter, data: Any, params: str = "") -> Response:
+        body = adapter.dump_json(adapter.validate_python(data, from_attributes=True))
+        return await self.store_bytes(route, role, body, params)
+
+    async def store_bytes(self, route: str, role: str, body: bytes, params: str = "") -> Response:
+        """Tayyor JSON baytlarni saqlash (masalan: fast_json orqali yig'ilgan ro'yxat)"""
+        try:
+            await self.backend.set(self._key(route, role, params), body, self.ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Cache write error ({route}): {e}")
+        return Response(content=body, media_type="application/json", headers={"X-Cache": "MISS"})
+
+    async def invalidate(self, *routes: str) -> None:
+        for route in routes:
+            self.invalidations += 1
+            try:
+                await self.backend.delete_prefix(f"{route}|")
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Cache invalidate error ({route}): {e}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+            "entries": self.backend.size(),
+            "ttl": self.ttl,
+        }
+
+
+def _create_backend():
+    if RESPONSE_CACHE_URL:
+        try:
+            return RedisBackend(RESPONSE_CACHE_URL)
+        except ImportError:
+            logger.warning("RESPONSE_CACHE_URL berilgan, lekin 'redis' o'rnatilmagan. LRU kesh ishlatiladi.")
+    return MemoryLRUBackend()
+
+
+response_cache = ResponseCache(_create_backend())
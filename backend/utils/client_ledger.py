@@ -0,0 +1,180 @@
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import select, update, delete, insert, func, case, literal
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal, Client, ClientLedger, ClientDebtAging
+
+# Bundan kichik qoldiqlar (float yaxlitlash) yopilgan hisoblanadi
+DEBT_EPSILON = 0.01
+
+
+def _utcnow() -> datetime:
+    # created_at ustunlari timezone siz - solishtirish uchun naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _aging_columns(now: datetime):
+    """Ochiq qarz yozuvlarini yoshi bo'yicha jamlash (kun chegaralari Pythonda hisoblanadi)"""
+    day_30 = now - timedelta(days=30)
+    day_60 = now - timedelta(days=60)
+    open_amount = ClientLedger.open_amount
+    created = ClientLedger.created_at
+    return (
+        func.sum(open_amount).label("total_debt"),
+        func.sum(case((created >= day_30, open_amount), else_=0)).label("days_0_30"),
+        func.sum(case(((created < day_30) & (created >= day_60), open_amount), else_=0)).label("days_31_60"),
+        func.sum(case((created < day_60, open_amount), else_=0)).label("days_60_plus"),
+        func.min(created).label("oldest_debt_at"),
+    )
+
+
+async def refresh_client_aging(db: AsyncSession, client_id: int, now: Optional[datetime] = None) -> None:
+    """Bitta mijozning qarz yoshi qatori (faqat uning ochiq yozuvlari, client_id indeksi orqali)"""
+    now = now or _utcnow()
+    row = (await db.execute(
+        select(*_aging_columns(now))
+        .where(ClientLedger.client_id == client_id, ClientLedger.open_amount > 0)
+    )).one()
+    await db.execute(delete(ClientDebtAging).where(ClientDebtAging.client_id == client_id))
+    if (row.total_debt or 0) > DEBT_EPSILON:
+        await db.execute(insert(ClientDebtAging).values(client_id=client_id, updated_at=now, **row._mapping))
+
+
+async def rebuild_debt_aging(executor, now: Optional[datetime] = None) -> int:
+    """Barcha qarzdorlar uchun qayta hisoblash: bitta DELETE va bitta INSERT ... SELECT.
+
+    executor - AsyncSession yoki AsyncConnection (update_db ham ishlatadi). Commit chaqiruvchida.
+    """
+    now = now or _utcnow()
+    aging = _aging_columns(now)
+    await executor.execute(delete(ClientDebtAging))
+    result = await executor.execute(
+        insert(ClientDebtAging).from_select(
+            ["client_id", "total_debt", "days_0_30", "days_31_60", "days_60_plus", "oldest_debt_at", "updated_at"],
+            select(ClientLedger.client_id, *aging, literal(now, ClientDebtAging.updated_at.type))
+            .where(ClientLedger.open_amount > 0)
+            .group_by(ClientLedger.client_id)
+            .having(aging[0] > DEBT_EPSILON)
+        )
+    )
+    return result.rowcount
+
+
+async def refresh_debt_aging():
+    """Har kecha: qarzlar vaqt o'tishi bilan keyingi kun oralig'iga o'tadi"""
+    try:
+        async with SessionLocal() as db:
+            count = await rebuild_debt_aging(db)
+            await db.commit()
+        print(f"📒 Qarz yoshi jadvali yangilandi: {count} ta qarzdor")
+        return count
+    except Exception as e:
+        print(f"❌ Qarz yoshi jadvalini hisoblashda xatolik: {e}")
+        return None
+
+
+def _close_lots(lots: list, amount: float, sale_id: Optional[int] = None) -> list:
+    """FIFO: eng eski ochiq qarzlar birinchi yopiladi. Qaytarishda avval o'sha savdoning qarzi yopiladi.
+
+    lots - [{"id", "open_amount", "sale_id"}] eng eskidan boshlab. O'zgargan yozuvlarni qaytaradi.
+    """
+    if sale_id is not None:
+        lots = sorted(lots, key=lambda lot: lot.get("sale_id") != sale_id)
+    changed = []
+    for lot in lots:
+        if amount <= DEBT_EPSILON:
+            break
+        take = min(lot["open_amount"], amount)
+        amount -= take
+        lot["open_amount"] -= take
+        if lot["open_amount"] <= DEBT_EPSILON:
+            lot["open_amount"] = 0.0
+        changed.append(lot)
+    return changed
+
+
+def _debt_change(old_balance: float, amount: float):
+    """(yangi ochiq qarz, yopiladigan qarz). Oldindan to'lov (musbat balans) qarzga aylanmaguncha qarz ochilmaydi"""
+    old_debt = max(0.0, -old_balance)
+    new_debt = max(0.0, -(old_balance + amount))
+    return max(0.0, new_debt - old_debt), max(0.0, old_debt - new_debt)
+
+
+async def post(
+    db: AsyncSession,
+    client_id: int,
+    amount: float,
+    entry_type: str,
+    sale_id: Optional[int] = None,
+    payment_id: Optional[int] = None,
+    created_by: Optional[int] = None,
+    created_at: Optional[datetime] = None
+) -> Optional[float]:
+    """Client.balance ni o'zgartirishning yagona yo'li: atomar UPDATE ... RETURNING, hisob yozuvi va qarz yoshi.
+
+    amount - balansga ta'sir (qarz manfiy). Yangi balansni qaytaradi (mijoz topilmasa - None).
+    """
+    if not client_id or not amount:
+        return None
+    new_balance = await db.scalar(
+        update(Client)
+        .where(Client.id == client_id)
+        .values(balance=func.coalesce(Client.balance, 0) + amount)
+        .returning(Client.balance)
+        .execution_options(synchronize_session=False)
+    )
+    if new_balance is None:
+        return None
+    # Sessiyada yuklangan mijoz obyekti eski balansni ko'rsatmasligi uchun
+    loaded = db.sync_session.identity_map.get(db.sync_session.identity_key(Client, client_id))
+    if loaded is not None:
+        set_committed_value(loaded, "balance", new_balance)
+
+    opened, closed = _debt_change(new_balance - amount, amount)
+    if closed:
+        lots = [dict(row._mapping) for row in (await db.execute(
+            select(ClientLedger.id, ClientLedger.open_amount, ClientLedger.sale_id)
+            .where(ClientLedger.client_id == client_id, ClientLedger.open_amount > 0)
+            .order_by(ClientLedger.created_at, ClientLedger.id)
+        )).all()]
+        changed = _close_lots(lots, closed, sale_id if entry_type == "refund" else None)
+        if changed:
+            await db.execute(update(ClientLedger), [{"id": lot["id"], "open_amount": lot["open_amount"]} for lot in changed])
+
+    await db.execute(insert(ClientLedger).values(
+        client_id=client_id,
+        entry_type=entry_type,
+        amount=amount,
+        balance_after=new_balance,
+        open_amount=opened,
+        sale_id=sale_id,
+        payment_id=payment_id,
+        created_by=created_by,
+        created_at=created_at or datetime.now(timezone.utc)
+    ))
+    if opened or closed:
+        await refresh_client_aging(db, client_id)
+    return new_balance
+
+
+def replay(entries: List[dict]) -> List[dict]:
+    """Tarixdan hisobni tiklash (update_db backfill): entries vaqt bo'yicha tartiblangan,
+    har biriga balance_after va open_amount qo'shiladi - post() bilan bir xil qoidalar.
+    """
+    balance = 0.0
+    lots = []
+    for entry in entries:
+        opened, closed = _debt_change(balance, entry["amount"])
+        if closed:
+            lots.sort(key=lambda lot: str(lot["created_at"]))  # post() dagi kabi - created_at bo'yicha FIFO
+            _close_lots(lots, closed, entry.get("sale_id") if entry["entry_type"] == "refund" else None)
+        balance += entry["amount"]
+        entry["balance_after"] = balance
+        entry["open_amount"] = opened
+        if opened:
+            lots.append(entry)
+        lots = [lot for lot in lots if lot["open_amount"] > 0]
+    return entries
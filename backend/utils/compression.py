@@ -0,0 +1,230 @@
+import os
+import zlib
+import hashlib
+from collections import OrderedDict
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli  # ixtiyoriy bog'liqlik (pip install brotli)
+except ImportError:
+    brotli = None
+
+# Siqish sozlamalari
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))  # bayt, bundan kichik javoblar siqilmaydi
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+# Katalog snapshotlari: shu yo'llarning siqilgan javobi kontent xeshi bo'yicha saqlanadi (bir xil body - qayta siqilmaydi)
+COMPRESS_CACHE_PATHS = [p.strip() for p in os.getenv(
+    "COMPRESS_CACHE_PATHS", "/inventory/products,/inventory/categories,/crm/clients"
+).split(",") if p.strip()]
+COMPRESS_CACHE_ENTRIES = int(os.getenv("COMPRESS_CACHE_ENTRIES", "32"))
+
+# Faqat matnli turlar. XLSX/rasmlar allaqachon siqilgan, SSE esa darhol yetib borishi kerak
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "text/csv",
+    "text/plain",
+    "text/html",
+    "text/css",
+}
+
+
+def _accepted_encodings(header: str) -> dict:
+    """'gzip;q=0.5, br' -> {'gzip': 0.5, 'br': 1.0}"""
+    result = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            result[name.strip().lower()] = q
+    return result
+
+
+def choose_encoding(accept_encoding: str):
+    accepted = _accepted_encodings(accept_encoding)
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    """Oqimli siqish: har bir bo'lak darhol flush qilinadi (eksportlar buferlanmaydi)"""
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=level)
+        else:
+            self._c = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 - gzip sarlavhasi bilan
+
+    def chunk(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._c.process(data) + self._c.flush()
+        return self._c.compress(data) + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._c.process(data) + self._c.finish()
+        return self._c.compress(data) + self._c.flush()
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return _Compressor(encoding, level).finish(data)
+
+
+class CompressionStats:
+    def __init__(self):
+        self.responses = 0
+        self.streamed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cache_hits = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "responses": self.responses,
+            "streamed": self.streamed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else 0.0,
+            "cache_hits": self.cache_hits,
+        }
+
+
+compression_stats = CompressionStats()
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware: gzip (brotli o'rnatilgan bo'lsa - br) siqish.
+
+    - COMPRESS_MIN_SIZE dan kichik va COMPRESSIBLE_TYPES ga kirmaydigan javoblar o'zgarmaydi
+    - StreamingResponse (CSV eksport) bo'laklab siqiladi, butun javob xotiraga yig'ilmaydi
+    - COMPRESS_CACHE_PATHS dagi javoblar siqilgan holda LRU da saqlanadi
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_SIZE, cache_paths=COMPRESS_CACHE_PATHS,
+                 cache_entries: int = COMPRESS_CACHE_ENTRIES, stats: CompressionStats = compression_stats):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache_paths = set(cache_paths)
+        self.cache_entries = cache_entries
+        self.stats = stats
+        self._cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _Responder(self, scope, encoding, send)
+        await self.app(scope, receive, responder)
+
+    def level(self, encoding: str) -> int:
+        return COMPRESS_BROTLI_QUALITY if encoding == "br" else COMPRESS_GZIP_LEVEL
+
+    def compress_body(self, path: str, encoding: str, body: bytes) -> bytes:
+        if path not in self.cache_paths:
+            return compress(body, encoding, self.level(encoding))
+        # Kalit - body xeshi: katalog o'zgarsa, xesh ham o'zgaradi (alohida invalidatsiya kerak emas)
+        key = (path, encoding, hashlib.blake2b(body, digest_size=16).digest())
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.stats.cache_hits += 1
+            return cached
+        compressed = compress(body, encoding, self.level(encoding))
+        self._cache[key] = compressed
+        while len(self._cache) > self.cache_entries:
+            self._cache.popitem(last=False)
+        return compressed
+
+
+class _Responder:
+    def __init__(self, middleware: CompressionMiddleware, scope, encoding: str, send):
+        self.mw = middleware
+        self.path = scope["path"]
+        self.encoding = encoding
+        self.send = send
+        self.start = None
+        self.mode = None  # None - hali noma'lum, "plain" - o'zgartirmasdan, "stream" - bo'laklab siqish
+        self.compressor = None
+
+    def _compressible(self, message) -> bool:
+        headers = Headers(raw=message["headers"])
+        if message["status"] < 200 or message["status"] in (204, 304):
+            return False
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        return content_type in COMPRESSIBLE_TYPES
+
+    def _set_headers(self, content_length=None):
+        headers = MutableHeaders(raw=self.start["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if content_length is None:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(content_length)
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            if not self._compressible(message):
+                self.mode = "plain"
+                await self.send(message)
+            return
+
+        if message["type"] != "http.response.body" or self.mode == "plain":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        stats = self.mw.stats
+
+        if self.mode is None:
+            if not more_body:
+                # Butun javob bitta bo'lakda
+                if len(body) < self.mw.minimum_size:
+                    self.mode = "plain"
+                    await self.send(self.start)
+                    await self.send(message)
+                    return
+                compressed = self.mw.compress_body(self.path, self.encoding, body)
+                stats.responses += 1
+                stats.bytes_in += len(body)
+                stats.bytes_out += len(compressed)
+                self._set_headers(len(compressed))
+                await self.send(self.start)
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+            # Oqim: uzunlik oldindan noma'lum
+            self.mode = "stream"
+            self.compressor = _Compressor(self.encoding, self.mw.level(self.encoding))
+            stats.responses += 1
+            stats.streamed += 1
+            self._set_headers()
+            await self.send(self.start)
+
+        data = self.compressor.chunk(body) if more_body else self.compressor.finish(body)
+        stats.bytes_in += len(body)
+        stats.bytes_out += len(data)
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
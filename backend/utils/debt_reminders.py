@@ -0,0 +1,111 @@
+import os
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, insert, exists, case, literal
+
+from database import SessionLocal, Client, DebtReminder
+from utils.settings_provider import settings_provider
+from utils.telegram import telegram_sender
+
+DEBT_REMINDER_CONCURRENCY = int(os.getenv("DEBT_REMINDER_CONCURRENCY", "8"))  # Parallel yuboruvchilar soni
+DEBT_REMINDER_CHUNK = 500  # Mijozlar bazadan shu miqdorda o'qiladi
+OVERDUE = -1  # Muddati o'tgan qarz uchun days_left qiymati
+
+
+def reminder_text(name: str, debt: float, days_left: int) -> str:
+    if days_left == OVERDUE:
+        return f"‼️ {name}, siz qarzingizni kechiktirdingiz!\n💰 Qarzingiz: {debt:,.0f} so'm.\nIltimos, tezroq to'lang."
+    if days_left == 0:
+        return f"🚨 {name}, bugun qarzingizni to'lash muddati!\n💰 Iltimos, {debt:,.0f} so'm to'lang."
+    if days_left == 1:
+        return f"⚠️ Diqqat: {name}, ertaga qarzingizni to'lash muddati tugaydi!\n💰 Summa: {debt:,.0f} so'm"
+    return f"🔔 Eslatma: {name}, qarzingizni to'lashga {days_left} kun qoldi.\n💰 Summa: {debt:,.0f} so'm"
+
+
+def _days_left_expr(today_start: datetime, reminder_days: int):
+    """Muddatgacha qolgan kunni SQLda hisoblaydi (kun chegaralari Pythonda tayyorlanadi)"""
+    whens = [(Client.debt_due_date < today_start, literal(OVERDUE))]
+    for day in range(reminder_days + 1):
+        whens.append((Client.debt_due_date < today_start + timedelta(days=day + 1), literal(day)))
+    return case(*whens, else_=None)
+
+
+async def _eligible_clients(today, reminder_days: int):
+    """Bugun eslatma olishi kerak bo'lgan mijozlarni bo'laklab qaytaradi (keyset pagination)"""
+    today_start = datetime.combine(today, datetime.min.time())
+    horizon = today_start + timedelta(days=reminder_days + 1)
+    days_left = _days_left_expr(today_start, reminder_days).label("days_left")
+    last_id = 0
+    while True:
+        async with SessionLocal() as db:
+            already = exists().where(
+                DebtReminder.client_id == Client.id,
+                DebtReminder.reminder_date == today
+            )
+            res = await db.execute(
+                select(Client.id, Client.name, Client.telegram_id, Client.balance, days_left)
+                .where(
+                    Client.debt_due_date.isnot(None),
+                    Client.debt_due_date < horizon,
+                    Client.telegram_id.isnot(None),
+                    Client.balance < 0,
+                    Client.id > last_id,
+                    ~already
+                )
+                .order_by(Client.id)
+                .limit(DEBT_REMINDER_CHUNK)
+            )
+            rows = res.all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+async def _record(rows: list):
+    if not rows:
+        return
+    async with SessionLocal() as db:
+        await db.execute(insert(DebtReminder), rows)
+        await db.commit()
+
+
+async def send_debt_reminders(bot) -> dict:
+    """Qarz eslatmalarini yuboradi. Bugun eslatma olgan mijozlar qayta ishga tushirilganda o'tkazib yuboriladi"""
+    settings = await settings_provider.load()
+    reminder_days = max(settings.debt_reminder_days, 0)
+    today = datetime.now().date()
+    semaphore = asyncio.Semaphore(DEBT_REMINDER_CONCURRENCY)
+    counts = {"sent": 0, "blocked": 0, "failed": 0}
+    started = time.monotonic()
+
+    async def deliver(row):
+        async with semaphore:
+            text = reminder_text(row.name, abs(row.balance), row.days_left)
+            try:
+                status, error = await telegram_sender.send(row.telegram_id, lambda: bot.send_message(row.telegram_id, text))
+            except Exception as e:
+                status, error = "failed", str(e)[:255]
+        counts[status] += 1
+        if status == "failed":
+            print(f"Xabar yuborishda xatolik ({row.name}): {error}")
+            # Yozilmaydi - keyingi ishga tushirishda qayta uriniladi
+            return None
+        return {
+            "client_id": row.id,
+            "reminder_date": today,
+            "days_left": row.days_left,
+            "status": status,
+            "created_at": datetime.now(timezone.utc)
+        }
+
+    async for chunk in _eligible_clients(today, reminder_days):
+        results = await asyncio.gather(*(deliver(row) for row in chunk))
+        await _record([r for r in results if r])
+
+    total = sum(counts.values())
+    if total:
+        print(f"🔔 Qarz eslatmalari: {counts['sent']} yuborildi, {counts['blocked']} bloklangan, {counts['failed']} xatolik ({time.monotonic() - started:.0f}s)")
+    return counts
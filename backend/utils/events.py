@@ -0,0 +1,193 @@
+import os
+import asyncio
+import itertools
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+from utils.fast_json import dumps
+
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))  # Har bir ulanish uchun navbat (to'lsa - resync)
+EVENT_KEEPALIVE_SECONDS = int(os.getenv("EVENT_KEEPALIVE_SECONDS", "15"))
+EVENT_AUTH_RECHECK_SECONDS = int(os.getenv("EVENT_AUTH_RECHECK_SECONDS", "60"))  # Xodim bloklanganini shu oraliqda tekshirish
+
+# Faqat admin ko'radigan maydonlar (/finance/stats dagi kabi tannarx va foyda menejer/kassirdan yashiriladi)
+PRIVATE_FIELDS = ("cost",)
+
+
+def _frame(event_id: int, event_type: str, data: dict) -> bytes:
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (event_id, event_type.encode(), dumps(data))
+
+
+class Event:
+    """Bitta hodisa: JSON bir marta yig'iladi va barcha ulanishlarga bir xil bayt bo'lib ketadi"""
+
+    __slots__ = ("id", "type", "actor_id", "actor_role", "full", "public")
+
+    def __init__(self, event_id: int, event_type: str, data: dict, actor_id: Optional[int], actor_role: Optional[str]):
+        self.id = event_id
+        self.type = event_type
+        self.actor_id = actor_id
+        self.actor_role = actor_role
+        self.full = _frame(event_id, event_type, data)
+        public = {k: v for k, v in data.items() if k not in PRIVATE_FIELDS}
+        self.public = self.full if len(public) == len(data) else _frame(event_id, event_type, public)
+
+    def frame_for(self, user_id: int, role: str) -> Optional[bytes]:
+        """Ruxsat: /finance/stats bilan bir xil - kassir faqat o'zinikini, menejer admin amallarisiz"""
+        if self.actor_id is None:
+            return self.public
+        if role == "admin":
+            return self.full
+        if role == "manager":
+            return None if self.actor_role == "admin" else self.public
+        return self.public if self.actor_id == user_id else None
+
+
+class Subscriber:
+    def __init__(self, user_id: int, role: str, queue_size: int):
+        self.user_id = user_id
+        self.role = role
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.lagging = False
+
+    def offer(self, event: Event) -> bool:
+        frame = event.frame_for(self.user_id, self.role)
+        if frame is None or self.lagging:
+            return True
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            # Sekin mijoz: navbatni tashlab, "resync" yuboramiz - dashboard to'liq qayta yuklaydi
+            self.lagging = True
+            return False
+
+
+class EventBus:
+    """Jarayon ichidagi hodisalar shinasi (SSE dashboardlar uchun).
+
+    Diqqat: har bir uvicorn worker o'z shinasiga ega - bir nechta worker bo'lsa,
+    dashboard faqat o'zi ulangan workerdagi hodisalarni oladi.
+    """
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, event_type: str, data: dict, actor_id: Optional[int] = None, actor_role: Optional[str] = None) -> Optional[Event]:
+        """Commitdan KEYIN chaqiriladi. Obunachi bo'lmasa - hech narsa qilinmaydi"""
+        if not self._subscribers:
+            return None
+        event = Event(next(self._ids), event_type, data, actor_id, actor_role)
+        self.published += 1
+        for sub in list(self._subscribers):
+            if not sub.offer(event):
+                self.dropped += 1
+        return event
+
+    def subscribe(self, user_id: int, role: str) -> Subscriber:
+        sub = Subscriber(user_id, role, self.queue_size)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        self._subscribers.discard(sub)
+
+    async def stream(self, user_id: int, role: str, expires_at: Optional[float] = None,
+                     still_allowed: Optional[Callable[[], Awaitable[bool]]] = None,
+                     keepalive: int = EVENT_KEEPALIVE_SECONDS, recheck: int = EVENT_AUTH_RECHECK_SECONDS):
+        """SSE oqimi: hodisalar, har keepalive soniyada ping, navbat to'lsa - resync.
+
+        expires_at (unix vaqt) - access token muddati: shu vaqtda "expired" yuborilib oqim yopiladi.
+        still_allowed - har recheck soniyada chaqiriladi, False bo'lsa (xodim bloklangan) oqim yopiladi.
+        """
+        sub = self.subscribe(user_id, role)
+        next_check = time.monotonic() + recheck
+        try:
+            yield b"retry: 3000\nevent: ready\ndata: {}\n\n"
+            while True:
+                if expires_at is not None and time.time() >= expires_at:
+                    yield b"event: expired\ndata: {}\n\n"
+                    return
+                if still_allowed is not None and time.monotonic() >= next_check:
+                    if not await still_allowed():
+                        yield b"event: expired\ndata: {}\n\n"
+                        return
+                    next_check = time.monotonic() + recheck
+                if sub.lagging:
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()
+                    sub.lagging = False
+                    yield b"event: resync\ndata: {}\n\n"
+                    continue
+                timeout = keepalive
+                if expires_at is not None:
+                    timeout = max(min(timeout, expires_at - time.time()), 0)
+                try:
+                    frame = await asyncio.wait_for(sub.queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                yield frame
+        finally:
+            self.unsubscribe(sub)
+
+    def stats(self) -> dict:
+        return {"subscribers": len(self._subscribers), "published": self.published, "dropped": self.dropped}
+
+
+event_bus = EventBus()
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Bazadan o'qilgan vaqt naive UTC, sessiyadagisi esa aware - hodisada har doim aniq UTC (...Z) bo'lsin"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def sale_event(sale, sign: int = 1) -> dict:
+    """Savdo (sign=1) yoki qaytarish (sign=-1) deltasi. sale.items[].product yuklangan bo'lishi kerak.
+
+    shift_* maydonlari /pos/shifts/active dagi total_cash/total_card/total_debt ga mos.
+    """
+    cost = sum(item.quantity * item.product.buy_price for item in sale.items if item.product)
+    return {
+        "sale_id": sale.id,
+        "cashier_id": sale.cashier_id,
+        "shift_id": sale.shift_id,
+        "client_id": sale.client_id,
+        "created_at": _utc(sale.created_at),
+        "payment_method": sale.payment_method,
+        "sales": sign * sale.total_amount,
+        "cost": sign * cost,
+        "shift_cash": sign * (sale.cash_amount or 0),
+        "shift_card": sign * ((sale.card_amount or 0) + (sale.transfer_amount or 0)),
+        "shift_debt": sign * (sale.debt_amount or 0),
+        "items": sign * len(sale.items),
+    }
+
+
+def refund_event(sale, portion: dict, cost: float, shift_id: Optional[int]) -> dict:
+    """Qisman yoki to'liq qaytarish deltasi (portion - shu qaytarishga tushgan summalar, shift_id - qaytarish yozilgan smena)"""
+    return {
+        "sale_id": sale.id,
+        "cashier_id": sale.cashier_id,
+        "shift_id": shift_id,
+        "client_id": sale.client_id,
+        "created_at": _utc(sale.created_at),
+        "payment_method": sale.payment_method,
+        "status": sale.status,
+        "sales": -portion["amount"],
+        "cost": -cost,
+        "shift_cash": -portion["cash_amount"],
+        "shift_card": -(portion["card_amount"] + portion["transfer_amount"]),
+        "shift_debt": -portion["debt_amount"],
+        "items": -len(sale.items) if sale.status == "refunded" else 0,
+    }
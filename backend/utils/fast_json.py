@@ -0,0 +1,71 @@
+from datetime import date, datetime, timezone
+from decimal import Decimal
+import json
+from typing import Any, Iterable, Optional, Sequence
+
+from fastapi import Response
+
+try:
+    import orjson  # ixtiyoriy bog'liqlik (pip install orjson)
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is not None and value.utcoffset() == timezone.utc.utcoffset(None):
+            return value.replace(tzinfo=None).isoformat() + "Z"  # pydantic bilan bir xil
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"JSON ga aylantirib bo'lmaydi: {type(value).__name__}")
+
+
+def dumps(data: Any) -> bytes:
+    """orjson bo'lsa - u orqali, bo'lmasa standart json (sekinroq, lekin natija bir xil)"""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_UTC_Z)
+    return json.dumps(data, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(data: Any, headers: Optional[dict] = None) -> Response:
+    body = data if isinstance(data, bytes) else dumps(data)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+class Projection:
+    """Pydantic sxemasidagi ustunlarni to'g'ridan-to'g'ri SELECT qilish (ORM obyektlarisiz).
+
+    columns - select() ga beriladigan ustunlar (sxema tartibida),
+    build(row, offset) - natija qatorini sxema bilan bir xil tartibli dict ga aylantiradi.
+    nested - jadvalda yo'q, keyin qo'shiladigan maydonlar (masalan: product, items).
+    """
+
+    def __init__(self, model, schema, entity=None, nested: Sequence[str] = ()):
+        entity = entity if entity is not None else model
+        table_cols = model.__table__.c
+        self.plan = []
+        self.columns = []
+        for name in schema.model_fields:
+            if name in nested:
+                self.plan.append((name, None))
+            elif name in table_cols:
+                self.plan.append((name, len(self.columns)))
+                self.columns.append(getattr(entity, name))
+        self.width = len(self.columns)
+        self.names = [name for name, idx in self.plan if idx is not None]
+        self.id_index = dict(self.plan).get("id")
+
+    def build(self, row: Sequence, offset: int = 0, **nested) -> dict:
+        return {name: (nested.get(name) if idx is None else row[offset + idx]) for name, idx in self.plan}
+
+    def build_optional(self, row: Sequence, offset: int = 0) -> Optional[dict]:
+        """LEFT JOIN natijasi: birlamchi kalit NULL bo'lsa - None"""
+        if row[offset + self.id_index] is None:
+            return None
+        return self.build(row, offset)
+
+    def build_all(self, rows: Iterable[Sequence]) -> list:
+        return [self.build(row) for row in rows]
@@ -0,0 +1,159 @@
+import os
+import json
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from sqlalchemy import delete, insert
+
+from database import SessionLocal, FsmState
+
+FSM_STATE_TTL_HOURS = int(os.getenv("FSM_STATE_TTL_HOURS", "24"))  # Shuncha vaqt tegilmagan holat eskirgan hisoblanadi
+FSM_FLUSH_DELAY = float(os.getenv("FSM_FLUSH_DELAY", "0.5"))  # Shu oraliqdagi yozuvlar bitta tranzaksiyada saqlanadi
+FSM_RETRY_MAX_DELAY = 30.0  # Baza ishlamay qolsa qayta urinishlar orasidagi eng katta pauza (soniya)
+FSM_CACHE_SECONDS = 300  # Xotiradagi nusxa shuncha vaqtdan keyin bazadan qayta o'qiladi
+
+
+class _Record:
+    __slots__ = ("state", "data", "touched_at", "loaded_at")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[dict] = None, touched_at: Optional[datetime] = None):
+        self.state = state
+        self.data = data or {}
+        self.touched_at = touched_at or datetime.now(timezone.utc).replace(tzinfo=None)
+        self.loaded_at = time.monotonic()
+
+
+class DatabaseStorage(BaseStorage):
+    """Bazada saqlanadigan FSM storage (SQLite/Postgres).
+
+    O'qish xotiradagi keshdan; yozuvlar keshga tushadi va FSM_FLUSH_DELAY dan keyin
+    bitta tranzaksiyada bazaga yoziladi. FSM_STATE_TTL_HOURS dan eski holatlar tozalanadi.
+    """
+
+    def __init__(self, ttl_hours: int = FSM_STATE_TTL_HOURS, flush_delay: float = FSM_FLUSH_DELAY):
+        self.ttl = timedelta(hours=ttl_hours)
+        self.flush_delay = flush_delay
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache: Dict[str, _Record] = {}
+        self._dirty = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    def _expired(self, record: _Record) -> bool:
+        return record.touched_at < datetime.now(timezone.utc).replace(tzinfo=None) - self.ttl
+
+    async def _record(self, key: StorageKey) -> _Record:
+        k = self.key_builder.build(key)
+        record = self._cache.get(k)
+        if record is not None and (k in self._dirty or time.monotonic() - record.loaded_at < FSM_CACHE_SECONDS):
+            if not self._expired(record):
+                return record
+            record = None
+
+        async with SessionLocal() as db:
+            row = await db.get(FsmState, k)
+        if row is not None:
+            record = _Record(row.state, json.loads(row.data) if row.data else {}, row.updated_at)
+            if self._expired(record):
+                record = _Record()
+        else:
+            record = _Record()
+        self._cache[k] = record
+        return record
+
+    def _touch(self, key: StorageKey, record: _Record):
+        record.touched_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        k = self.key_builder.build(key)
+        self._cache[k] = record
+        self._dirty.add(k)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        # Yozish paytida tegilgan yoki xato sababli qaytarilgan kalitlar ham saqlanmaguncha aylanadi
+        delay = self.flush_delay
+        while True:
+            await asyncio.sleep(delay)
+            ok = await self.flush()
+            if not self._dirty:
+                return
+            delay = self.flush_delay if ok else min(max(delay, self.flush_delay) * 2, FSM_RETRY_MAX_DELAY)
+
+    async def flush(self) -> bool:
+        """Yig'ilgan o'zgarishlarni bazaga yozadi (bo'sh holatlar o'chiriladi). Xato bo'lsa False"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return True
+            keys = list(self._dirty)
+            self._dirty.clear()
+            rows = []
+            for k in keys:
+                record = self._cache.get(k)
+                if record is not None and (record.state is not None or record.data):
+                    rows.append({
+                        "key": k,
+                        "state": record.state,
+                        "data": json.dumps(record.data, ensure_ascii=False),
+                        "updated_at": record.touched_at
+                    })
+            try:
+                async with SessionLocal() as db:
+                    await db.execute(delete(FsmState).where(FsmState.key.in_(keys)))
+                    if rows:
+                        await db.execute(insert(FsmState), rows)
+                    await db.commit()
+            except asyncio.CancelledError:
+                self._dirty.update(keys)
+                raise
+            except Exception as e:
+                # Keyingi urinishda qayta yoziladi
+                self._dirty.update(keys)
+                print(f"❌ FSM holatlarini saqlashda xatolik: {e}")
+                return False
+            return True
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        record = await self._record(key)
+        record.data = data.copy()
+        self._touch(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._record(key)).data.copy()
+
+    async def purge_expired(self):
+        """Eskirgan holatlarni bazadan va xotiradan tozalash"""
+        try:
+            cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - self.ttl
+            for k in [k for k, r in self._cache.items() if k not in self._dirty and (r.touched_at < cutoff or time.monotonic() - r.loaded_at >= FSM_CACHE_SECONDS)]:
+                self._cache.pop(k, None)
+            async with SessionLocal() as db:
+                result = await db.execute(delete(FsmState).where(FsmState.updated_at < cutoff))
+                await db.commit()
+                if result.rowcount:
+                    print(f"🧹 {result.rowcount} ta eskirgan FSM holati tozalandi.")
+        except Exception as e:
+            print(f"❌ FSM holatlarini tozalashda xatolik: {e}")
+
+    async def close(self) -> None:
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
@@ -0,0 +1,112 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import select, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal, IdempotencyKey
+
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+MAX_KEY_LENGTH = 64
+
+
+def _cutoff() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+
+
+async def request_fingerprint(request: Request) -> str:
+    """sha256(method, path, body). JSON body kalitlar tartibi va bo'shliqlardan qat'i nazar bir xil xeshlanadi"""
+    body = await request.body()  # Starlette body ni keshlaydi - endpoint allaqachon o'qigan bo'lsa ham ishlaydi
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode() if body else b""
+    except ValueError:
+        pass
+    digest = hashlib.sha256(f"{request.method} {request.url.path}\n".encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def _replay(record: IdempotencyKey, fingerprint: Optional[str]) -> Response:
+    if fingerprint and record.request_hash and record.request_hash != fingerprint:
+        # Kalit boshqa so'rov (boshqa chek, summa yoki mijoz) bilan qayta ishlatilgan - birinchi javobni qaytarmaymiz
+        raise HTTPException(status_code=422, detail="Idempotency-Key boshqa so'rov uchun ishlatilgan")
+    if record.response_body is None:
+        raise HTTPException(status_code=409, detail="So'rov hali bajarilmoqda. Birozdan so'ng qayta urinib ko'ring")
+    return Response(
+        content=record.response_body,
+        status_code=record.status_code or 200,
+        media_type="application/json",
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+
+async def begin_idempotent(db: AsyncSession, scope: str, user_id: int, key: Optional[str], request: Optional[Request] = None):
+    """Idempotency-Key bilan kelgan so'rovni tekshiradi.
+
+    Qaytaradi: (replay_response, record). Agar kalit avval ishlatilgan bo'lsa -
+    saqlangan javob qaytariladi; aks holda joriy tranzaksiyada yangi yozuv band qilinadi.
+    request berilsa - kalit method, path va body xeshiga bog'lanadi: boshqa so'rov bilan kelsa 422.
+    """
+    if not key:
+        return None, None
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key {MAX_KEY_LENGTH} belgidan oshmasligi kerak")
+    fingerprint = await request_fingerprint(request) if request is not None else None
+
+    existing = await db.scalar(
+        select(IdempotencyKey).where(
+            IdempotencyKey.scope == scope,
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == key
+        )
+    )
+    if existing is not None:
+        if existing.created_at >= _cutoff():
+            return _replay(existing, fingerprint), None
+        # Muddati o'tgan kalitni qayta ishlatishga ruxsat beramiz
+        await db.delete(existing)
+        await db.flush()
+
+    record = IdempotencyKey(scope=scope, user_id=user_id, key=key, request_hash=fingerprint)
+    db.add(record)
+    try:
+        # Parallel takroriy so'rov shu yerda unique cheklovga uriladi
+        await db.flush()
+    except IntegrityError:
+        await db.rollback()
+        existing = await db.scalar(
+            select(IdempotencyKey).where(
+                IdempotencyKey.scope == scope,
+                IdempotencyKey.user_id == user_id,
+                IdempotencyKey.key == key
+            )
+        )
+        if existing is None:
+            raise HTTPException(status_code=409, detail="So'rov hali bajarilmoqda. Birozdan so'ng qayta urinib ko'ring")
+        return _replay(existing, fingerprint), None
+    return None, record
+
+
+def finish_idempotent(record: Optional[IdempotencyKey], body: str, status_code: int = 200):
+    """Javobni kalit yozuviga biriktiradi (asosiy amal bilan bitta commitda saqlanadi)"""
+    if record is None:
+        return
+    record.response_body = body
+    record.status_code = status_code
+
+
+async def purge_expired_keys():
+    """Muddati o'tgan idempotency kalitlarini o'chirish"""
+    try:
+        async with SessionLocal() as db:
+            result = await db.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < _cutoff()))
+            await db.commit()
+            if result.rowcount:
+                print(f"🧹 {result.rowcount} ta eskirgan idempotency kaliti tozalandi.")
+    except Exception as e:
+        print(f"❌ Idempotency kalitlarini tozalashda xatolik: {e}")
@@ -0,0 +1,180 @@
+import os
+import time
+import logging
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger("kassa.metrics")
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+SLOW_LOG_MAX_STATEMENTS = 20  # Sekin so'rov logida ko'rsatiladigan SQL soni
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class RequestStats:
+    __slots__ = ("sql_count", "sql_time", "statements")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.statements = []  # (soniya, SQL) - faqat sekin so'rov logi uchun
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # oxirgisi +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.requests = {}  # (method, route, status) -> soni
+        self.latency = {}  # (method, route) -> Histogram
+        self.sql_per_request = {}  # (method, route) -> Histogram
+        self.slow_requests = 0
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        key = (method, route)
+        self.requests[(method, route, status)] = self.requests.get((method, route, status), 0) + 1
+        self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+        self.sql_per_request.setdefault(key, Histogram(SQL_COUNT_BUCKETS)).observe(stats.sql_count)
+
+    def render(self, extra_gauges: dict = None) -> str:
+        """Prometheus text format"""
+        lines = [
+            "# HELP kassa_http_requests_total HTTP so'rovlar soni",
+            "# TYPE kassa_http_requests_total counter",
+        ]
+        for (method, route, status), value in sorted(self.requests.items()):
+            lines.append(f'kassa_http_requests_total{{method="{method}",route="{_esc(route)}",status="{status}"}} {value}')
+
+        lines += _render_histogram(
+            "kassa_http_request_duration_seconds", "So'rov davomiyligi (soniya)", self.latency
+        )
+        lines += _render_histogram(
+            "kassa_http_request_sql_statements", "Bitta so'rovdagi SQL buyruqlar soni", self.sql_per_request
+        )
+        lines += [
+            "# HELP kassa_http_slow_requests_total SLOW_REQUEST_MS dan sekin so'rovlar",
+            "# TYPE kassa_http_slow_requests_total counter",
+            f"kassa_http_slow_requests_total {self.slow_requests}",
+        ]
+        for name, (help_text, value) in (extra_gauges or {}).items():
+            kind = "counter" if name.endswith("_total") else "gauge"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def _esc(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _render_histogram(name: str, help_text: str, histograms: dict) -> list:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for (method, route), h in sorted(histograms.items()):
+        labels = f'method="{method}",route="{_esc(route)}"'
+        cumulative = 0
+        for bound, count in zip(h.buckets, h.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {h.count}')
+        lines.append(f"{name}_sum{{{labels}}} {h.total:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {h.count}")
+    return lines
+
+
+metrics_registry = MetricsRegistry()
+
+
+def install_sql_hooks(*engines):
+    """Har bir SQL buyruqni joriy so'rov statistikasiga yozadi (N+1 larni aniqlash uchun)"""
+    for eng in set(engines):
+        sync_engine = eng.sync_engine
+
+        @event.listens_for(sync_engine, "before_cursor_execute")
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            if context is not None:
+                context._metrics_started = time.perf_counter()
+
+        @event.listens_for(sync_engine, "after_cursor_execute")
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            stats = _current.get()
+            started = getattr(context, "_metrics_started", None)
+            if stats is None or started is None:
+                return
+            elapsed = time.perf_counter() - started
+            stats.sql_count += 1
+            stats.sql_time += elapsed
+            if len(stats.statements) < SLOW_LOG_MAX_STATEMENTS:
+                stats.statements.append((elapsed, statement))
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: route bo'yicha latency, SQL soni va sekin so'rovlar logi"""
+
+    def __init__(self, app, registry: MetricsRegistry = metrics_registry, slow_ms: float = SLOW_REQUEST_MS):
+        self.app = app
+        self.registry = registry
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        status_code = 500
+        event_stream = False
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code, event_stream
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                event_stream = any(k == b"content-type" and v.startswith(b"text/event-stream") for k, v in message["headers"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            # SSE ulanishi daqiqalab ochiq turadi - latency va sekin so'rovlar statistikasini buzmasligi uchun hisoblanmaydi
+            if not event_stream:
+                self._record(scope, status_code, elapsed, stats)
+
+    def _record(self, scope, status_code: int, elapsed: float, stats: RequestStats):
+        # Route shabloni (/sales/{sale_id}) - aniq URL emas, aks holda metrikalar soni cheksiz o'sadi
+        route = getattr(scope.get("route"), "path", None) or "unmatched"
+        method = scope["method"]
+        self.registry.observe(method, route, status_code, elapsed, stats)
+
+        if elapsed * 1000 >= self.slow_ms:
+            self.registry.slow_requests += 1
+            sql_lines = "\n".join(
+                f"  [{seconds * 1000:.1f} ms] {' '.join(statement.split())[:300]}"
+                for seconds, statement in stats.statements
+            )
+            more = stats.sql_count - len(stats.statements)
+            logger.warning(
+                f"Sekin so'rov: {method} {scope['path']} ({route}) - {elapsed * 1000:.0f} ms, "
+                f"status {status_code}, SQL: {stats.sql_count} ta / {stats.sql_time * 1000:.0f} ms"
+                + (f"\n{sql_lines}" if sql_lines else "")
+                + (f"\n  ... yana {more} ta" if more > 0 else "")
+            )
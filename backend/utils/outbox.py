@@ -0,0 +1,143 @@
+import os
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update, delete, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal, OutboxMessage
+from utils.telegram import telegram_sender
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "120"))  # Worker yiqilsa, "sending" xabarlar shu vaqtdan keyin qayta olinadi
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def enqueue_message(db: AsyncSession, chat_id: int, text: str, parse_mode: str = "HTML") -> OutboxMessage:
+    """Xabarni navbatga qo'shadi. Asosiy amal bilan bitta commitda saqlanadi (commit chaqiruvchida)"""
+    msg = OutboxMessage(chat_id=chat_id, text=text, parse_mode=parse_mode, status="pending", next_attempt_at=_now())
+    db.add(msg)
+    return msg
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    # 30s, 1m, 2m, 4m ... ko'pi bilan 1 soat
+    return timedelta(seconds=min(30 * 2 ** (attempts - 1), 3600))
+
+
+def _lease_seconds(batch_size: int) -> float:
+    """Band qilish muddati partiyaning eng yomon vaqtidan uzun bo'lishi kerak: hamma xabar bitta chatga
+    (1 xabar/soniya) va har biri barcha urinishlarni tarmoq xatosi kutishlari bilan ishlatsa"""
+    per_message = telegram_sender.max_attempts * telegram_sender.per_chat.interval + (2 ** telegram_sender.max_attempts - 1)
+    return OUTBOX_LEASE_SECONDS + batch_size * per_message
+
+
+async def _claim(batch_size: int):
+    """Yuborilishi kerak bo'lgan xabarlarni band qiladi (bir nechta worker bir xabarni olmaydi).
+    Qaytaradi: (claim_token, qatorlar)"""
+    token = uuid.uuid4().hex
+    now = _now()
+    due = or_(OutboxMessage.status == "pending", OutboxMessage.status == "sending")
+    async with SessionLocal() as db:
+        candidates = (
+            select(OutboxMessage.id)
+            .where(due, OutboxMessage.next_attempt_at <= now)
+            .order_by(OutboxMessage.id)
+            .limit(batch_size)
+        )
+        await db.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(candidates), due, OutboxMessage.next_attempt_at <= now)
+            .values(status="sending", claim_token=token, next_attempt_at=now + timedelta(seconds=_lease_seconds(batch_size)))
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        res = await db.execute(
+            select(OutboxMessage.id, OutboxMessage.chat_id, OutboxMessage.text, OutboxMessage.parse_mode, OutboxMessage.attempts)
+            .where(OutboxMessage.claim_token == token, OutboxMessage.status == "sending")
+            .order_by(OutboxMessage.id)
+        )
+        return token, res.all()
+
+
+async def drain_outbox(bot, batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    """Bitta partiyani yuboradi. Qaytaradi: olingan xabarlar soni"""
+    token, rows = await _claim(batch_size)
+    if not rows:
+        return 0
+
+    async def deliver(row):
+        try:
+            status, error = await telegram_sender.send(
+                row.chat_id, lambda: bot.send_message(row.chat_id, row.text, parse_mode=row.parse_mode)
+            )
+        except Exception as e:
+            status, error = "failed", str(e)[:255]
+
+        attempts = row.attempts + 1
+        values = {"status": status, "attempts": attempts, "last_error": error, "claim_token": None}
+        if status == "sent":
+            values["sent_at"] = _now()
+        elif status == "failed" and attempts < OUTBOX_MAX_ATTEMPTS:
+            # Keyinroq qayta urinamiz
+            values["status"] = "pending"
+            values["next_attempt_at"] = _now() + _retry_delay(attempts)
+        return values
+
+    results = await asyncio.gather(*(deliver(row) for row in rows))
+    lost = 0
+    async with SessionLocal() as db:
+        for row, values in zip(rows, results):
+            # Faqat hali shu workerda turgan qator yoziladi: muddat o'tib boshqa worker olgan bo'lsa, uning natijasini buzmaymiz
+            result = await db.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id == row.id, OutboxMessage.claim_token == token)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            lost += result.rowcount == 0
+        await db.commit()
+
+    failed = [r for r in results if r["status"] == "failed"]
+    if failed:
+        print(f"❌ Outbox: {len(failed)} ta xabar yuborilmadi ({failed[0]['last_error']})")
+    if lost:
+        print(f"⚠️ Outbox: {lost} ta xabar band qilish muddati o'tib boshqa workerga o'tgan - natijasi yozilmadi")
+    return len(rows)
+
+
+async def run_outbox_worker(bot):
+    """Navbatni doimiy bo'shatib turadi (bot worker yoki API ichida fon vazifasi sifatida)"""
+    print("📤 Outbox worker ishga tushdi.")
+    while True:
+        try:
+            processed = await drain_outbox(bot)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Outbox xatolik: {e}")
+            processed = 0
+        if processed < OUTBOX_BATCH_SIZE:
+            await asyncio.sleep(OUTBOX_POLL_SECONDS)
+
+
+async def purge_outbox():
+    """Yuborilgan eski xabarlarni o'chirish"""
+    try:
+        cutoff = _now() - timedelta(days=OUTBOX_RETENTION_DAYS)
+        async with SessionLocal() as db:
+            result = await db.execute(
+                delete(OutboxMessage).where(OutboxMessage.status.in_(["sent", "blocked", "failed"]), OutboxMessage.created_at < cutoff)
+            )
+            await db.commit()
+            if result.rowcount:
+                print(f"🧹 {result.rowcount} ta eski outbox xabari tozalandi.")
+    except Exception as e:
+        print(f"❌ Outbox tozalashda xatolik: {e}")
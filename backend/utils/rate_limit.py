@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Oddiy token-bucket: soniyasiga `rate` ta, bir vaqtda ko'pi bilan `capacity` ta"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Telegram retry_after qaytarganda barcha yuboruvchilarni to'xtatish"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self, tokens: float = 1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class PerChatLimiter:
+    """Bitta chatga xabarlar orasida kamida `interval` soniya bo'lishini ta'minlaydi"""
+
+    def __init__(self, interval: float = 1.0, max_tracked: int = 10000):
+        self.interval = interval
+        self.max_tracked = max_tracked
+        self._last_sent = {}
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        next_allowed = self._last_sent.get(chat_id, 0.0) + self.interval
+        if next_allowed > now:
+            await asyncio.sleep(next_allowed - now)
+            now = time.monotonic()
+        self._last_sent[chat_id] = now
+
+        if len(self._last_sent) > self.max_tracked:
+            cutoff = now - self.interval
+            self._last_sent = {k: v for k, v in self._last_sent.items() if v > cutoff}
@@ -0,0 +1,108 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import select, func, delete, insert
+
+from database import SessionLocal, Product, Sale, SaleItem, ReorderSuggestion
+
+# Sozlamalar (env orqali o'zgartirish mumkin)
+REORDER_LOOKBACK_DAYS = int(os.getenv("REORDER_LOOKBACK_DAYS", "90"))  # Necha kunlik sotuv tahlil qilinadi
+REORDER_HALF_LIFE_DAYS = float(os.getenv("REORDER_HALF_LIFE_DAYS", "14"))  # Eski kunlarning og'irligi ikki barobar kamayadigan muddat
+REORDER_LEAD_TIME_DAYS = float(os.getenv("REORDER_LEAD_TIME_DAYS", "3"))  # Firma mahsulotni necha kunda yetkazadi
+REORDER_COVER_DAYS = float(os.getenv("REORDER_COVER_DAYS", "14"))  # Buyurtma qancha kunga yetishi kerak
+
+INSERT_CHUNK = 5000
+
+
+def ew_velocity(product_idx, day_idx, quantities, n_products, n_days, half_life):
+    """Har bir mahsulot uchun eksponensial og'irlikdagi kunlik sotuv tezligi.
+
+    Sotuv bo'lmagan kunlar 0 sifatida hisobga olinadi, oxirgi kunlar ko'proq og'irlikka ega.
+    """
+    matrix = np.zeros((n_products, n_days))
+    np.add.at(matrix, (product_idx, day_idx), quantities)
+    ages = np.arange(n_days - 1, -1, -1, dtype=float)  # day_idx 0 = eng eski kun
+    weights = np.power(0.5, ages / half_life)
+    return matrix @ weights / weights.sum()
+
+
+async def refresh_reorder_suggestions():
+    """reorder_suggestions jadvalini sotuv tezligi asosida qayta hisoblaydi"""
+    now = datetime.now(timezone.utc)
+    today = now.date()
+    start_day = today - timedelta(days=REORDER_LOOKBACK_DAYS - 1)
+    since = datetime.combine(start_day, datetime.min.time())
+
+    try:
+        async with SessionLocal() as db:
+            prod_res = await db.execute(
+                select(Product.id, Product.stock, Product.supplier_id).order_by(Product.id)
+            )
+            products = prod_res.all()
+            if not products:
+                return 0
+
+            product_ids = np.array([p.id for p in products], dtype=np.int64)
+            stock = np.array([p.stock or 0 for p in products], dtype=float)
+
+            # Bitta guruhlangan so'rov: mahsulot x kun bo'yicha sotilgan miqdor
+            day_col = func.date(Sale.created_at)
+            sales_res = await db.execute(
+                select(SaleItem.product_id, day_col, func.sum(SaleItem.quantity - func.coalesce(SaleItem.refunded_quantity, 0)))
+                .join(Sale, SaleItem.sale_id == Sale.id)
+                .where(Sale.status == "completed", Sale.created_at >= since)
+                .group_by(SaleItem.product_id, day_col)
+            )
+            rows = sales_res.all()
+
+            velocity = np.zeros(len(products))
+            if rows:
+                row_products = np.array([r[0] for r in rows], dtype=np.int64)
+                row_days = np.array([str(r[1])[:10] for r in rows], dtype="datetime64[D]")
+                row_qty = np.array([r[2] or 0 for r in rows], dtype=float)
+
+                day_idx = (row_days - np.datetime64(start_day, "D")).astype(np.int64)
+                product_idx = np.searchsorted(product_ids, row_products)
+                product_idx = np.clip(product_idx, 0, len(product_ids) - 1)
+                # O'chirilgan mahsulotlar va oraliqdan tashqaridagi kunlarni tashlab yuboramiz
+                mask = (
+                    (product_ids[product_idx] == row_products)
+                    & (day_idx >= 0)
+                    & (day_idx < REORDER_LOOKBACK_DAYS)
+                )
+                velocity = ew_velocity(
+                    product_idx[mask], day_idx[mask], row_qty[mask],
+                    len(products), REORDER_LOOKBACK_DAYS, REORDER_HALF_LIFE_DAYS
+                )
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                days_of_cover = np.where(velocity > 0, np.maximum(stock, 0) / velocity, np.nan)
+            target = velocity * (REORDER_LEAD_TIME_DAYS + REORDER_COVER_DAYS)
+            reorder_qty = np.ceil(np.maximum(target - stock, 0))
+
+            # Faqat harakatdagi yoki tugagan mahsulotlarni saqlaymiz
+            keep = np.nonzero((velocity > 0) | (stock <= 0))[0]
+            rows_out = [
+                {
+                    "product_id": int(product_ids[i]),
+                    "supplier_id": products[i].supplier_id,
+                    "stock": float(stock[i]),
+                    "daily_velocity": float(velocity[i]),
+                    "days_of_cover": None if np.isnan(days_of_cover[i]) else float(days_of_cover[i]),
+                    "reorder_quantity": float(reorder_qty[i]),
+                    "computed_at": now,
+                }
+                for i in keep
+            ]
+
+            await db.execute(delete(ReorderSuggestion))
+            for start in range(0, len(rows_out), INSERT_CHUNK):
+                await db.execute(insert(ReorderSuggestion), rows_out[start:start + INSERT_CHUNK])
+            await db.commit()
+
+        print(f"📦 Buyurtma tavsiyalari yangilandi: {len(rows_out)} ta mahsulot")
+        return len(rows_out)
+    except Exception as e:
+        print(f"❌ Buyurtma tavsiyalarini hisoblashda xatolik: {e}")
+        return None
@@ -0,0 +1,84 @@
+import os
+import time
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal, StoreSetting
+
+# Boshqa worker sozlamani o'zgartirganini necha soniyada bir tekshiramiz
+SETTINGS_VERSION_CHECK_SECONDS = float(os.getenv("SETTINGS_VERSION_CHECK_SECONDS", "5"))
+
+
+class StoreSettingsSnapshot(BaseModel):
+    """Do'kon sozlamalarining o'zgarmas (immutable) nusxasi"""
+    model_config = ConfigDict(frozen=True)
+
+    id: Optional[int] = None
+    name: str = "Mening Do'konim"
+    address: Optional[str] = None
+    phone: Optional[str] = None
+    header_text: Optional[str] = None
+    footer_text: Optional[str] = None
+    logo_url: Optional[str] = None
+    low_stock_threshold: int = 5
+    bonus_percentage: float = 1.0
+    debt_reminder_days: int = 3
+    version: int = 0
+
+    @classmethod
+    def from_row(cls, row: Optional[StoreSetting]) -> "StoreSettingsSnapshot":
+        if row is None:
+            return cls()
+        # NULL qiymatlar uchun default ishlatiladi
+        values = {
+            field: getattr(row, field)
+            for field in cls.model_fields
+            if getattr(row, field, None) is not None
+        }
+        return cls(**values)
+
+
+class SettingsProvider:
+    """StoreSetting qatorini xotirada saqlaydi.
+
+    Har bir workerda alohida nusxa bo'ladi; boshqa worker o'zgartirganini
+    `version` ustuni orqali (SETTINGS_VERSION_CHECK_SECONDS da bir marta) aniqlaydi.
+    """
+
+    def __init__(self):
+        self._snapshot = StoreSettingsSnapshot()
+        self._checked_at = 0.0
+
+    @property
+    def snapshot(self) -> StoreSettingsSnapshot:
+        return self._snapshot
+
+    def set(self, row: Optional[StoreSetting]) -> StoreSettingsSnapshot:
+        # Yangi obyekt yaratib, havolani bir marta almashtiramiz (atomik)
+        self._snapshot = StoreSettingsSnapshot.from_row(row)
+        self._checked_at = time.monotonic()
+        return self._snapshot
+
+    async def load(self, db: Optional[AsyncSession] = None) -> StoreSettingsSnapshot:
+        if db is None:
+            async with SessionLocal() as session:
+                return await self.load(session)
+        result = await db.execute(select(StoreSetting).order_by(StoreSetting.id).limit(1))
+        return self.set(result.scalars().first())
+
+    async def get(self, db: AsyncSession) -> StoreSettingsSnapshot:
+        if time.monotonic() - self._checked_at < SETTINGS_VERSION_CHECK_SECONDS:
+            return self._snapshot
+
+        version = await db.scalar(select(StoreSetting.version).order_by(StoreSetting.id).limit(1))
+        if (version or 0) != self._snapshot.version:
+            return await self.load(db)
+
+        self._checked_at = time.monotonic()
+        return self._snapshot
+
+
+settings_provider = SettingsProvider()
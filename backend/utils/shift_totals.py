@@ -0,0 +1,198 @@
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import select, update, func, case, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Shift, Sale, Payment, RefundItem
+
+# Jamlar orasidagi farq shundan katta bo'lsa - tafovut (float yaxlitlash xatolari hisobga olinmaydi)
+RECONCILE_TOLERANCE = 0.01
+
+TOTAL_FIELDS = (
+    "sales_count", "sales_total", "total_cash", "total_card", "total_debt",
+    "refunds_count", "refunds_total", "debt_collected", "debt_collected_cash",
+)
+
+
+async def open_shift_id(db: AsyncSession, cashier_id: int) -> Optional[int]:
+    return await db.scalar(
+        select(Shift.id).where(Shift.cashier_id == cashier_id, Shift.status == "open").limit(1)
+    )
+
+
+async def shift_id_at(db: AsyncSession, cashier_id: int, at: datetime) -> Optional[int]:
+    """Savdo vaqtida ochiq bo'lgan smena (update_db dagi backfill bilan bir xil qoida:
+    kassir + opened_at <= vaqt <= closed_at). Topilmasa - hozir ochiq smena
+    (backfillda bunday savdo smenasiz qoladi - u sync paytida qaysi smena ochiq bo'lganini bilmaydi).
+    """
+    at = _naive_utc(at)  # smena vaqtlari naive UTC
+    shift_id = await db.scalar(
+        select(Shift.id)
+        .where(
+            Shift.cashier_id == cashier_id,
+            Shift.opened_at <= at,
+            or_(Shift.closed_at.is_(None), Shift.closed_at >= at)
+        )
+        .order_by(Shift.opened_at.desc())
+        .limit(1)
+    )
+    return shift_id or await open_shift_id(db, cashier_id)
+
+
+def _sale_amounts(sale):
+    return (
+        sale.cash_amount or 0,
+        (sale.card_amount or 0) + (sale.transfer_amount or 0),
+        sale.debt_amount or 0,
+    )
+
+
+def _naive_utc(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo is not None else value
+
+
+def _attachable(at: Optional[datetime] = None):
+    """Smenaga yozish sharti: smena ochiq. Yopish avval status ni o'zgartiradi, shuning uchun
+    yopilayotgan smenaga yangi savdo tushmaydi. at - offline savdo vaqti: u o'z vaqtidagi
+    (yopilgan) smenaga ham tushadi (shift_id_at)
+    """
+    if at is None:
+        return Shift.status == "open"
+    at = _naive_utc(at)
+    return or_(Shift.status == "open", and_(Shift.opened_at <= at, Shift.closed_at >= at))
+
+
+async def add_sale(db: AsyncSession, shift_id: Optional[int], sale, at: Optional[datetime] = None) -> Optional[int]:
+    """Savdo smena jamlariga qo'shiladi (UPDATE ... SET x = x + :delta - parallel kassalarda yo'qotishsiz).
+
+    Smena shu orada yopilgan bo'lsa - savdo smenasiz qoladi (sale.shift_id = None). Biriktirilgan smenani qaytaradi.
+    """
+    if not shift_id:
+        return None
+    cash, card, debt = _sale_amounts(sale)
+    attached = await db.scalar(
+        update(Shift)
+        .where(Shift.id == shift_id, _attachable(at))
+        .values(
+            sales_count=Shift.sales_count + 1,
+            sales_total=Shift.sales_total + (sale.total_amount or 0),
+            total_cash=Shift.total_cash + cash,
+            total_card=Shift.total_card + card,
+            total_debt=Shift.total_debt + debt
+        )
+        .returning(Shift.id)
+        .execution_options(synchronize_session=False)
+    )
+    if attached is None:
+        sale.shift_id = None
+    return attached
+
+
+async def add_refund(db: AsyncSession, shift_id: Optional[int], amount: float, cash: float, card: float, debt: float,
+                     new_refund: bool = True) -> Optional[int]:
+    """Qaytarilgan qism qaytargan xodimning ochiq smenasidan ayriladi (pul shu kassadan chiqadi) -
+    yopilgan smena va uning Z-hisoboti o'zgarmaydi.
+
+    refunds_count - shu smenada qaytarilgan savdolar soni (bitta chekdagi bir nechta qisman qaytarish bitta hisoblanadi).
+    Smena shu orada yopilgan bo'lsa - None (qaytarish smenasiz qoladi)
+    """
+    if not shift_id:
+        return None
+    return await db.scalar(
+        update(Shift)
+        .where(Shift.id == shift_id, _attachable())
+        .values(
+            total_cash=Shift.total_cash - cash,
+            total_card=Shift.total_card - card,
+            total_debt=Shift.total_debt - debt,
+            refunds_count=Shift.refunds_count + (1 if new_refund else 0),
+            refunds_total=Shift.refunds_total + amount
+        )
+        .returning(Shift.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def add_debt_payment(db: AsyncSession, shift_id: Optional[int], amount: float, payment_method: str) -> Optional[int]:
+    """Smena shu orada yopilgan bo'lsa - None (to'lov smenasiz qoladi)"""
+    if not shift_id:
+        return None
+    return await db.scalar(
+        update(Shift)
+        .where(Shift.id == shift_id, _attachable())
+        .values(
+            debt_collected=Shift.debt_collected + amount,
+            debt_collected_cash=Shift.debt_collected_cash + (amount if payment_method == "cash" else 0)
+        )
+        .returning(Shift.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def aggregate_totals(db: AsyncSession, shift_id: int) -> dict:
+    """To'liq qayta hisoblash (savdolar va to'lovlar shift_id indeksi orqali) - yopishda tekshirish uchun.
+
+    Sof jamlar = smena savdolari - shu smenada qilingan qaytarishlar (refund_items.shift_id).
+    """
+    sales = (await db.execute(
+        select(
+            func.count(Sale.id),
+            func.coalesce(func.sum(Sale.total_amount), 0),
+            func.coalesce(func.sum(Sale.cash_amount), 0),
+            func.coalesce(func.sum(Sale.card_amount + Sale.transfer_amount), 0),
+            func.coalesce(func.sum(Sale.debt_amount), 0),
+        ).where(Sale.shift_id == shift_id)
+    )).one()
+    refunds = (await db.execute(
+        select(
+            func.coalesce(func.sum(RefundItem.cash_amount), 0),
+            func.coalesce(func.sum(RefundItem.card_amount + RefundItem.transfer_amount), 0),
+            func.coalesce(func.sum(RefundItem.debt_amount), 0),
+            func.count(func.distinct(RefundItem.sale_id)),
+            func.coalesce(func.sum(RefundItem.amount), 0),
+        ).where(RefundItem.shift_id == shift_id)
+    )).one()
+    sales = (sales[0], sales[1], sales[2] - refunds[0], sales[3] - refunds[1], sales[4] - refunds[2], refunds[3], refunds[4])
+    payments = (await db.execute(
+        select(
+            func.coalesce(func.sum(Payment.amount), 0),
+            func.coalesce(func.sum(case((Payment.payment_method == "cash", Payment.amount), else_=0)), 0),
+        ).where(Payment.shift_id == shift_id)
+    )).one()
+    return dict(zip(TOTAL_FIELDS, (*sales, *payments)))
+
+
+async def reconcile(db: AsyncSession, shift: Shift) -> dict:
+    """Joriy jamlarni to'liq agregat bilan solishtiradi. Farq bo'lsa - agregat to'g'ri deb olinadi.
+
+    Smena yopilgandan (status='closed') KEYIN chaqiriladi - aks holda agregat va yozish orasida
+    commit bo'lgan savdoning qo'shgani absolyut qiymat bilan ustidan yozilib ketadi.
+
+    Qaytaradi: {maydon: {"running": x, "actual": y}} (bo'sh - hammasi mos)
+    """
+    actual = await aggregate_totals(db, shift.id)
+    discrepancies = {}
+    for field, value in actual.items():
+        running = getattr(shift, field) or 0
+        if abs(running - value) > RECONCILE_TOLERANCE:
+            discrepancies[field] = {"running": running, "actual": value}
+            setattr(shift, field, value)
+    return discrepancies
+
+
+def z_report(shift: Shift, discrepancies: Optional[dict] = None) -> dict:
+    """Z-hisobot faqat smena ustunlaridan - savdolar soniga bog'liq emas"""
+    expected_cash = (shift.opening_balance or 0) + (shift.total_cash or 0) + (shift.debt_collected_cash or 0)
+    report = {field: getattr(shift, field) or 0 for field in TOTAL_FIELDS}
+    report.update({
+        "shift_id": shift.id,
+        "opening_balance": shift.opening_balance or 0,
+        "net_sales": (shift.total_cash or 0) + (shift.total_card or 0) + (shift.total_debt or 0),
+        "expected_cash": expected_cash,
+        "closing_balance": shift.closing_balance,
+        "cash_difference": (shift.closing_balance - expected_cash) if shift.closing_balance is not None else None,
+        "reconciled": not discrepancies,
+        "discrepancies": discrepancies or {},
+    })
+    return report
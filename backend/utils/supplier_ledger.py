@@ -0,0 +1,58 @@
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import update, insert, func
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Supplier, SupplierLedger
+
+
+async def post(
+    db: AsyncSession,
+    supplier_id: int,
+    amount: float,
+    entry_type: str,
+    receipt_id: Optional[int] = None,
+    payment_id: Optional[int] = None,
+    created_by: Optional[int] = None,
+    created_at: Optional[datetime] = None
+) -> Optional[float]:
+    """Supplier.balance ni o'zgartirishning yagona yo'li: atomar UPDATE ... RETURNING va hisob yozuvi.
+
+    amount - balansga ta'sir (kirim musbat, to'lov manfiy). Yangi balansni qaytaradi (firma topilmasa - None).
+    """
+    new_balance = await db.scalar(
+        update(Supplier)
+        .where(Supplier.id == supplier_id)
+        .values(balance=func.coalesce(Supplier.balance, 0) + amount)
+        .returning(Supplier.balance)
+        .execution_options(synchronize_session=False)
+    )
+    if new_balance is None:
+        return None
+    # Sessiyada yuklangan firma obyekti eski balansni ko'rsatmasligi uchun
+    loaded = db.sync_session.identity_map.get(db.sync_session.identity_key(Supplier, supplier_id))
+    if loaded is not None:
+        set_committed_value(loaded, "balance", new_balance)
+
+    await db.execute(insert(SupplierLedger).values(
+        supplier_id=supplier_id,
+        entry_type=entry_type,
+        amount=amount,
+        balance_after=new_balance,
+        receipt_id=receipt_id,
+        payment_id=payment_id,
+        created_by=created_by,
+        created_at=created_at or datetime.now(timezone.utc)
+    ))
+    return new_balance
+
+
+def replay(entries: List[dict]) -> List[dict]:
+    """Tarixdan hisobni tiklash (update_db backfill): entries vaqt bo'yicha tartiblangan, balance_after qo'shiladi"""
+    balance = 0.0
+    for entry in entries:
+        balance += entry["amount"]
+        entry["balance_after"] = balance
+    return entries
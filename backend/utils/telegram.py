@@ -24,3 +24,54 @@ async def send_telegram_notification(message: str):
             await client.post(url, json=payload)
     except Exception as e:
         print(f"Telegram notification error: {e}")
+
+
+# --- Rate limit bilan yuborish (broadcast, eslatmalar) ---
+import asyncio
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest,
+    TelegramNetworkError, TelegramServerError
+)
+from utils.rate_limit import TokenBucket, PerChatLimiter
+
+# Telegram: bot uchun ~30 xabar/soniya, bitta chatga ~1 xabar/soniya
+TELEGRAM_RATE_PER_SECOND = float(os.getenv("TELEGRAM_RATE_PER_SECOND", "25"))
+TELEGRAM_MAX_ATTEMPTS = int(os.getenv("TELEGRAM_MAX_ATTEMPTS", "3"))
+
+
+class TelegramSender:
+    """Umumiy token-bucket va chat limiti orqali xabar yuboradi, retry_after ni hurmat qiladi"""
+
+    def __init__(self, rate: float = TELEGRAM_RATE_PER_SECOND, per_chat_interval: float = 1.0,
+                 max_attempts: int = TELEGRAM_MAX_ATTEMPTS):
+        self.bucket = TokenBucket(rate)
+        self.per_chat = PerChatLimiter(per_chat_interval)
+        self.max_attempts = max_attempts
+
+    async def send(self, chat_id: int, send_fn):
+        """send_fn - argumentsiz coroutine funksiya. Qaytaradi: (status, error)
+
+        status: sent, blocked (bot bloklangan), failed
+        """
+        last_error = None
+        for attempt in range(self.max_attempts):
+            await self.per_chat.wait(chat_id)
+            await self.bucket.acquire()
+            try:
+                await send_fn()
+                return "sent", None
+            except TelegramRetryAfter as e:
+                # Barcha yuboruvchilar kutadi, keyin shu xabar qayta yuboriladi
+                self.bucket.pause(e.retry_after)
+                last_error = e
+            except TelegramForbiddenError as e:
+                return "blocked", str(e)[:255]
+            except TelegramBadRequest as e:
+                return "failed", str(e)[:255]
+            except (TelegramNetworkError, TelegramServerError) as e:
+                last_error = e
+                await asyncio.sleep(2 ** attempt)
+        return "failed", str(last_error)[:255] if last_error else None
+
+
+telegram_sender = TelegramSender()
@@ -0,0 +1,137 @@
+import os
+import uuid
+import asyncio
+import hashlib
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import update
+
+from database import SessionLocal, SupplyReceipt
+
+try:
+    import aiofiles  # ixtiyoriy bog'liqlik (pip install aiofiles)
+except ImportError:
+    aiofiles = None
+
+# Nakladnoy yuklash sozlamalari
+MAX_INVOICE_UPLOAD_MB = float(os.getenv("MAX_INVOICE_UPLOAD_MB", "15"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB bo'laklar - fayl xotiraga to'liq o'qilmaydi
+INVOICE_THUMB_SIZE = int(os.getenv("INVOICE_THUMB_SIZE", "320"))  # px, ro'yxatdagi kichik rasm
+INVOICE_PREVIEW_SIZE = int(os.getenv("INVOICE_PREVIEW_SIZE", "1600"))  # px, ko'rish uchun WebP
+INVOICE_WEBP_QUALITY = int(os.getenv("INVOICE_WEBP_QUALITY", "75"))
+
+INVOICE_DIR = "uploads/invoices"
+INVOICE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".heic", ".pdf"}
+
+
+async def _write_chunks(upload: UploadFile, path: str, max_bytes: int) -> Tuple[str, int]:
+    """Faylni bo'laklab diskka yozadi (event loopni bloklamasdan) va sha256 ni shu bilan birga hisoblaydi"""
+    digest = hashlib.sha256()
+    size = 0
+    if aiofiles is not None:
+        f = await aiofiles.open(path, "wb")
+        write, close = f.write, f.close
+    else:
+        f = await asyncio.to_thread(open, path, "wb")
+        write = lambda chunk: asyncio.to_thread(f.write, chunk)
+        close = lambda: asyncio.to_thread(f.close)
+    try:
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Fayl hajmi {MAX_INVOICE_UPLOAD_MB:g} MB dan oshmasligi kerak")
+            digest.update(chunk)
+            await write(chunk)
+    finally:
+        await close()
+    return digest.hexdigest(), size
+
+
+async def save_invoice(upload: UploadFile) -> Tuple[str, str, bool]:
+    """Nakladnoyni saqlash. Fayl nomi - kontent xeshi, shuning uchun bir xil fayl ikki marta saqlanmaydi.
+
+    Qaytaradi: (URL yo'li, disk yo'li, yangi faylmi)
+    """
+    ext = os.path.splitext(upload.filename or "")[1].lower()
+    if ext not in INVOICE_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Faqat rasm yoki PDF yuklash mumkin")
+    max_bytes = int(MAX_INVOICE_UPLOAD_MB * 1024 * 1024)
+    if upload.size is not None and upload.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Fayl hajmi {MAX_INVOICE_UPLOAD_MB:g} MB dan oshmasligi kerak")
+
+    await asyncio.to_thread(os.makedirs, INVOICE_DIR, exist_ok=True)
+    tmp_path = os.path.join(INVOICE_DIR, f".{uuid.uuid4()}.part")
+    try:
+        sha, _ = await _write_chunks(upload, tmp_path, max_bytes)
+        filename = f"{sha}{ext}"
+        path = os.path.join(INVOICE_DIR, filename)
+        is_new = not await asyncio.to_thread(os.path.exists, path)
+        if is_new:
+            await asyncio.to_thread(os.replace, tmp_path, path)
+    finally:
+        if await asyncio.to_thread(os.path.exists, tmp_path):
+            await asyncio.to_thread(os.remove, tmp_path)
+    return f"/uploads/invoices/{filename}", path, is_new
+
+
+def variant_paths(path: str) -> Tuple[str, str]:
+    """(kichik rasm, ko'rish uchun WebP) - asl fayl yonida"""
+    base = os.path.splitext(path)[0]
+    return f"{base}_thumb.webp", f"{base}_preview.webp"
+
+
+def _to_url(path: str) -> str:
+    return "/" + path.replace(os.sep, "/")
+
+
+def existing_variants(path: str) -> Optional[Tuple[str, str]]:
+    """Takroriy fayl uchun avval yaratilgan variantlar (URL), bo'lmasa - None"""
+    variants = variant_paths(path)
+    if all(os.path.exists(p) for p in variants):
+        return tuple(_to_url(p) for p in variants)
+    return None
+
+
+def _render_variants(path: str) -> Optional[Tuple[str, str]]:
+    """Pillow bilan kichik rasm va siqilgan WebP yaratish (CPU ish - threadda chaqiriladi)"""
+    if path.lower().endswith(".pdf"):
+        return None
+    try:
+        from PIL import Image, ImageOps  # ixtiyoriy bog'liqlik (pip install Pillow)
+    except ImportError:
+        print("⚠️ Pillow o'rnatilmagan - nakladnoy uchun kichik rasm yaratilmadi")
+        return None
+    try:
+        with Image.open(path) as img:
+            img = ImageOps.exif_transpose(img)  # telefon rasmlari aylantirilgan holda saqlanadi
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGB")
+            for target, size in zip(variant_paths(path), (INVOICE_THUMB_SIZE, INVOICE_PREVIEW_SIZE)):
+                variant = img.copy()
+                variant.thumbnail((size, size))
+                tmp_target = f"{target}.part"
+                variant.save(tmp_target, format="WEBP", quality=INVOICE_WEBP_QUALITY, method=4)
+                os.replace(tmp_target, target)
+    except Exception as e:
+        # O'qib bo'lmaydigan rasm - asl fayl ko'rsatiladi
+        print(f"❌ Nakladnoy rasmini qayta ishlashda xatolik ({path}): {e}")
+        return None
+    return tuple(_to_url(p) for p in variant_paths(path))
+
+
+async def build_invoice_variants(receipt_id: int, path: str):
+    """Fon vazifa (javob qaytgandan keyin): variantlarni yaratib, kirim yozuviga biriktiradi"""
+    variants = await asyncio.to_thread(_render_variants, path)
+    if not variants:
+        return
+    try:
+        async with SessionLocal() as db:
+            await db.execute(
+                update(SupplyReceipt)
+                .where(SupplyReceipt.id == receipt_id)
+                .values(invoice_thumbnail=variants[0], invoice_preview=variants[1])
+            )
+            await db.commit()
+    except Exception as e:
+        print(f"❌ Nakladnoy variantlarini saqlashda xatolik: {e}")
@@ -13,6 +13,11 @@ api.interceptors.request.use(
         if (token) {
             config.headers.Authorization = `Bearer ${token}`;
         }
+        // Replika bo'lsa: yaqinda yozgan bo'lsak, server o'qishni asosiy bazadan qiladi (qaysi worker bo'lmasin)
+        const lastWrite = localStorage.getItem('lastWrite');
+        if (lastWrite) {
+            config.headers['X-Last-Write'] = lastWrite;
+        }
         return config;
     },
     (error) => {
@@ -22,7 +27,13 @@ api.interceptors.request.use(
 
 // Add a response interceptor to handle 401 errors
 api.interceptors.response.use(
-    (response) => response,
+    (response) => {
+        const lastWrite = response.headers['x-last-write'];
+        if (lastWrite) {
+            localStorage.setItem('lastWrite', lastWrite);
+        }
+        return response;
+    },
     (error) => {
         if (error.response?.status === 401) {
             // Clear stored auth data
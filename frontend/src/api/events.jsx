@@ -0,0 +1,69 @@
+import { useEffect, useRef } from 'react';
+import api, { API_URL } from './axios';
+
+const EVENT_TYPES = ['sale', 'refund', 'expense', 'debt_payment'];
+const MAX_RETRY_MS = 30000;
+
+// /events/stream ga ulanadi va hodisalarni handlers[type] ga beradi.
+// Token URL ga qo'yilmaydi: har ulanishdan oldin qisqa muddatli chipta olinadi (POST /events/ticket).
+// Uzilishdan keyin qayta ulanganda o'tkazib yuborilgan hodisalar bo'lishi mumkin - handlers.resync chaqiriladi.
+export const useLiveEvents = (handlers, enabled = true) => {
+    const handlersRef = useRef(handlers);
+    useEffect(() => {
+        handlersRef.current = handlers;
+    });
+
+    useEffect(() => {
+        if (!enabled) return undefined;
+        let source = null;
+        let timer = null;
+        let stopped = false;
+        let connected = false;
+        let retryMs = 1000;
+
+        const call = (type, data) => {
+            const handler = handlersRef.current?.[type];
+            if (handler) handler(data);
+        };
+
+        const reconnect = () => {
+            if (source) source.close();
+            source = null;
+            if (stopped) return;
+            timer = setTimeout(connect, retryMs);
+            retryMs = Math.min(retryMs * 2, MAX_RETRY_MS);
+        };
+
+        const connect = async () => {
+            let ticket;
+            try {
+                // Token muddati tugagan bo'lsa 401 -> axios interceptor login sahifasiga olib o'tadi
+                ticket = (await api.post('/events/ticket')).data.ticket;
+            } catch {
+                reconnect();
+                return;
+            }
+            if (stopped) return;
+            source = new EventSource(`${API_URL}/events/stream?ticket=${encodeURIComponent(ticket)}`);
+            source.addEventListener('ready', () => {
+                retryMs = 1000;
+                if (connected) call('resync', {});
+                connected = true;
+            });
+            source.addEventListener('resync', () => call('resync', {}));
+            source.addEventListener('expired', reconnect);
+            EVENT_TYPES.forEach((type) => {
+                source.addEventListener(type, (e) => call(type, JSON.parse(e.data)));
+            });
+            // Brauzer o'zi eski chipta bilan qayta ulanmasin - yangi chipta olamiz
+            source.onerror = reconnect;
+        };
+
+        connect();
+        return () => {
+            stopped = true;
+            clearTimeout(timer);
+            if (source) source.close();
+        };
+    }, [enabled]);
+};
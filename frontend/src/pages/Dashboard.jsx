@@ -4,6 +4,8 @@ import { Link } from 'react-router-dom';
 import { Card, CardContent, CardHeader, CardTitle, CardDescription } from "@/components/ui/card";
 import { useQuery } from '@tanstack/react-query';
 import api from '../api/axios';
+import { queryClient } from '../api/queryClient';
+import { useLiveEvents } from '../api/events';
 import {
     Users,
     Package,
@@ -22,6 +24,47 @@ import TopProducts from '../components/TopProducts';
 import { Button } from "@/components/ui/button";
 import { Badge } from "@/components/ui/badge";
 
+const formatSum = (value) => `${Math.round(value || 0).toLocaleString('en-US')} so'm`;
+
+// Hodisa vaqti UTC (/finance/stats va dashboard-chart kunlari ham UTC bo'yicha)
+const utcDay = (iso) => (iso || '').slice(0, 10);
+
+const matchesEmployee = (employeeId, actorId) =>
+    !employeeId || employeeId === 'all' || String(employeeId) === String(actorId);
+
+// SSE deltasini keshdagi barcha dashboard so'rovlariga qo'llash (filtrlar mos kelsa)
+const applyToStats = (day, actorId, apply) => {
+    queryClient.getQueryCache().findAll({ queryKey: ['dashboard-stats'] }).forEach(({ queryKey }) => {
+        const f = queryKey[1] || {};
+        if (f.start_date && day < f.start_date) return;
+        if (f.end_date && day > f.end_date) return;
+        if (!matchesEmployee(f.employee_id, actorId)) return;
+        queryClient.setQueryData(queryKey, (old) => {
+            if (!old) return old;
+            const next = apply({ ...old });
+            return {
+                ...next,
+                dailySalesFormatted: formatSum(next.dailySales),
+                netProfitFormatted: formatSum(next.netProfit)
+            };
+        });
+    });
+};
+
+const applyToChart = (day, actorId, amount) => {
+    const label = `${day.slice(8, 10)}.${day.slice(5, 7)}`;
+    queryClient.getQueryCache().findAll({ queryKey: ['dashboard-chart'] }).forEach(({ queryKey }) => {
+        if (!matchesEmployee(queryKey[1], actorId)) return;
+        queryClient.setQueryData(queryKey, (old) => {
+            const index = old?.labels?.indexOf(label) ?? -1;
+            if (index < 0) return old;
+            const data = [...old.data];
+            data[index] += amount;
+            return { ...old, data };
+        });
+    });
+};
+
 const Dashboard = () => {
     const today = new Date().toISOString().split('T')[0];
     const role = localStorage.getItem('role');
@@ -40,6 +83,36 @@ const Dashboard = () => {
         enabled: role === 'admin'
     });
 
+    // Savdo/qaytarish/xarajat deltalari SSE orqali keladi - hisobotlarni qayta so'ramaymiz
+    const onSaleDelta = (event) => {
+        const day = utcDay(event.created_at);
+        applyToStats(day, event.cashier_id, (s) => {
+            s.dailySales = (s.dailySales || 0) + event.sales;
+            if (role === 'admin' && event.cost !== undefined) {
+                s.totalCost = (s.totalCost || 0) + event.cost;
+                s.netProfit = (s.netProfit || 0) + event.sales - event.cost;
+            }
+            return s;
+        });
+        applyToChart(day, event.cashier_id, event.sales);
+    };
+
+    useLiveEvents({
+        sale: onSaleDelta,
+        refund: onSaleDelta,
+        expense: (event) => {
+            applyToStats(utcDay(event.created_at), event.created_by, (s) => {
+                s.totalExpenses = (s.totalExpenses || 0) + event.amount;
+                if (role === 'admin') s.netProfit = (s.netProfit || 0) - event.amount;
+                return s;
+            });
+        },
+        resync: () => {
+            queryClient.invalidateQueries({ queryKey: ['dashboard-stats'] });
+            queryClient.invalidateQueries({ queryKey: ['dashboard-chart'] });
+        }
+    });
+
     const { data: stats, isLoading, error } = useQuery({
         queryKey: ['dashboard-stats', filters],
         queryFn: async () => {
@@ -2,6 +2,7 @@ import React, { useState, useEffect, useRef } from 'react';
 import { useQuery, useMutation } from '@tanstack/react-query';
 import api from '../api/axios';
 import { queryClient } from '../api/queryClient';
+import { useLiveEvents } from '../api/events';
 import {
     Search,
     ShoppingCart,
@@ -51,6 +52,8 @@ const POS = () => {
     const [isPaymentModalOpen, setIsPaymentModalOpen] = useState(false);
     const [paymentAmounts, setPaymentAmounts] = useState({ cash: '', card: '', perevod: '', qarz: '' });
     const [selectedClient, setSelectedClient] = useState(null);
+    const [clientSearch, setClientSearch] = useState('');
+    const [clientQuery, setClientQuery] = useState('');
     const [isFullscreen, setIsFullscreen] = useState(false);
     const [isShiftModalOpen, setIsShiftModalOpen] = useState(false);
     const [shiftBalance, setShiftBalance] = useState('');
@@ -71,6 +74,35 @@ const POS = () => {
         }
     });
 
+    // Smena jamlari SSE deltalari bilan yangilanadi (/pos/shifts/active qayta so'ralmaydi)
+    const applyToShift = (shiftId, apply) => {
+        queryClient.setQueryData(['active-shift'], (old) => (old && old.id === shiftId ? apply({ ...old }) : old));
+    };
+
+    useLiveEvents({
+        sale: (event) => applyToShift(event.shift_id, (s) => ({
+            ...s,
+            total_cash: (s.total_cash || 0) + event.shift_cash,
+            total_card: (s.total_card || 0) + event.shift_card,
+            total_debt: (s.total_debt || 0) + event.shift_debt,
+            sales_count: (s.sales_count || 0) + 1,
+            sales_total: (s.sales_total || 0) + event.sales
+        })),
+        refund: (event) => applyToShift(event.shift_id, (s) => ({
+            ...s,
+            total_cash: (s.total_cash || 0) + event.shift_cash,
+            total_card: (s.total_card || 0) + event.shift_card,
+            total_debt: (s.total_debt || 0) + event.shift_debt,
+            refunds_total: (s.refunds_total || 0) - event.sales
+        })),
+        debt_payment: (event) => applyToShift(event.shift_id, (s) => ({
+            ...s,
+            debt_collected: (s.debt_collected || 0) + event.amount,
+            debt_collected_cash: (s.debt_collected_cash || 0) + (event.payment_method === 'cash' ? event.amount : 0)
+        })),
+        resync: () => queryClient.invalidateQueries({ queryKey: ['active-shift'] })
+    }, !!activeShift);
+
     // Auto-open shift modal if cashier has no active shift
     useEffect(() => {
         if (!isShiftLoading && !activeShift && role === 'cashier') {
@@ -132,14 +164,34 @@ const POS = () => {
         }
     });
 
-    // Fetch Clients
-    const { data: clients = [] } = useQuery({
-        queryKey: ['clients'],
+    // Mijoz qidirish: butun jadval yuklanmaydi, yozish to'xtagach typeahead (ko'pi bilan 20 ta)
+    useEffect(() => {
+        const timer = setTimeout(() => setClientQuery(clientSearch.trim()), 250);
+        return () => clearTimeout(timer);
+    }, [clientSearch]);
+
+    const { data: clientMatches = [] } = useQuery({
+        queryKey: ['clients-typeahead', clientQuery],
         queryFn: async () => {
-            const res = await api.get('/crm/clients');
+            const res = await api.get('/crm/clients/typeahead', { params: { q: clientQuery } });
             return res.data;
-        }
+        },
+        enabled: clientQuery.length > 0,
+        staleTime: 30000
+    });
+
+    // Tanlangan mijoz (bonus balansi uchun)
+    const { data: selectedClientData } = useQuery({
+        queryKey: ['client', selectedClient],
+        queryFn: async () => {
+            const res = await api.get(`/crm/clients/${selectedClient}`);
+            return res.data;
+        },
+        enabled: !!selectedClient
     });
+    const clientOptions = selectedClientData && !clientMatches.some(c => c.id === selectedClientData.id)
+        ? [selectedClientData, ...clientMatches]
+        : clientMatches;
 
     // Fetch Settings
     const { data: settings } = useQuery({
@@ -150,11 +202,21 @@ const POS = () => {
         }
     });
 
+    // Idempotency key: bitta savat uchun bitta kalit, qayta urinishlar ikki marta sotmaydi
+    const checkoutKeyRef = useRef(null);
+    useEffect(() => {
+        checkoutKeyRef.current = null;
+    }, [cart]);
+
     // Sale Mutation
     const saleMutation = useMutation({
-        mutationFn: (data) => api.post('/sales/', data),
+        mutationFn: ({ data, key }) => api.post('/sales/', data, { headers: { 'Idempotency-Key': key } }),
+        // Faqat tarmoq xatolarida (javob kelmagan) qayta urinamiz
+        retry: (failureCount, err) => !err.response && failureCount < 3,
+        retryDelay: (attempt) => Math.min(500 * 2 ** attempt, 4000),
         onSuccess: () => {
             toast.success("Sotuv amalga oshirildi!");
+            checkoutKeyRef.current = null;
             setCart([]);
             setIsPaymentModalOpen(false);
             setPaymentAmounts({ cash: '', card: '', perevod: '', qarz: '' });
@@ -163,6 +225,7 @@ const POS = () => {
             queryClient.invalidateQueries({ queryKey: ['sales-history'] });
             queryClient.invalidateQueries({ queryKey: ['finance-stats'] });
             queryClient.invalidateQueries({ queryKey: ['dashboard-stats'] });
+            queryClient.invalidateQueries({ queryKey: ['client'] });
         },
         onError: (err) => {
             const responseData = err.response?.data;
@@ -251,7 +314,7 @@ const POS = () => {
     };
 
     const cartTotal = Math.round(cart.reduce((sum, item) => sum + (item.price * item.quantity), 0));
-    const bonusBalance = clients.find(c => c.id === selectedClient)?.bonus_balance || 0;
+    const bonusBalance = (selectedClient && selectedClientData?.bonus_balance) || 0;
     const bonusEarned = Math.floor((cartTotal - (Number(paymentAmounts.qarz) || 0)) * (settings?.bonus_percentage || 1) / 100);
     const totalPaid = Number(paymentAmounts.cash) + Number(paymentAmounts.card) + Number(paymentAmounts.perevod) + Number(paymentAmounts.qarz) + Number(bonusSpent);
 
@@ -305,7 +368,10 @@ const POS = () => {
             debt_amount: Number(paymentAmounts.qarz) || 0,
             bonus_spent: Number(bonusSpent) || 0
         };
-        saleMutation.mutate(saleData);
+        if (!checkoutKeyRef.current) {
+            checkoutKeyRef.current = crypto.randomUUID();
+        }
+        saleMutation.mutate({ data: saleData, key: checkoutKeyRef.current });
     };
 
     // Filtered Products
@@ -690,6 +756,12 @@ const POS = () => {
                 </Badge>
             )}
                                 </div>
+                                <Input
+                                    value={clientSearch}
+                                    onChange={(e) => setClientSearch(e.target.value)}
+                                    placeholder="Ism yoki telefon bo'yicha qidirish"
+                                    className="h-10 mb-2 bg-white border-slate-200"
+                                />
                                 <Select
                                     value={selectedClient?.toString()}
                                     onValueChange={(val) => setSelectedClient(val === "null" ? null : parseInt(val))}
@@ -699,7 +771,7 @@ const POS = () => {
                                     </SelectTrigger>
                                     <SelectContent>
                                         <SelectItem value="null">Tanlanmagan</SelectItem>
-                                        {clients.map(c => (
+                                        {clientOptions.map(c => (
                                             <SelectItem key={c.id} value={c.id.toString()}>
                                                 {c.name} {c.phone ? `(${c.phone})` : ''}
                                             </SelectItem>
@@ -308,9 +308,9 @@ const Suppliers = () => {
                                         </div>
                                     </div>
                                     {item.image && (
-                                        <a href={`${API_URL}${item.image}`} target="_blank" rel="noreferrer" className="shrink-0 bg-white border p-1 rounded-lg hover:shadow-md transition-all">
+                                        <a href={`${API_URL}${item.preview || item.image}`} target="_blank" rel="noreferrer" className="shrink-0 bg-white border p-1 rounded-lg hover:shadow-md transition-all">
                                             <div className="relative group">
-                                                <img src={`${API_URL}${item.image}`} alt="Nakladnoy" className="w-16 h-16 object-cover rounded shadow-inner" />
+                                                <img src={`${API_URL}${item.thumbnail || item.image}`} alt="Nakladnoy" loading="lazy" className="w-16 h-16 object-cover rounded shadow-inner" />
                                                 <div className="absolute inset-0 bg-black/40 opacity-0 group-hover:opacity-100 flex items-center justify-center transition-opacity rounded">
                                                     <Eye className="h-5 w-5 text-white" />
                                                 </div>
@@ -0,0 +1,101 @@
+import os
+import sys
+import asyncio
+import tempfile
+from datetime import datetime, timedelta
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{TMP_DIR}/test.db")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:ABCDEFabcdefABCDEF")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from database import Base, Client, ClientLedger
+from utils.client_ledger import _close_lots, _debt_change, post, replay
+
+
+def _lots(*amounts_and_sales):
+    return [{"id": n, "open_amount": amount, "sale_id": sale_id} for n, (amount, sale_id) in enumerate(amounts_and_sales, 1)]
+
+
+def test_payment_closes_oldest_debt_first():
+    lots = _lots((100.0, 1), (200.0, 2), (300.0, 3))
+    changed = _close_lots(lots, 250.0)
+    assert [lot["id"] for lot in changed] == [1, 2]
+    assert [lot["open_amount"] for lot in lots] == [0.0, 50.0, 300.0]
+
+
+def test_refund_closes_its_own_sale_debt_first():
+    lots = _lots((100.0, 1), (200.0, 2), (300.0, 3))
+    changed = _close_lots(lots, 350.0, sale_id=3)
+    # Avval 3-savdo qarzi (300), qolgan 50 - eng eskisidan
+    assert [lot["id"] for lot in changed] == [3, 1]
+    assert {lot["id"]: lot["open_amount"] for lot in lots} == {1: 50.0, 2: 200.0, 3: 0.0}
+
+
+def test_prepayment_absorbs_new_debt():
+    # Balans +500 (oldindan to'lov): 300 lik qarzga savdo yangi qarz ochmaydi
+    assert _debt_change(500.0, -300.0) == (0.0, 0.0)
+    # 700 lik savdo: faqat to'lovdan oshgan 200 qarz bo'ladi
+    assert _debt_change(500.0, -700.0) == (200.0, 0.0)
+    # Qarz -400, 600 to'lov: 400 yopiladi, ortig'i oldindan to'lovga o'tadi
+    assert _debt_change(-400.0, 600.0) == (0.0, 400.0)
+
+
+async def _post_history(db, history, start):
+    client = Client(name="Mijoz", balance=0, bonus_balance=0)
+    db.add(client)
+    await db.flush()
+    for n, (amount, entry_type, sale_id) in enumerate(history):
+        await post(db, client.id, amount, entry_type, sale_id=sale_id, created_at=start + timedelta(hours=n))
+    return client.id
+
+
+async def check_replay_matches_post():
+    engine = create_async_engine(f"sqlite+aiosqlite:///{TMP_DIR}/ledger.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    start = datetime(2026, 1, 1, 9, 0)
+    # (balansga ta'sir, turi, savdo) -> kutilgan ochiq qarzlar
+    cases = [
+        # Ikki qarz, 2-savdoni qisman qaytarish (o'z qarzini yopadi), to'lov (eng eskisini yopadi)
+        ([(-300.0, "sale", 1), (-200.0, "sale", 2), (150.0, "refund", 2), (100.0, "payment", None)],
+         [200.0, 50.0, 0.0, 0.0]),
+        # Oldindan to'lov keyingi savdoni yutadi, undan oshgani qarz bo'ladi
+        ([(500.0, "payment", None), (-300.0, "sale", 3), (-400.0, "sale", 4)],
+         [0.0, 0.0, 200.0]),
+    ]
+    async with AsyncSession(engine, expire_on_commit=False) as db:
+        client_ids = [await _post_history(db, history, start) for history, _ in cases]
+        await db.commit()
+
+        for client_id, (history, expected_open) in zip(client_ids, cases):
+            balance = await db.scalar(select(Client.balance).where(Client.id == client_id))
+            rows = (await db.execute(
+                select(ClientLedger).where(ClientLedger.client_id == client_id).order_by(ClientLedger.id)
+            )).scalars().all()
+            entries = replay([
+                {"created_at": row.created_at, "entry_type": row.entry_type, "amount": row.amount, "sale_id": row.sale_id}
+                for row in rows
+            ])
+
+            assert balance == sum(amount for amount, _, _ in history)
+            assert entries[-1]["balance_after"] == balance
+            assert [e["balance_after"] for e in entries] == [row.balance_after for row in rows]
+            assert [e["open_amount"] for e in entries] == [row.open_amount for row in rows] == expected_open
+    await engine.dispose()
+
+
+def test_replay_matches_post():
+    asyncio.run(check_replay_matches_post())
+
+
+if __name__ == "__main__":
+    test_payment_closes_oldest_debt_first()
+    test_refund_closes_its_own_sale_debt_first()
+    test_prepayment_absorbs_new_debt()
+    test_replay_matches_post()
+    print("OK: mijoz hisobi (FIFO, qaytarish, oldindan to'lov) va replay bir xil")
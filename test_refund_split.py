@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+
+# Faqat sof hisob-kitob funksiyalari tekshiriladi - baza kerak emas (modullar import paytida DATABASE_URL o'qiydi)
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/test.db")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:ABCDEFabcdefABCDEF")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from routers.sales import _split, _refund_portion
+
+# Aralash to'lov: naqd + karta + o'tkazma + qarz, bonus bilan (summalar qoldiqsiz bo'linmaydi)
+ORIGINAL = {
+    "amount": 100_000.0,
+    "cash_amount": 33_333.0,
+    "card_amount": 25_000.0,
+    "transfer_amount": 11_667.0,
+    "debt_amount": 30_000.0,
+    "bonus_amount": 1_000.0,
+}
+# Chek qatorlari: (miqdor, narx)
+LINES = {1: (3, 7_000.0), 2: (7, 9_000.0), 3: (1, 16_000.0)}
+
+
+def _refund(requested: dict, refunded: dict, prev: dict) -> dict:
+    """refund_sale dagi kabi: qaytarish ulushi va qatorlarga bo'lingan summalar (RefundItem qatorlari)"""
+    line_ids = list(requested)
+    values = [requested[i] * LINES[i][1] for i in line_ids]
+    total_value = sum(qty * price for qty, price in LINES.values())
+    final = all(qty - refunded.get(i, 0) - requested.get(i, 0) <= 1e-9 for i, (qty, _) in LINES.items())
+    portion = _refund_portion(ORIGINAL, prev, sum(values) / total_value, final)
+    shares = {field: _split(portion[field], values) for field in ORIGINAL}
+    return [{field: shares[field][n] for field in ORIGINAL} for n in range(len(line_ids))]
+
+
+def _sums(rows: list) -> dict:
+    return {field: sum(row[field] for row in rows) for field in ORIGINAL}
+
+
+def test_split_sums_to_total():
+    parts = _split(1_000.0, [1.0, 1.0, 1.0])
+    assert len(parts) == 3
+    assert sum(parts) == 1_000.0
+    assert parts[0] == parts[1] == 1_000.0 / 3
+
+
+def test_split_zero_weights_divides_evenly():
+    assert _split(90.0, [0.0, 0.0, 0.0]) == [30.0, 30.0, 30.0]
+    assert _split(90.0, []) == []
+
+
+def test_partial_refund_is_proportional():
+    # Qator 2 dan 2 dona: 18 000 / 100 000 = 18% - har bir to'lov turidan 18%
+    rows = _refund({2: 2}, {}, {field: 0.0 for field in ORIGINAL})
+    portion = _sums(rows)
+    for field, value in ORIGINAL.items():
+        assert abs(portion[field] - value * 0.18) < 1e-6, field
+
+
+def test_partial_then_final_refund_sums_to_original():
+    # Bittadan qaytarish: ulushlar yig'indisi float xatosi to'playdi, oxirgi qaytarish uni aynan yopishi kerak
+    refunded = {}
+    rows = []
+    for requested in [{2: 1}] * 7 + [{1: 1}] * 3 + [{3: 1}]:
+        rows += _refund(requested, refunded, _sums(rows))
+        for line_id, qty in requested.items():
+            refunded[line_id] = refunded.get(line_id, 0) + qty
+
+    totals = _sums(rows)
+    for field, value in ORIGINAL.items():
+        assert totals[field] == value, (field, totals[field], value)
+
+
+if __name__ == "__main__":
+    test_split_sums_to_total()
+    test_split_zero_weights_divides_evenly()
+    test_partial_refund_is_proportional()
+    test_partial_then_final_refund_sums_to_original()
+    print("OK: qaytarish summalari to'lov turlariga to'g'ri bo'lindi")
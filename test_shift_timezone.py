@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{TMP_DIR}/test.db")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:ABCDEFabcdefABCDEF")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import httpx
+from sqlalchemy import text
+
+
+@contextmanager
+def _tashkent_server():
+    """Server UTC da bo'lmasa ham (Toshkent, UTC+5) smena oynasi va offline savdo vaqti bir xil soatda solishtirilishi kerak.
+    TZ va ishchi papka (uploads, zaxira nusxalar) faqat shu test davomida o'zgaradi"""
+    old_tz, old_cwd = os.environ.get("TZ"), os.getcwd()
+    os.environ["TZ"] = "Asia/Tashkent"
+    time.tzset()
+    os.chdir(TMP_DIR)
+    try:
+        yield
+    finally:
+        os.chdir(old_cwd)
+        if old_tz is None:
+            os.environ.pop("TZ", None)
+        else:
+            os.environ["TZ"] = old_tz
+        time.tzset()
+
+
+async def _login(client, username):
+    r = await client.post("/auth/token", data={"username": username, "password": "123"})
+    return {"Authorization": "Bearer " + r.json()["access_token"]}
+
+
+async def check_shift_timezone():
+    import main
+    import update_db
+    from core import get_password_hash
+    from database import engine, Base, init_db, SessionLocal, Employee
+
+    # Test id larga tayanadi (xodim 1-2, smena 1) - vaqtinchalik bazani toza holatdan boshlaymiz
+    if engine.url.get_backend_name() != "sqlite" or not (engine.url.database or "").startswith(tempfile.gettempdir()):
+        raise RuntimeError(f"Test faqat vaqtinchalik SQLite bazada ishlaydi: {engine.url}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await init_db()
+    async with SessionLocal() as db:
+        db.add(Employee(username="admin", hashed_password=get_password_hash("123"), role="admin", permissions="all", full_name="Admin"))
+        db.add(Employee(username="kassir", hashed_password=get_password_hash("123"), role="cashier", permissions="pos", full_name="Kassir"))
+        await db.commit()
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+    admin, cashier = await _login(client, "admin"), await _login(client, "kassir")
+    await client.post("/inventory/categories", json={"name": "Test"}, headers=admin)
+    await client.post("/inventory/products", json={"name": "P", "barcode": "12345678", "buy_price": 1, "sell_price": 10, "stock": 100, "category_id": 1}, headers=admin)
+
+    # 1. Smena vaqti UTC da yoziladi
+    r = await client.post("/pos/shifts/open", json={"opening_balance": 0}, headers=cashier)
+    opened_at = datetime.fromisoformat(r.json()["opened_at"].rstrip("Z"))
+    utc_now = datetime.now(timezone.utc).replace(tzinfo=None)
+    assert abs((utc_now - opened_at).total_seconds()) < 60, f"opened_at UTC emas: {opened_at} (UTC {utc_now})"
+
+    # 2. Yopilgan smena oynasidagi offline savdo o'sha smenaga tushadi (hozir ochiq smenaga emas)
+    async with SessionLocal() as db:
+        await db.execute(text("UPDATE shifts SET opened_at = :t"), {"t": utc_now - timedelta(minutes=30)})
+        await db.commit()
+    await client.post("/pos/shifts/close", json={"closing_balance": 10}, headers=cashier)
+    await client.post("/pos/shifts/open", json={"opening_balance": 0}, headers=cashier)
+    sale_time = (datetime.now(timezone.utc) - timedelta(minutes=10)).isoformat()
+    r = await client.post("/sales/sync", json={"sales": [{
+        "client_uuid": "6f1c1f7e-1111-4e2a-9c8e-3a2b1c0d9e81", "created_at": sale_time,
+        "total_amount": 10, "payment_method": "cash", "cash_amount": 10,
+        "items": [{"product_id": 1, "quantity": 1, "price": 10}]
+    }]}, headers=cashier)
+    assert r.json()["applied"] == 1
+    async with SessionLocal() as db:
+        shift_id = (await db.execute(text("SELECT shift_id FROM sales"))).scalar()
+    assert shift_id == 1, f"Offline savdo noto'g'ri smenaga tushdi: {shift_id}"
+
+    # 3. Mahalliy vaqtda yozilgan eski smena bir marta UTC ga o'giriladi
+    async with SessionLocal() as db:
+        await db.execute(text(
+            "INSERT INTO shifts (cashier_id, opening_balance, opened_at, closed_at, status, utc_times) "
+            "VALUES (2, 0, '2026-01-01 15:00:00', '2026-01-01 20:00:00', 'closed', 0)"
+        ))
+        await db.commit()
+    await update_db.update_db()
+    await update_db.update_db()
+    async with SessionLocal() as db:
+        row = (await db.execute(text("SELECT opened_at, closed_at FROM shifts WHERE id = 3"))).one()
+    assert str(row[0]).startswith("2026-01-01 10:00:00") and str(row[1]).startswith("2026-01-01 15:00:00"), row
+
+    await client.aclose()
+    print("OK: smena vaqtlari UTC da, offline savdo o'z smenasiga tushdi")
+
+
+def test_shift_timezone():
+    with _tashkent_server():
+        asyncio.run(check_shift_timezone())
+
+
+if __name__ == "__main__":
+    test_shift_timezone()